@@ -0,0 +1,309 @@
+"""Offline handler benchmarks
+
+Drives the bot's handlers with synthetic updates against a fake Telegram
+Bot API, so nothing leaves the machine. Each user count runs in its own
+process, in a temporary working directory seeded with that many users.
+
+    python bench.py                          # 1k, 100k and 1M users
+    python bench.py --users 1000 --latency-ms 30 --iterations 500
+    python bench.py --backend sqlite --json results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import itertools
+import subprocess
+import statistics
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ADMIN_ID = 1
+HANDLERS = (
+    'start', 'send_menu', 'handle_location_selection',
+    'handle_drink_rating', 'handle_service_rating', 'handle_broadcast_text',
+)
+
+
+def make_request_class():
+    from telegram.request import BaseRequest
+
+    class FakeRequest(BaseRequest):
+        """Bot API stand-in that answers every method after a fixed delay"""
+
+        def __init__(self, latency):
+            self.latency = latency
+            self.calls = 0
+            self._message_ids = itertools.count(1000)
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None):
+            self.calls += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            name = url.rsplit('/', 1)[-1]
+            params = request_data.parameters if request_data else {}
+            message = {
+                'message_id': next(self._message_ids),
+                'date': 0,
+                'chat': {'id': int(params.get('chat_id') or 1), 'type': 'private'},
+            }
+            photo = [{'file_id': f"F{message['message_id']}", 'file_unique_id': 'u', 'width': 1, 'height': 1}]
+            if name == 'getMe':
+                result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+            elif name == 'sendPhoto':
+                result = dict(message, photo=photo)
+            elif name == 'sendMediaGroup':
+                media = params['media']
+                if isinstance(media, str):
+                    media = json.loads(media)
+                result = [dict(message, photo=photo) for _ in media]
+            elif name in ('answerCallbackQuery', 'setWebhook', 'deleteWebhook'):
+                result = True
+            else:
+                result = message
+            return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+    return FakeRequest
+
+
+def seed_users(path, count, locations, seed=0):
+    """Write a users_data.json snapshot with count users, a third of them with ratings"""
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{')
+        for i in range(count):
+            user_id = 1000 + i
+            user = {'username': f'user{user_id}', 'first_name': 'Bench', 'last_name': str(user_id)}
+            if i % 3 == 0:
+                user['ratings'] = [{
+                    'location': rng.choice(locations),
+                    'drink_rating': rng.randint(1, 5),
+                    'service_rating': rng.randint(1, 5),
+                }]
+            f.write(('' if i == 0 else ',') + json.dumps(str(user_id)) + ':')
+            f.write(json.dumps(user, ensure_ascii=False, separators=(',', ':')))
+        f.write('}')
+
+
+def message_update(bot, user_id, text, update_id):
+    from telegram import Update
+    data = {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench', 'username': f'user{user_id}'},
+            'text': text,
+        },
+    }
+    if text.startswith('/'):
+        data['message']['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return Update.de_json(data, bot)
+
+
+def callback_update(bot, user_id, data, update_id):
+    from telegram import Update
+    return Update.de_json({
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': 'bench',
+            'data': data,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+            'message': {'message_id': update_id, 'date': 0, 'chat': {'id': user_id, 'type': 'private'}, 'text': '-'},
+        },
+    }, bot)
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def run_scenario(bot_module, application, users, iterations, seed, trace):
+    """Run every benchmarked handler iterations times, return {name: samples}"""
+    from telegram.ext import CallbackContext
+    import messages as msg
+
+    bot = application.bot
+    rng = random.Random(seed)
+    update_ids = itertools.count(1)
+    samples = {name: [] for name in HANDLERS}
+
+    async def measure(name, handler, update, user_id):
+        context = CallbackContext(application, chat_id=user_id, user_id=user_id)
+        if trace:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            await handler(update, context)
+            current, peak = tracemalloc.get_traced_memory()
+            samples[name].append((current - before, peak - before))
+        else:
+            started = time.perf_counter_ns()
+            await handler(update, context)
+            samples[name].append(time.perf_counter_ns() - started)
+
+    for _ in range(iterations):
+        user_id = 1000 + rng.randrange(users) if users else 1000
+        location = rng.choice(bot_module.location_registry.names())
+
+        await measure('start', bot_module.start, message_update(bot, user_id, '/start', next(update_ids)), user_id)
+        await measure('send_menu', bot_module.send_menu,
+                      message_update(bot, user_id, msg.BUTTON_MENU, next(update_ids)), user_id)
+        await measure('handle_location_selection', bot_module.handle_location_selection,
+                      message_update(bot, user_id, location, next(update_ids)), user_id)
+        await measure('handle_drink_rating', bot_module.handle_drink_rating,
+                      callback_update(bot, user_id, f'rate_drink_{rng.randint(1, 5)}', next(update_ids)), user_id)
+        await measure('handle_service_rating', bot_module.handle_service_rating,
+                      callback_update(bot, user_id, f'rate_service_{rng.randint(1, 5)}', next(update_ids)), user_id)
+
+        await measure('handle_broadcast_text', bot_module.handle_broadcast_text,
+                      message_update(bot, ADMIN_ID, 'Benchmark broadcast', next(update_ids)), ADMIN_ID)
+        # Сама рассылка не измеряется: останавливаем её сразу после ответа обработчика
+        for job in list(bot_module.broadcasts.jobs.values()):
+            await bot_module.broadcasts.cancel(job.job_id)
+
+    return samples
+
+
+async def run_single(args):
+    from telegram import Bot
+    from telegram.ext import Application
+    import logging
+    import bot as bot_module
+
+    # INFO-логи каждого обработчика мешают читать отчёт
+    logging.getLogger().setLevel(logging.WARNING)
+
+    request = make_request_class()(args.latency_ms / 1000)
+    bot = Bot('123456:bench', request=request, get_updates_request=request)
+    application = Application.builder().bot(bot).build()
+
+    # Первая загрузка переносит users_data.json в формат бэкенда, вторая — обычный запуск
+    started = time.perf_counter()
+    bot_module.load_users_data()
+    migrate_seconds = time.perf_counter() - started
+    bot_module.save_users_data()
+    started = time.perf_counter()
+    bot_module.load_users_data()
+    load_seconds = time.perf_counter() - started
+    bot_module.image_cache.warm(bot_module.MENU_PAGES)
+
+    await application.initialize()
+    bot_module.storage_writer.start()
+    try:
+        # Прогрев: первые вызовы заполняют кэши клавиатур, изображений и file_id
+        await run_scenario(bot_module, application, args.users, min(5, args.iterations), args.seed + 1, False)
+        latencies = await run_scenario(bot_module, application, args.users, args.iterations, args.seed, False)
+
+        tracemalloc.start()
+        allocations = await run_scenario(
+            bot_module, application, args.users, max(1, args.iterations // 10), args.seed + 2, True
+        )
+        tracemalloc.stop()
+
+        await bot_module.broadcasts.shutdown()
+    finally:
+        await bot_module.storage_writer.stop()
+        bot_module.save_users_data()
+        await application.shutdown()
+
+    results = {}
+    for name in HANDLERS:
+        results[name] = {
+            'p50_ms': percentile(latencies[name], 0.50) / 1e6,
+            'p99_ms': percentile(latencies[name], 0.99) / 1e6,
+            'net_kib': statistics.mean(net for net, _ in allocations[name]) / 1024,
+            'peak_kib': max(peak for _, peak in allocations[name]) / 1024,
+        }
+    return {'users': args.users, 'backend': args.backend, 'migrate_s': migrate_seconds, 'load_s': load_seconds,
+            'handlers': results}
+
+
+def single(args):
+    """Run one user count inside a temporary working directory"""
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    for name in ('welcome.jpg', 'menu1.jpg', 'menu2.jpg', 'menu3.jpg'):
+        source = os.path.join(HERE, name)
+        if os.path.exists(source):
+            os.symlink(source, os.path.join(workdir, name))
+    os.chdir(workdir)
+    sys.path.insert(0, HERE)
+
+    os.environ.update({
+        'BOT_TOKEN': '123456:bench',
+        'ADMIN_ID': str(ADMIN_ID),
+        'STORAGE_BACKEND': args.backend,
+        'SQLITE_FILE': 'bench.db',
+        'MEDIA_CACHE_DIR': os.path.join(workdir, 'cache'),
+        'MENU_PAGES': 'menu1.jpg,menu2.jpg,menu3.jpg',
+    })
+    try:
+        seed_users('users_data.json', args.users, ['degtyarev', 'city-mall'], args.seed)
+        result = asyncio.run(run_single(args))
+    finally:
+        os.chdir(HERE)
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(result))
+
+
+def report(result):
+    print(f"\n{result['users']:,} users ({result['backend']}), storage load {result['load_s']:.2f}s "
+          f"(first load with migration from JSON {result['migrate_s']:.2f}s)")
+    print(f"{'handler':<28}{'p50 ms':>10}{'p99 ms':>10}{'net KiB':>12}{'peak KiB':>11}")
+    for name, row in result['handlers'].items():
+        print(f"{name:<28}{row['p50_ms']:>10.3f}{row['p99_ms']:>10.3f}{row['net_kib']:>12.1f}{row['peak_kib']:>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', default='1000,100000,1000000',
+                        help='comma-separated user counts to seed (default: %(default)s)')
+    parser.add_argument('--iterations', type=int, default=200, help='calls per handler (default: %(default)s)')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='simulated Bot API latency (default: %(default)s)')
+    parser.add_argument('--backend', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='PATH', help='also write results to PATH')
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        args.users = int(args.users)
+        single(args)
+        return
+
+    results = []
+    for users in [int(count) for count in args.users.split(',') if count.strip()]:
+        command = [
+            sys.executable, os.path.abspath(__file__), '--single', '--users', str(users),
+            '--iterations', str(args.iterations), '--latency-ms', str(args.latency_ms),
+            '--backend', args.backend, '--seed', str(args.seed),
+        ]
+        completed = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+        if completed.returncode != 0:
+            print(f"Benchmark for {users} users failed", file=sys.stderr)
+            sys.exit(completed.returncode)
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        results.append(result)
+        report(result)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,37 @@
 import os
-import json
+import asyncio
 import logging
-from datetime import datetime
+from datetime import date, datetime
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, InputMediaPhoto, KeyboardButton
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters, ConversationHandler
-from telegram.error import TelegramError
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters, ConversationHandler, TypeHandler
+from telegram.error import TelegramError, BadRequest
 import messages as msg
+import keyboards
+from storage import create_storage, WriteBehind
+from history import RatingHistory
+from stats import StatsCache, build_report
+from media import ImageCache, MediaRegistry, create_image_executor
+from broadcast import BroadcastEngine, BroadcastJob, BroadcastManager
+from router import ButtonRouter, ButtonFilter
+from locations import LocationRegistry, migrate_name_keys
+from flood import AntiFlood
+from log_setup import setup_logging, parse_logger_levels
+from metrics import Gauge, InstrumentedRequest, MetricsServer, UPDATE_QUEUE, instrument_handlers
 import uuid
-from PIL import Image
-import io
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
+# Configure logging: records are written by a background thread, tokens are redacted
+setup_logging(
+    os.getenv('LOG_FILE', 'bot.log'),
+    level=os.getenv('LOG_LEVEL', 'INFO'),
+    logger_levels=parse_logger_levels(os.getenv('LOG_LEVELS', '')),
+    max_bytes=int(os.getenv('LOG_MAX_BYTES', str(5 * 1024 * 1024))),
+    backup_count=int(os.getenv('LOG_BACKUP_COUNT', '5')),
+    rotate_when=os.getenv('LOG_ROTATE_WHEN', ''),
+    secrets=[os.getenv('BOT_TOKEN'), os.getenv('WEBHOOK_SECRET')]
 )
 logger = logging.getLogger(__name__)
 
@@ -31,52 +41,175 @@ MAIN_MENU, LOCATION_SELECTION, RATING_DRINKS, RATING_SERVICE, FEEDBACK, WAITING_
 # Admin ID from environment
 ADMIN_ID = os.getenv('ADMIN_ID')
 BOT_TOKEN = os.getenv('BOT_TOKEN')
+# Bot API server, e.g. a self-hosted one or fake_api.py for load tests
+BOT_API_URL = os.getenv('BOT_API_URL', '')
+
+# Update delivery: long polling or webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
 
 # File paths
-USERS_FILE = 'users_data.json'
-USERS_LIST_FILE = 'users.txt'
-MENU_PHOTOS = ['menu1.jpg', 'menu2.jpg', 'menu3.jpg']
+USERS_FILE = 'users_data.snap'
+USERS_LEGACY_FILE = 'users_data.json'  # Снимок прежних версий, переносится при первом запуске
+USERS_JOURNAL_FILE = 'users_data.journal'
+FEEDBACKS_FILE = 'feedbacks.jsonl'
+RATING_HISTORY_FILE = 'ratings_history.bin'
+SQLITE_FILE = os.getenv('SQLITE_FILE', 'bot.db')
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')
+JOURNAL_COMPACT_EVERY = int(os.getenv('JOURNAL_COMPACT_EVERY', '1000'))
+FLUSH_INTERVAL_MS = int(os.getenv('FLUSH_INTERVAL_MS', '200'))
+FLUSH_MAX_PENDING = int(os.getenv('FLUSH_MAX_PENDING', '500'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '20'))
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
+BROADCAST_CHAT_INTERVAL = float(os.getenv('BROADCAST_CHAT_INTERVAL', '1.0'))
+BROADCAST_RETENTION_DAYS = float(os.getenv('BROADCAST_RETENTION_DAYS', '30'))
+JOBS_LIST_FINISHED = 10  # Сколько завершённых рассылок показывает /jobs
+# Страницы меню в порядке отправки
+MENU_PAGES = [page.strip() for page in os.getenv('MENU_PAGES', 'menu1.jpg,menu2.jpg,menu3.jpg').split(',') if page.strip()]
+MEDIA_GROUP_LIMIT = 10  # Telegram allows 2-10 items per album
+WELCOME_PHOTO = 'welcome.jpg'
+# Locations: JSON list of {"id", "name"}; ids go into callback data
+LOCATIONS_FILE = os.getenv('LOCATIONS_FILE', 'locations.json')
+LOCATIONS_PAGE_SIZE = int(os.getenv('LOCATIONS_PAGE_SIZE', '8'))
+MEDIA_CACHE_DIR = os.getenv('MEDIA_CACHE_DIR', 'cache')
+# Days shown on the admin /stats charts
+STATS_DAYS = int(os.getenv('STATS_DAYS', '30'))
+# Image rendering pool ('thread' or 'process') and JPEG encoder settings
+IMAGE_POOL = os.getenv('IMAGE_POOL', 'thread')
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '2'))
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', '75'))
+IMAGE_PROGRESSIVE = os.getenv('IMAGE_PROGRESSIVE', '0') == '1'
+MEDIA_REGISTRY_FILE = 'media_registry.json'
+BROADCAST_JOBS_FILE = 'broadcast_jobs.json'
+# Prometheus metrics at http://METRICS_LISTEN:METRICS_PORT/metrics; 0 disables the endpoint
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+# Anti-flood: per-user bucket refilled at FLOOD_RATE updates/s up to FLOOD_BURST; commands cost more
+FLOOD_RATE = float(os.getenv('FLOOD_RATE', '1'))
+FLOOD_BURST = float(os.getenv('FLOOD_BURST', '10'))
+FLOOD_COMMAND_COST = float(os.getenv('FLOOD_COMMAND_COST', '3'))
+FLOOD_DUPLICATE_WINDOW = float(os.getenv('FLOOD_DUPLICATE_WINDOW', '2'))
+
+location_registry = LocationRegistry.load(LOCATIONS_FILE)
 
 # Store user data
-users_data = {}
-feedbacks = {}  # Глобальное хранилище для обращений
+storage = create_storage(
+    STORAGE_BACKEND, USERS_FILE, USERS_JOURNAL_FILE, FEEDBACKS_FILE, SQLITE_FILE, JOURNAL_COMPACT_EVERY,
+    USERS_LEGACY_FILE
+)
+storage_writer = WriteBehind(storage, FLUSH_INTERVAL_MS, FLUSH_MAX_PENDING)
+# Все оценки с отметкой времени, для динамики по локациям
+rating_history = RatingHistory(RATING_HISTORY_FILE)
+history_writer = WriteBehind(rating_history, FLUSH_INTERVAL_MS, FLUSH_MAX_PENDING)
+image_executor = create_image_executor(IMAGE_POOL, IMAGE_WORKERS)
+image_cache = ImageCache(MEDIA_CACHE_DIR, quality=IMAGE_QUALITY, progressive=IMAGE_PROGRESSIVE, executor=image_executor)
+media_registry = MediaRegistry(MEDIA_REGISTRY_FILE)
+stats_cache = StatsCache(image_executor)
+
+def format_broadcast_status(job):
+    """Text of the admin's broadcast status message"""
+    if job.state == 'done':
+        return msg.ADMIN_BROADCAST_COMPLETE.format(success=job.sent, fail=job.failed, unreachable=job.unreachable)
+    template = {
+        'paused': msg.ADMIN_BROADCAST_PAUSED,
+        'cancelled': msg.ADMIN_BROADCAST_CANCELLED,
+    }.get(job.state, msg.ADMIN_BROADCAST_PROGRESS)
+    return template.format(
+        job_id=job.job_id, done=job.done, total=job.total,
+        success=job.sent, fail=job.failed, unreachable=job.unreachable
+    )
+
+def mark_user_unreachable(user_id):
+    """Exclude a user who blocked the bot or no longer exists from broadcasts"""
+    try:
+        storage.set_active(str(user_id), False)
+    except Exception as e:
+        logger.error(f"Error marking user {user_id} inactive: {e}")
+
+broadcasts = BroadcastManager(
+    BroadcastEngine(BROADCAST_CONCURRENCY, BROADCAST_RATE, BROADCAST_CHAT_INTERVAL),
+    BROADCAST_JOBS_FILE,
+    lambda after: storage.iter_user_ids(after, active_only=True),
+    format_broadcast_status,
+    mark_user_unreachable,
+    BROADCAST_RETENTION_DAYS * 86400
+)
 feedback_counter = 0
 active_tickets = {}
+ratings_version = 0  # Растёт с каждой оценкой, ключ кэша /stats
+metrics_server = MetricsServer(METRICS_LISTEN, METRICS_PORT) if METRICS_PORT else None
+
+Gauge('bot_users', 'Known users by broadcast state', ['state'],
+      callback=lambda: dict(zip([('active',), ('inactive',)], storage.count_users())))
+Gauge('bot_broadcast_jobs', 'Broadcast jobs by state', ['state'],
+      callback=lambda: {(state,): sum(1 for job in broadcasts.jobs.values() if job.state == state)
+                        for state in ('running', 'paused', 'done', 'cancelled')})
 
 def load_users_data():
-    """Load users data from file"""
-    global users_data
+    """Open storage and load users data; a storage that fails to load stops the bot"""
+    try:
+        storage.load()
+    except Exception as e:
+        # С пустым хранилищем работать нельзя: первое же сжатие затрёт снимок на диске
+        logger.critical(f"Error loading users data, not starting: {e}")
+        raise
     try:
-        if os.path.exists(USERS_FILE):
-            with open(USERS_FILE, 'r', encoding='utf-8') as f:
-                users_data = json.load(f)
+        rating_history.load()
     except Exception as e:
-        logger.error(f"Error loading users data: {e}")
+        logger.error(f"Error loading rating history: {e}")
+    try:
+        migrate_name_keys(location_registry, storage, rating_history)
+    except Exception as e:
+        logger.error(f"Error moving ratings to location ids: {e}")
 
 def save_users_data():
-    """Save users data to file"""
+    """Flush outstanding users data and close storage"""
     try:
-        with open(USERS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(users_data, f, ensure_ascii=False, indent=2)
+        storage.close()
     except Exception as e:
         logger.error(f"Error saving users data: {e}")
+    try:
+        rating_history.close()
+    except Exception as e:
+        logger.error(f"Error saving rating history: {e}")
+
+def record_rating(user_id, location, kind, rating):
+    """Store a user's drink or service rating for location (by id)"""
+    global ratings_version
+    ratings_version += 1
+    try:
+        previous = storage.set_rating(user_id, location, kind, rating)
+        if previous != rating:
+            location_keyboard.invalidate(location)
+        rating_history.record(user_id, location, kind, rating)
+    except Exception as e:
+        logger.error(f"Error saving rating: {e}")
+
+async def send_users_export(message, fmt='txt', compress=False):
+    """Stream the users list into a document and send it to the admin"""
+    # Выгрузка нужна только админу, csv и gzip грузим при первом вызове
+    from export import build_export, export_filename
 
-def save_users_list():
-    """Save users list to text file"""
+    active, inactive = storage.count_users()
     try:
-        with open(USERS_LIST_FILE, 'w', encoding='utf-8') as f:
-            f.write("Список пользователей\n")
-            f.write("==================\n\n")
-            for user_id, user_info in users_data.items():
-                f.write(msg.ADMIN_USER_INFO.format(
-                    user_id=user_id,
-                    username=user_info['username'],
-                    first_name=user_info['first_name'],
-                    last_name=user_info['last_name']
-                ))
-                f.write("\n" + "="*40 + "\n\n")
+        users = storage.iter_users()
+        document = await asyncio.to_thread(build_export, users, fmt, compress)
+        with document:
+            # PTB всё равно читает вложение целиком перед отправкой
+            await message.reply_document(
+                document=document.read(),
+                filename=export_filename(fmt, compress),
+                caption=msg.ADMIN_USERS_LIST_HEADER + "\n" + msg.ADMIN_USERS_STATS.format(
+                    active=active, inactive=inactive
+                )
+            )
     except Exception as e:
-        logger.error(f"Error saving users list: {e}")
+        logger.error(f"Error sending users list: {e}")
+        await message.reply_text(msg.ERROR_GENERAL)
 
 def is_admin(user_id: int) -> bool:
     """Check if user is admin"""
@@ -84,116 +217,90 @@ def is_admin(user_id: int) -> bool:
 
 def get_main_menu_keyboard(is_admin_user: bool = False):
     """Get main menu keyboard"""
-    keyboard = [
-        [msg.BUTTON_FEEDBACK],
-        [msg.BUTTON_MENU, msg.BUTTON_VACANCIES],
-        [msg.BUTTON_COOPERATION, msg.BUTTON_SUGGESTIONS]
-    ]
-    if is_admin_user:
-        keyboard.append([msg.ADMIN_BUTTON_BROADCAST, msg.ADMIN_BUTTON_USERS])
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-def get_location_keyboard():
+    return keyboards.main_menu(is_admin_user)
+
+def get_location_keyboard(page=0):
     """Get location selection keyboard"""
-    keyboard = [
-        [KeyboardButton(get_location_button_text("Дегтярев"))],
-        [KeyboardButton(get_location_button_text("Сити Молл"))],
-        [KeyboardButton(msg.BUTTON_BACK)]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-
-def get_rating_keyboard():
-    """Get rating inline keyboard"""
-    keyboard = [
-        [InlineKeyboardButton(str(i), callback_data=f'rate_{i}') for i in range(1, 6)],
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    return location_keyboard.get(page)
 
 def get_vacancies_keyboard():
     """Get vacancies keyboard"""
-    keyboard = [
-        [msg.BUTTON_SEND_RESUME],
-        [msg.BUTTON_CONTACT_ADMIN],
-        [msg.BUTTON_BACK]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    return keyboards.VACANCIES
 
 def get_cooperation_keyboard():
     """Get cooperation menu keyboard"""
-    keyboard = [
-        [msg.BUTTON_BUY_FRANCHISE],
-        [msg.BUTTON_OTHER_QUESTION],
-        [msg.BUTTON_BACK]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    return keyboards.COOPERATION
 
 def save_user_data(user):
     """Save user data to storage"""
-    global users_data
-    
-    # Ensure users_data is initialized
-    if users_data is None:
-        users_data = {}
-    
     # Always update user data
-    users_data[str(user.id)] = {
+    storage.upsert_user(str(user.id), {
         'username': user.username or '',
         'first_name': user.first_name or '',
         'last_name': user.last_name or ''
-    }
-    
-    try:
-        save_users_data()
-    except Exception as e:
-        logger.error(f"Error saving user data: {e}")
+    })
 
 def save_feedback(user_id: int, feedback_type: str, text: str) -> str:
     """Save feedback and return feedback ID"""
     feedback_id = str(uuid.uuid4())
-    feedbacks[feedback_id] = {
+    storage.save_feedback(feedback_id, {
         'user_id': user_id,
         'type': feedback_type,
         'text': text,
         'timestamp': datetime.now().isoformat()
-    }
+    })
     return feedback_id
 
-def resize_image(image_path):
-    """Resize image to fit Telegram requirements"""
-    try:
-        with Image.open(image_path) as img:
-            # Convert to RGB if needed
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Get dimensions
-            width, height = img.size
-            
-            # Calculate new dimensions
-            max_size = 1280  # Telegram recommended size
-            if width > height:
-                if width > max_size:
-                    ratio = max_size / width
-                    new_width = max_size
-                    new_height = int(height * ratio)
-            else:
-                if height > max_size:
-                    ratio = max_size / height
-                    new_height = max_size
-                    new_width = int(width * ratio)
-                    
-            # Resize image
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Save to bytes
-            bio = io.BytesIO()
-            bio.name = 'image.jpg'
-            img.save(bio, 'JPEG')
-            bio.seek(0)
-            return bio
-    except Exception as e:
-        logger.error(f"Error resizing image {image_path}: {e}")
-        return None
+async def reply_photo_cached(message, key, upload, **kwargs):
+    """Send photo by cached file_id, uploading it on first use or when the id is rejected
+
+    upload is an async callable returning the photo bytes.
+    """
+    file_id = media_registry.get(key)
+    if file_id:
+        try:
+            return await message.reply_photo(photo=file_id, **kwargs)
+        except BadRequest as e:
+            logger.warning(f"Cached file_id for {key} rejected, uploading again: {e}")
+            media_registry.discard(key)
+
+    sent = await message.reply_photo(photo=await upload(), **kwargs)
+    if sent.photo:
+        media_registry.set(key, sent.photo[-1].file_id)
+    return sent
+
+async def reply_media_group_cached(message, pages):
+    """Send (key, path) pages as albums, reusing cached file_ids and uploading the rest"""
+    async def build_media(chunk, use_cache):
+        media = []
+        for key, path in chunk:
+            file_id = media_registry.get(key) if use_cache else None
+            media.append(InputMediaPhoto(
+                media=file_id or await image_cache.aget(path),
+                filename=os.path.basename(path)
+            ))
+        return media
+
+    for offset in range(0, len(pages), MEDIA_GROUP_LIMIT):
+        chunk = pages[offset:offset + MEDIA_GROUP_LIMIT]
+        if len(chunk) == 1:
+            key, path = chunk[0]
+            await reply_photo_cached(message, key, lambda: image_cache.aget(path), filename=os.path.basename(path))
+            continue
+
+        try:
+            sent = await message.reply_media_group(media=await build_media(chunk, use_cache=True))
+        except BadRequest as e:
+            if not any(media_registry.get(key) for key, _ in chunk):
+                raise
+            logger.warning(f"Cached menu file_ids rejected, uploading again: {e}")
+            for key, _ in chunk:
+                media_registry.discard(key)
+            sent = await message.reply_media_group(media=await build_media(chunk, use_cache=False))
+
+        for (key, _), sent_message in zip(chunk, sent):
+            if sent_message.photo:
+                media_registry.set(key, sent_message.photo[-1].file_id)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start command handler"""
@@ -216,14 +323,20 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Try to send photo with caption if exists
         welcome_sent = False
-        if os.path.exists('welcome.jpg') and os.path.getsize('welcome.jpg') > 0:
+        if os.path.exists(WELCOME_PHOTO) and os.path.getsize(WELCOME_PHOTO) > 0:
             try:
-                with open('welcome.jpg', 'rb') as photo:
-                    await update.message.reply_photo(
-                        photo=photo,
-                        caption=msg.INITIAL_MESSAGE
-                    )
-                    welcome_sent = True
+                async def upload():
+                    with open(WELCOME_PHOTO, 'rb') as photo:
+                        return photo.read()
+
+                await reply_photo_cached(
+                    update.message,
+                    media_registry.file_key(WELCOME_PHOTO),
+                    upload,
+                    caption=msg.INITIAL_MESSAGE,
+                    filename=WELCOME_PHOTO
+                )
+                welcome_sent = True
             except Exception as e:
                 logger.error(f"Error sending welcome photo: {e}")
                 # Продолжаем выполнение и отправим текстовое сообщение
@@ -248,21 +361,16 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def send_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        menu_photos = [
-            'menu1.jpg',
-            'menu2.jpg',
-            'menu3.jpg'
-        ]
-        
-        for photo in menu_photos:
-            if os.path.exists(photo):
-                resized_photo = resize_image(photo)
-                if resized_photo:
-                    await update.message.reply_photo(photo=resized_photo)
-                else:
-                    logging.error(f"Failed to resize photo: {photo}")
+        pages = []
+        for photo in MENU_PAGES:
+            key = await image_cache.akey(photo)
+            if key:
+                pages.append((key, photo))
             else:
-                logging.error(f"Menu photo not found: {photo}")
+                logging.error(f"Failed to prepare menu photo: {photo}")
+
+        if pages:
+            await reply_media_group_cached(update.message, pages)
         
         return MAIN_MENU
             
@@ -271,64 +379,55 @@ async def send_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Извините, произошла ошибка при отправке меню")
         return MAIN_MENU
 
-async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle main menu options"""
-    try:
-        text = update.message.text
+async def show_locations(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(msg.SELECT_LOCATION, reply_markup=get_location_keyboard())
+    return LOCATION_SELECTION
 
-        if text == msg.BUTTON_FEEDBACK:
-            reply_markup = get_location_keyboard()
-            await update.message.reply_text(msg.SELECT_LOCATION, reply_markup=reply_markup)
-            return LOCATION_SELECTION
+async def show_vacancies(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(msg.VACANCIES_DESCRIPTION, reply_markup=get_vacancies_keyboard())
+    return WAITING_RESUME
 
-        elif text == msg.BUTTON_MENU:
-            await send_menu(update, context)
-            return MAIN_MENU
+async def show_cooperation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(msg.COOPERATION_CHOICE, reply_markup=get_cooperation_keyboard())
+    return COOPERATION_MENU
 
-        elif text == msg.BUTTON_VACANCIES:
-            reply_markup = get_vacancies_keyboard()
-            await update.message.reply_text(msg.VACANCIES_DESCRIPTION, reply_markup=reply_markup)
-            return WAITING_RESUME
+async def ask_suggestion(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(msg.SUGGESTIONS_REQUEST, reply_markup=keyboards.BACK)
+    context.user_data['feedback_type'] = 'suggestion'
+    return FEEDBACK
 
-        elif text == msg.BUTTON_COOPERATION:
-            reply_markup = get_cooperation_keyboard()
-            await update.message.reply_text(msg.COOPERATION_CHOICE, reply_markup=reply_markup)
-            return COOPERATION_MENU
+async def ask_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.message.from_user.id):
+        return None
+    await update.message.reply_text(msg.ADMIN_BROADCAST_USAGE, reply_markup=keyboards.BACK)
+    return WAITING_BROADCAST
 
-        elif text == msg.BUTTON_SUGGESTIONS:
-            await update.message.reply_text(
-                msg.SUGGESTIONS_REQUEST,
-                reply_markup=ReplyKeyboardMarkup([[msg.BUTTON_BACK]], resize_keyboard=True)
-            )
-            context.user_data['feedback_type'] = 'suggestion'
-            return FEEDBACK
+async def show_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.message.from_user.id):
+        return None
+    await send_users_export(update.message)
+    return MAIN_MENU
 
-        elif text == msg.ADMIN_BUTTON_BROADCAST and is_admin(update.message.from_user.id):
-            await update.message.reply_text(
-                msg.ADMIN_BROADCAST_USAGE,
-                reply_markup=ReplyKeyboardMarkup([[msg.BUTTON_BACK]], resize_keyboard=True)
-            )
-            return WAITING_BROADCAST
+async def back_to_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    reply_markup = get_main_menu_keyboard(is_admin(update.message.from_user.id))
+    await update.message.reply_text(msg.WELCOME_MESSAGE, reply_markup=reply_markup)
+    return MAIN_MENU
 
-        elif text == msg.ADMIN_BUTTON_USERS and is_admin(update.message.from_user.id):
-            save_users_list()
-            try:
-                with open(USERS_LIST_FILE, 'rb') as f:
-                    await update.message.reply_document(
-                        document=f,
-                        filename='users_list.txt',
-                        caption=msg.ADMIN_USERS_LIST_HEADER
-                    )
-            except Exception as e:
-                logger.error(f"Error sending users list: {e}")
-                await update.message.reply_text(msg.ERROR_GENERAL)
-            return MAIN_MENU
+main_menu_router = ButtonRouter({
+    msg.BUTTON_FEEDBACK: show_locations,
+    msg.BUTTON_MENU: send_menu,
+    msg.BUTTON_VACANCIES: show_vacancies,
+    msg.BUTTON_COOPERATION: show_cooperation,
+    msg.BUTTON_SUGGESTIONS: ask_suggestion,
+    msg.ADMIN_BUTTON_BROADCAST: ask_broadcast,
+    msg.ADMIN_BUTTON_USERS: show_users,
+    msg.BUTTON_BACK: back_to_main_menu,
+})
 
-        elif text == msg.BUTTON_BACK:
-            is_admin_user = is_admin(update.message.from_user.id)
-            reply_markup = get_main_menu_keyboard(is_admin_user)
-            await update.message.reply_text(msg.WELCOME_MESSAGE, reply_markup=reply_markup)
-            return MAIN_MENU
+async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle main menu options"""
+    try:
+        return await main_menu_router.dispatch(update, context)
 
     except Exception as e:
         logger.error(f"Error in main menu handler: {e}")
@@ -336,40 +435,23 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return MAIN_MENU
 
 async def feedback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = [
-        [msg.BUTTON_QUALITY],
-        [msg.BUTTON_SERVICE],
-        [msg.BUTTON_BACK]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    await update.message.reply_text(msg.WELCOME_MESSAGE, reply_markup=reply_markup)
+    await update.message.reply_text(msg.WELCOME_MESSAGE, reply_markup=keyboards.FEEDBACK_TYPES)
 
 async def handle_location_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle location selection"""
+    """Handle a location sent as text: its name or a button label from an older reply keyboard"""
     try:
-        # Extract location name without rating info
-        location = update.message.text.split(" (")[0]
+        location = location_keyboard.find(update.message.text)
         
-        if location not in ["Дегтярев", "Сити Молл"]:
-            await update.message.reply_text(msg.INVALID_LOCATION)
+        if location is None:
+            await update.message.reply_text(msg.INVALID_LOCATION, reply_markup=get_location_keyboard())
             return LOCATION_SELECTION
 
         # Save location in user context
-        context.user_data['current_location'] = location
-        
-        # Create rating keyboard
-        keyboard = [[
-            InlineKeyboardButton("1", callback_data="rate_drink_1"),
-            InlineKeyboardButton("2", callback_data="rate_drink_2"),
-            InlineKeyboardButton("3", callback_data="rate_drink_3"),
-            InlineKeyboardButton("4", callback_data="rate_drink_4"),
-            InlineKeyboardButton("5", callback_data="rate_drink_5"),
-        ]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        context.user_data['current_location'] = location.id
         
         await update.message.reply_text(
-            f"Оцените качество напитков в {location}:",
-            reply_markup=reply_markup
+            f"Оцените качество напитков в {location.name}:",
+            reply_markup=keyboards.DRINK_RATING
         )
         return RATING_DRINKS
         
@@ -378,6 +460,45 @@ async def handle_location_selection(update: Update, context: ContextTypes.DEFAUL
         await update.message.reply_text(msg.ERROR_MESSAGE)
         return MAIN_MENU
 
+async def handle_location_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle location keyboard buttons: a location, a page switch or back"""
+    try:
+        query = update.callback_query
+        data = query.data
+
+        if data.startswith(keyboards.LOCATION_PAGE_CALLBACK):
+            await query.answer()
+            page = int(data[len(keyboards.LOCATION_PAGE_CALLBACK):])
+            await query.edit_message_reply_markup(reply_markup=get_location_keyboard(page))
+            return LOCATION_SELECTION
+
+        if data == keyboards.LOCATION_BACK_CALLBACK:
+            await query.answer()
+            reply_markup = get_main_menu_keyboard(is_admin(query.from_user.id))
+            await query.message.reply_text(msg.WELCOME_MESSAGE, reply_markup=reply_markup)
+            return MAIN_MENU
+
+        location = None
+        if data.startswith(keyboards.LOCATION_CALLBACK):
+            location = location_registry.get(data[len(keyboards.LOCATION_CALLBACK):])
+        if location is None:
+            # Номер страницы или локация, которой больше нет в конфиге
+            await query.answer(None if data == keyboards.LOCATION_NOOP_CALLBACK else msg.INVALID_LOCATION)
+            return LOCATION_SELECTION
+
+        await query.answer()
+        context.user_data['current_location'] = location.id
+        await query.edit_message_text(
+            f"Оцените качество напитков в {location.name}:",
+            reply_markup=keyboards.DRINK_RATING
+        )
+        return RATING_DRINKS
+
+    except Exception as e:
+        logger.error(f"Error in handle_location_callback: {e}")
+        await update.callback_query.message.reply_text(msg.ERROR_MESSAGE)
+        return MAIN_MENU
+
 async def handle_drink_rating(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle drink rating"""
     try:
@@ -386,42 +507,18 @@ async def handle_drink_rating(update: Update, context: ContextTypes.DEFAULT_TYPE
         
         # Extract rating from callback data
         rating = int(query.data.split('_')[-1])
-        location = context.user_data.get('current_location')
+        location = location_registry.get(context.user_data.get('current_location'))
+        if location is None:
+            # Локацию убрали из конфига, пока пользователь выбирал оценку
+            return await send_location_keyboard(update, context)
         
         # Save drink rating
         user_id = str(query.from_user.id)
-        if user_id not in users_data:
-            users_data[user_id] = {'ratings': []}
-        
-        # Find existing rating for this location or create new
-        rating_entry = None
-        for entry in users_data[user_id].get('ratings', []):
-            if entry.get('location') == location:
-                rating_entry = entry
-                break
-                
-        if rating_entry is None:
-            rating_entry = {'location': location}
-            users_data[user_id].setdefault('ratings', []).append(rating_entry)
-            
-        rating_entry['drink_rating'] = rating
-        
-        # Save updated data
-        save_users_data()
-        
-        # Create service rating keyboard
-        keyboard = [[
-            InlineKeyboardButton("1", callback_data="rate_service_1"),
-            InlineKeyboardButton("2", callback_data="rate_service_2"),
-            InlineKeyboardButton("3", callback_data="rate_service_3"),
-            InlineKeyboardButton("4", callback_data="rate_service_4"),
-            InlineKeyboardButton("5", callback_data="rate_service_5"),
-        ]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        record_rating(user_id, location.id, 'drink', rating)
         
         await query.edit_message_text(
-            f"Оцените качество обслуживания в {location}:",
-            reply_markup=reply_markup
+            f"Оцените качество обслуживания в {location.name}:",
+            reply_markup=keyboards.SERVICE_RATING
         )
         return RATING_SERVICE
         
@@ -438,58 +535,56 @@ async def handle_service_rating(update: Update, context: ContextTypes.DEFAULT_TY
         
         # Extract rating from callback data
         rating = int(query.data.split('_')[-1])
-        location = context.user_data.get('current_location')
+        location = location_registry.get(context.user_data.get('current_location'))
+        if location is None:
+            return await send_location_keyboard(update, context)
         
         # Save service rating
         user_id = str(query.from_user.id)
-        for entry in users_data[user_id].get('ratings', []):
-            if entry.get('location') == location:
-                entry['service_rating'] = rating
-                # Проверяем комбинацию оценок
-                drink_rating = entry.get('drink_rating', 0)
-                
-                # Если любая из оценок 4 или ниже, запрашиваем обратную связь
-                if rating <= 4 or drink_rating <= 4:
-                    # Если обе оценки <= 4, спрашиваем про более низкую оценку
-                    if rating <= 4 and drink_rating <= 4:
-                        if rating < drink_rating:
-                            context.user_data['feedback_type'] = 'service_quality'
-                            feedback_text = msg.FEEDBACK_SERVICE_REQUEST
-                        else:
-                            context.user_data['feedback_type'] = 'drink_quality'
-                            feedback_text = msg.FEEDBACK_QUALITY_REQUEST
+        entry = storage.get_rating(user_id, location.id)
+        if entry is not None:
+            record_rating(user_id, location.id, 'service', rating)
+            # Проверяем комбинацию оценок
+            drink_rating = entry.get('drink_rating', 0)
+            
+            # Если любая из оценок 4 или ниже, запрашиваем обратную связь
+            if rating <= 4 or drink_rating <= 4:
+                # Если обе оценки <= 4, спрашиваем про более низкую оценку
+                if rating <= 4 and drink_rating <= 4:
+                    if rating < drink_rating:
+                        context.user_data['feedback_type'] = 'service_quality'
+                        feedback_text = msg.FEEDBACK_SERVICE_REQUEST
+                    else:
+                        context.user_data['feedback_type'] = 'drink_quality'
+                        feedback_text = msg.FEEDBACK_QUALITY_REQUEST
+                else:
+                    # Иначе спрашиваем про ту, которая <= 4
+                    if rating <= 4:
+                        context.user_data['feedback_type'] = 'service_quality'
+                        feedback_text = msg.FEEDBACK_SERVICE_REQUEST
                     else:
-                        # Иначе спрашиваем про ту, которая <= 4
-                        if rating <= 4:
-                            context.user_data['feedback_type'] = 'service_quality'
-                            feedback_text = msg.FEEDBACK_SERVICE_REQUEST
-                        else:
-                            context.user_data['feedback_type'] = 'drink_quality'
-                            feedback_text = msg.FEEDBACK_QUALITY_REQUEST
-                    
-                    await query.edit_message_text(
-                        text=feedback_text,
-                        reply_markup=None
-                    )
-                    return FEEDBACK
-                break
+                        context.user_data['feedback_type'] = 'drink_quality'
+                        feedback_text = msg.FEEDBACK_QUALITY_REQUEST
                 
-        # Save updated data
-        save_users_data()
+                await query.edit_message_text(
+                    text=feedback_text,
+                    reply_markup=None
+                )
+                return FEEDBACK
         
         # Calculate new ratings
-        avg_drink, avg_service, total = calculate_location_rating(location)
+        avg_drink, avg_service, total = calculate_location_rating(location.id)
         
         await query.edit_message_text(
             f"Спасибо за оценку!\n\n"
-            f"Текущий рейтинг {location}:\n"
+            f"Текущий рейтинг {location.name}:\n"
             f"Качество напитков: {avg_drink}/5\n"
             f"Качество обслуживания: {avg_service}/5\n"
             f"Всего оценок: {total}"
         )
         
-        # Return to location selection
-        await send_location_keyboard(update, context)
+        # Return to location selection, on the page of the location just rated
+        await send_location_keyboard(update, context, location)
         return LOCATION_SELECTION
         
     except Exception as e:
@@ -520,7 +615,6 @@ async def handle_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Notify admin
         admin_id = ADMIN_ID
         if admin_id:
-            feedback_data = feedbacks[feedback_id]
             admin_message = f"""Новое обращение!
 Тип: {feedback_type}
 Текст: {text}
@@ -546,100 +640,90 @@ ID: {feedback_id}"""
         await update.message.reply_text(msg.ERROR_GENERAL)
         return MAIN_MENU
 
+async def ask_franchise(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "Для получения информации о франшизе, пожалуйста, опишите ваш запрос:",
+        reply_markup=keyboards.BACK
+    )
+    context.user_data['feedback_type'] = 'franchise'
+    return FEEDBACK
+
+async def ask_other_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("Пожалуйста, опишите ваш вопрос:", reply_markup=keyboards.BACK)
+    context.user_data['feedback_type'] = 'cooperation'
+    return FEEDBACK
+
+async def ask_cooperation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data['feedback_type'] = 'cooperation'
+    await update.message.reply_text(msg.COOPERATION_REQUEST, reply_markup=keyboards.BACK)
+    return FEEDBACK
+
+cooperation_router = ButtonRouter({
+    msg.BUTTON_BACK: back_to_main_menu,
+    msg.BUTTON_BUY_FRANCHISE: ask_franchise,
+    msg.BUTTON_OTHER_QUESTION: ask_other_question,
+}, default=ask_cooperation)
+
 async def handle_cooperation_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle cooperation menu options"""
     try:
-        text = update.message.text
-
-        if text == msg.BUTTON_BACK:
-            is_admin_user = is_admin(update.message.from_user.id)
-            reply_markup = get_main_menu_keyboard(is_admin_user)
-            await update.message.reply_text(msg.WELCOME_MESSAGE, reply_markup=reply_markup)
-            return MAIN_MENU
-        
-        elif text == msg.BUTTON_BUY_FRANCHISE:
-            await update.message.reply_text(
-                "Для получения информации о франшизе, пожалуйста, опишите ваш запрос:",
-                reply_markup=ReplyKeyboardMarkup([[msg.BUTTON_BACK]], resize_keyboard=True)
-            )
-            context.user_data['feedback_type'] = 'franchise'
-            return FEEDBACK
-            
-        elif text == msg.BUTTON_OTHER_QUESTION:
-            await update.message.reply_text(
-                "Пожалуйста, опишите ваш вопрос:",
-                reply_markup=ReplyKeyboardMarkup([[msg.BUTTON_BACK]], resize_keyboard=True)
-            )
-            context.user_data['feedback_type'] = 'cooperation'
-            return FEEDBACK
-
-        context.user_data['feedback_type'] = 'cooperation'
-        await update.message.reply_text(
-            msg.COOPERATION_REQUEST,
-            reply_markup=ReplyKeyboardMarkup([[msg.BUTTON_BACK]], resize_keyboard=True)
-        )
-        return FEEDBACK
+        return await cooperation_router.dispatch(update, context)
 
     except Exception as e:
         logger.error(f"Error in cooperation menu handler: {e}")
         await update.message.reply_text(msg.ERROR_GENERAL)
         return MAIN_MENU
 
+async def ask_resume(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(msg.RESUME_REQUEST, reply_markup=keyboards.BACK)
+    return WAITING_RESUME
+
+async def contact_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        f"Для связи с администратором, напишите: @rfatyhov",
+        reply_markup=get_main_menu_keyboard(is_admin(update.message.from_user.id))
+    )
+    return MAIN_MENU
+
+async def submit_resume(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Обработка полученного резюме
+    global feedback_counter
+    feedback_counter += 1
+    ticket_id = f"R{feedback_counter}"
+
+    user = update.message.from_user
+    admin_message = f"""Новое резюме {ticket_id}
+От: {user.first_name} {user.last_name} (@{user.username})
+Резюме:
+{update.message.text}"""
+
+    # Отправка резюме администратору
+    admin_id = ADMIN_ID
+    if admin_id:
+        try:
+            await context.bot.send_message(chat_id=admin_id, text=admin_message)
+        except Exception as e:
+            logger.error(f"Failed to send resume to admin: {e}")
+
+    is_admin_user = is_admin(update.message.from_user.id)
+    reply_markup = get_main_menu_keyboard(is_admin_user)
+    await update.message.reply_text(
+        "Спасибо за отправку резюме! Мы рассмотрим его и свяжемся с вами.",
+        reply_markup=reply_markup
+    )
+    return MAIN_MENU
+
+resume_router = ButtonRouter({
+    msg.BUTTON_SEND_RESUME: ask_resume,
+    msg.BUTTON_CONTACT_ADMIN: contact_admin,
+    msg.BUTTON_BACK: back_to_main_menu,
+}, default=submit_resume)
+
 async def handle_resume(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle resume submission"""
     try:
-        text = update.message.text
-        
-        if text == msg.BUTTON_SEND_RESUME:
-            await update.message.reply_text(
-                msg.RESUME_REQUEST,
-                reply_markup=ReplyKeyboardMarkup([[msg.BUTTON_BACK]], resize_keyboard=True)
-            )
-            return WAITING_RESUME
-            
-        elif text == msg.BUTTON_CONTACT_ADMIN:
-            admin_id = ADMIN_ID
-            admin_username = os.getenv('ADMIN_USERNAME', 'администратором')
-            await update.message.reply_text(
-                f"Для связи с администратором, напишите: @rfatyhov",
-                reply_markup=get_main_menu_keyboard(is_admin(update.message.from_user.id))
-            )
-            return MAIN_MENU
-            
-        elif text == msg.BUTTON_BACK:
-            is_admin_user = is_admin(update.message.from_user.id)
-            reply_markup = get_main_menu_keyboard(is_admin_user)
-            await update.message.reply_text(msg.WELCOME_MESSAGE, reply_markup=reply_markup)
-            return MAIN_MENU
-            
-        else:
-            # Обработка полученного резюме
-            global feedback_counter
-            feedback_counter += 1
-            ticket_id = f"R{feedback_counter}"
-            
-            user = update.message.from_user
-            admin_message = f"""Новое резюме {ticket_id}
-От: {user.first_name} {user.last_name} (@{user.username})
-Резюме:
-{text}"""
-            
-            # Отправка резюме администратору
-            admin_id = ADMIN_ID
-            if admin_id:
-                try:
-                    await context.bot.send_message(chat_id=admin_id, text=admin_message)
-                except Exception as e:
-                    logger.error(f"Failed to send resume to admin: {e}")
-            
-            is_admin_user = is_admin(update.message.from_user.id)
-            reply_markup = get_main_menu_keyboard(is_admin_user)
-            await update.message.reply_text(
-                "Спасибо за отправку резюме! Мы рассмотрим его и свяжемся с вами.",
-                reply_markup=reply_markup
-            )
-            return MAIN_MENU
-            
+        return await resume_router.dispatch(update, context)
+
     except Exception as e:
         logger.error(f"Error in resume handler: {e}")
         await update.message.reply_text(msg.ERROR_GENERAL)
@@ -660,7 +744,7 @@ async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
         # Ask admin to enter reply text
         await query.message.reply_text(
             "Введите текст ответа:",
-            reply_markup=ReplyKeyboardMarkup([[msg.BUTTON_BACK]], resize_keyboard=True)
+            reply_markup=keyboards.BACK
         )
         return WAITING_REPLY
 
@@ -685,7 +769,7 @@ async def handle_admin_reply_text(update: Update, context: ContextTypes.DEFAULT_
             return MAIN_MENU
 
         # Get feedback data from global storage
-        feedback_data = feedbacks.get(feedback_id)
+        feedback_data = storage.get_feedback(feedback_id)
         if feedback_data and 'user_id' in feedback_data:
             try:
                 # Send reply to user
@@ -723,7 +807,7 @@ async def start_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await query.message.reply_text(
         msg.ADMIN_REPLY_REQUEST.format(ticket_id=ticket_id),
-        reply_markup=ReplyKeyboardMarkup([[msg.BUTTON_BACK]], resize_keyboard=True)
+        reply_markup=keyboards.BACK
     )
     return WAITING_REPLY
 
@@ -788,99 +872,116 @@ async def handle_broadcast_text(update: Update, context: ContextTypes.DEFAULT_TY
         await message.reply_text(msg.WELCOME_MESSAGE, reply_markup=reply_markup)
         return MAIN_MENU
 
-    success_count = 0
-    fail_count = 0
-    broadcast_text = None
-    broadcast_media = None
-    
     try:
         if message.photo:
             logger.info("Got photo message")
-            broadcast_media = message.photo[-1].file_id
-            broadcast_text = message.caption
-            
-            # Отправляем всем пользователям
-            for user_id in users_data.keys():
-                try:
-                    await context.bot.send_photo(
-                        chat_id=user_id,
-                        photo=broadcast_media,
-                        caption=broadcast_text
-                    )
-                    success_count += 1
-                except Exception as e:
-                    logger.error(f"Failed to send photo to {user_id}: {e}")
-                    fail_count += 1
-                    
+            job = BroadcastJob(uuid.uuid4().hex[:8], 'photo', text=message.caption, media=message.photo[-1].file_id)
         elif message.video:
             logger.info("Got video message")
-            broadcast_media = message.video.file_id
-            broadcast_text = message.caption
-            
-            # Отправляем всем пользователям
-            for user_id in users_data.keys():
-                try:
-                    await context.bot.send_video(
-                        chat_id=user_id,
-                        video=broadcast_media,
-                        caption=broadcast_text
-                    )
-                    success_count += 1
-                except Exception as e:
-                    logger.error(f"Failed to send video to {user_id}: {e}")
-                    fail_count += 1
-                    
+            job = BroadcastJob(uuid.uuid4().hex[:8], 'video', text=message.caption, media=message.video.file_id)
         elif message.text:
             logger.info("Got text message")
-            broadcast_text = message.text
-            
-            # Отправляем всем пользователям
-            for user_id in users_data.keys():
-                try:
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text=broadcast_text
-                    )
-                    success_count += 1
-                except Exception as e:
-                    logger.error(f"Failed to send text to {user_id}: {e}")
-                    fail_count += 1
-        
+            job = BroadcastJob(uuid.uuid4().hex[:8], 'text', text=message.text)
         else:
             logger.warning("Unsupported message type in broadcast")
             await message.reply_text("Этот тип сообщения не поддерживается для рассылки. Пожалуйста, отправьте текст, фото или видео.")
             return WAITING_BROADCAST
+
+        # Рассылка идет в фоне, админ видит прогресс в сообщении статуса
+        job.total, inactive = storage.count_users()
+        status_message = await message.reply_text(
+            msg.ADMIN_BROADCAST_STARTED.format(job_id=job.job_id, total=job.total, inactive=inactive)
+        )
+        job.status_chat_id = status_message.chat_id
+        job.status_message_id = status_message.message_id
+        broadcasts.start(context.bot, job)
             
     except Exception as e:
         logger.error(f"Error in broadcast: {e}")
         await message.reply_text("Произошла ошибка при отправке рассылки. Попробуйте еще раз.")
         return WAITING_BROADCAST
 
-    # Отправляем отчет о результатах
     reply_markup = get_main_menu_keyboard(is_admin(message.from_user.id))
-    await message.reply_text(
-        msg.ADMIN_BROADCAST_COMPLETE.format(success=success_count, fail=fail_count),
-        reply_markup=reply_markup
-    )
+    await message.reply_text(msg.WELCOME_MESSAGE, reply_markup=reply_markup)
     return MAIN_MENU
 
-def calculate_location_rating(location):
-    """Calculate average rating for a location"""
-    total_drink_rating = 0
-    total_service_rating = 0
-    drink_count = 0
-    service_count = 0
-    
-    for user_data in users_data.values():
-        if 'ratings' in user_data:
-            for rating in user_data['ratings']:
-                if rating['location'] == location:
-                    if 'drink_rating' in rating:
-                        total_drink_rating += rating['drink_rating']
-                        drink_count += 1
-                    if 'service_rating' in rating:
-                        total_service_rating += rating['service_rating']
-                        service_count += 1
+async def handle_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Export users as /users [txt|csv|jsonl] [gz]"""
+    if not is_admin(update.message.from_user.id):
+        await update.message.reply_text(msg.ADMIN_NO_RIGHTS)
+        return
+
+    from export import EXPORT_FORMATS
+
+    args = [arg.lower() for arg in context.args or []]
+    fmt = args[0] if args else 'txt'
+    compress = args[1:] == ['gz']
+    if fmt not in EXPORT_FORMATS or (len(args) > 1 and not compress):
+        await update.message.reply_text(msg.ADMIN_USERS_USAGE)
+        return
+
+    await send_users_export(update.message, fmt, compress)
+
+async def handle_jobs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List, pause, resume or cancel broadcast jobs"""
+    if not is_admin(update.message.from_user.id):
+        await update.message.reply_text(msg.ADMIN_NO_RIGHTS)
+        return
+
+    args = context.args or []
+    if not args:
+        # Идущие и приостановленные рассылки, затем последние завершённые
+        jobs, hidden = broadcasts.listed(JOBS_LIST_FINISHED)
+        lines = [
+            msg.ADMIN_JOBS_ITEM.format(
+                job_id=job.job_id, state=job.state, kind=job.kind,
+                done=job.done, total=job.total, fail=job.failed, unreachable=job.unreachable
+            )
+            for job in jobs
+        ]
+        if hidden:
+            lines.append(msg.ADMIN_JOBS_MORE.format(count=hidden))
+        await update.message.reply_text("\n".join(lines) if lines else msg.ADMIN_JOBS_EMPTY)
+        return
+
+    if len(args) != 2 or args[0] not in ('pause', 'resume', 'cancel'):
+        await update.message.reply_text(msg.ADMIN_JOBS_USAGE)
+        return
+
+    action, job_id = args
+    if action == 'pause':
+        updated = broadcasts.pause(job_id)
+    elif action == 'resume':
+        updated = broadcasts.resume(context.bot, job_id)
+    else:
+        updated = await broadcasts.cancel(job_id)
+
+    template = msg.ADMIN_JOB_UPDATED if updated else msg.ADMIN_JOB_NOT_UPDATED
+    await update.message.reply_text(template.format(job_id=job_id))
+
+def stats_key():
+    """Changes whenever the numbers behind /stats do, and at midnight"""
+    return date.today(), ratings_version
+
+async def handle_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send per-location averages with rating trend and volume charts"""
+    if not is_admin(update.message.from_user.id):
+        await update.message.reply_text(msg.ADMIN_NO_RIGHTS)
+        return
+
+    try:
+        await stats_cache.send(
+            update.message,
+            stats_key(),
+            lambda: build_report(rating_history, location_registry.locations, storage.location_rating, STATS_DAYS)
+        )
+    except Exception as e:
+        logger.error(f"Error sending stats: {e}")
+        await update.message.reply_text(msg.ERROR_GENERAL)
+
+def calculate_location_rating(location_id):
+    """Calculate average rating for a location from storage aggregates"""
+    total_drink_rating, drink_count, total_service_rating, service_count = storage.location_rating(location_id)
     
     avg_drink = round(total_drink_rating / drink_count, 1) if drink_count > 0 else 0
     avg_service = round(total_service_rating / service_count, 1) if service_count > 0 else 0
@@ -890,32 +991,65 @@ def calculate_location_rating(location):
 
 def get_location_button_text(location):
     """Get button text with rating for location"""
-    avg_drink, avg_service, total = calculate_location_rating(location)
+    avg_drink, avg_service, total = calculate_location_rating(location.id)
     if total > 0:
         rating_text = f" (⭐️ {avg_drink}/5 • 👤 {total})"
     else:
         rating_text = ""
-    return f"{location}{rating_text}"
-
-async def send_location_keyboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Send location selection keyboard with ratings"""
-    keyboard = [
-        [KeyboardButton(get_location_button_text("Дегтярев"))],
-        [KeyboardButton(get_location_button_text("Сити Молл"))],
-        [KeyboardButton(msg.BUTTON_BACK)]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    await update.message.reply_text(msg.CHOOSE_LOCATION, reply_markup=reply_markup)
+    return f"{location.name}{rating_text}"
+
+location_keyboard = keyboards.LocationKeyboard(location_registry, get_location_button_text, LOCATIONS_PAGE_SIZE)
+
+async def send_location_keyboard(update: Update, context: ContextTypes.DEFAULT_TYPE, location=None):
+    """Send location selection keyboard with ratings, opened on the page of location"""
+    page = location_keyboard.page_of(location) if location is not None else 0
+    await update.effective_message.reply_text(msg.CHOOSE_LOCATION, reply_markup=get_location_keyboard(page))
     return LOCATION_SELECTION
 
+async def on_startup(application: Application):
+    """Start background storage flushing and resume interrupted broadcasts"""
+    storage_writer.start()
+    history_writer.start()
+    broadcasts.load()
+    broadcasts.restore(application.bot)
+    if metrics_server is not None:
+        await metrics_server.start()
+    # Меню отрисовывается в фоне, первые обновления его не ждут
+    application.bot_data['image_warmup'] = asyncio.gather(*(image_cache.aget(photo) for photo in MENU_PAGES))
+
+async def on_stop(application: Application):
+    """Checkpoint running broadcasts while the bot can still send"""
+    warmup = application.bot_data.pop('image_warmup', None)
+    if warmup is not None:
+        await warmup
+    await broadcasts.shutdown()
+
+async def on_shutdown(application: Application):
+    """Flush and close storage on shutdown"""
+    if metrics_server is not None:
+        await metrics_server.stop()
+    await storage_writer.stop()
+    await history_writer.stop()
+    save_users_data()
+    image_executor.shutdown(cancel_futures=True)
+
 def main():
     """Start the bot"""
     try:
         # Load saved users data
         load_users_data()
+        media_registry.load()
 
         # Create application
-        application = Application.builder().token(BOT_TOKEN).build()
+        builder = Application.builder().token(BOT_TOKEN)
+        builder = builder.request(InstrumentedRequest(connection_pool_size=256))
+        builder = builder.get_updates_request(InstrumentedRequest(connection_pool_size=1))
+        if BOT_API_URL:
+            builder = builder.base_url(BOT_API_URL)
+        application = builder.post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown).build()
+
+        # Кнопки сравниваются как строки, без регулярных выражений
+        back_button = ButtonFilter([msg.BUTTON_BACK])
 
         # Add conversation handler
         conv_handler = ConversationHandler(
@@ -923,17 +1057,13 @@ def main():
             states={
                 MAIN_MENU: [
                     CommandHandler('start', start),
-                    MessageHandler(filters.Regex(f"^{msg.BUTTON_FEEDBACK}$"), handle_main_menu),
-                    MessageHandler(filters.Regex(f"^{msg.BUTTON_MENU}$"), handle_main_menu),
-                    MessageHandler(filters.Regex(f"^{msg.BUTTON_VACANCIES}$"), handle_main_menu),
-                    MessageHandler(filters.Regex(f"^{msg.BUTTON_COOPERATION}$"), handle_main_menu),
-                    MessageHandler(filters.Regex(f"^{msg.BUTTON_SUGGESTIONS}$"), handle_main_menu),
-                    MessageHandler(filters.Regex(f"^{msg.ADMIN_BUTTON_BROADCAST}$"), handle_main_menu),
-                    MessageHandler(filters.Regex(f"^{msg.ADMIN_BUTTON_USERS}$"), handle_main_menu),
+                    MessageHandler(main_menu_router.filter, handle_main_menu),
                 ],
                 LOCATION_SELECTION: [
                     CommandHandler('start', start),
-                    MessageHandler(filters.Regex(f"^{msg.BUTTON_BACK}$"), handle_main_menu),
+                    CallbackQueryHandler(handle_location_callback, pattern='^loc'),
+                    # Клавиатура выбора локации inline, снизу остаётся главное меню
+                    MessageHandler(main_menu_router.filter, handle_main_menu),
                     MessageHandler(filters.TEXT & ~filters.COMMAND, handle_location_selection),
                 ],
                 RATING_DRINKS: [
@@ -946,41 +1076,59 @@ def main():
                 ],
                 FEEDBACK: [
                     CommandHandler('start', start),
-                    MessageHandler(filters.Regex(f"^{msg.BUTTON_BACK}$"), handle_main_menu),
+                    MessageHandler(back_button, handle_main_menu),
                     MessageHandler(filters.TEXT & ~filters.COMMAND, handle_feedback),
                 ],
                 WAITING_RESUME: [
                     CommandHandler('start', start),
-                    MessageHandler(filters.Regex(f"^{msg.BUTTON_BACK}$"), handle_main_menu),
                     MessageHandler(filters.Document.ALL | filters.TEXT, handle_resume),
                 ],
                 COOPERATION_MENU: [
                     CommandHandler('start', start),
-                    MessageHandler(filters.Regex(f"^{msg.BUTTON_BACK}$"), handle_main_menu),
                     MessageHandler(filters.TEXT & ~filters.COMMAND, handle_cooperation_menu),
                 ],
                 WAITING_BROADCAST: [
                     CommandHandler('start', start),
-                    MessageHandler(filters.Regex(f"^{msg.BUTTON_BACK}$"), handle_main_menu),
+                    MessageHandler(back_button, handle_main_menu),
                     MessageHandler((filters.TEXT | filters.PHOTO | filters.VIDEO) & ~filters.COMMAND, handle_broadcast_text),
                 ],
                 WAITING_REPLY: [
                     CommandHandler('start', start),
-                    MessageHandler(filters.Regex(f"^{msg.BUTTON_BACK}$"), handle_main_menu),
+                    MessageHandler(back_button, handle_main_menu),
                     MessageHandler(filters.TEXT & ~filters.COMMAND, handle_admin_reply_text),
                 ]
             },
             fallbacks=[
                 CommandHandler('start', start),
-                MessageHandler(filters.Regex(f"^{msg.BUTTON_BACK}$"), handle_main_menu),
+                MessageHandler(back_button, handle_main_menu),
                 CallbackQueryHandler(handle_admin_reply, pattern='^reply_'),
+                # Кнопки локаций из ранее отправленных сообщений
+                CallbackQueryHandler(handle_location_callback, pattern='^loc'),
             ]
         )
 
+        # Антифлуд в группе -1 отбрасывает лишние обновления раньше всех остальных обработчиков
+        anti_flood = AntiFlood(FLOOD_RATE, FLOOD_BURST, FLOOD_COMMAND_COST, FLOOD_DUPLICATE_WINDOW, exempt=is_admin)
+        application.add_handler(TypeHandler(Update, anti_flood.guard_update), group=-1)
+        application.add_handler(CommandHandler(msg.CMD_USERS, handle_users_command))
+        application.add_handler(CommandHandler(msg.CMD_JOBS, handle_jobs_command))
+        application.add_handler(CommandHandler(msg.CMD_STATS, handle_stats_command))
         application.add_handler(conv_handler)
 
+        for handlers in application.handlers.values():
+            instrument_handlers(handlers)
+        UPDATE_QUEUE.set_function(application.update_queue.qsize)
+
         # Start the bot
-        application.run_polling()
+        if BOT_MODE == 'webhook':
+            from webhook import WebhookServer, run_webhook
+
+            if not WEBHOOK_SECRET:
+                logger.warning("WEBHOOK_SECRET is not set, webhook requests are not authenticated")
+            server = WebhookServer(application, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET)
+            asyncio.run(run_webhook(application, server, WEBHOOK_URL, WEBHOOK_SECRET))
+        else:
+            application.run_polling()
 
     except Exception as e:
         logger.error(f"Error starting bot: {e}")
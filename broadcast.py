@@ -0,0 +1,436 @@
+import os
+import json
+import time
+import asyncio
+import threading
+import logging
+from collections import deque
+
+from telegram.error import TelegramError, RetryAfter, NetworkError, Forbidden, BadRequest
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_MESSAGES = Counter('bot_broadcast_messages_total', 'Broadcast deliveries by result', ['result'])
+BROADCAST_RETRIES = Counter('bot_broadcast_retries_total', 'Broadcast sends retried after flood control or network errors')
+
+# Ошибки 400, после которых писать пользователю бессмысленно
+UNREACHABLE_MESSAGES = (
+    'chat not found',
+    'user is deactivated',
+    'peer_id_invalid',
+    "bot can't initiate conversation",
+)
+
+
+def classify_error(error):
+    """Return 'retry', 'unreachable' or 'failed' for a send error"""
+    if isinstance(error, Forbidden):
+        return 'unreachable'
+    # BadRequest наследует NetworkError, поэтому проверяется раньше
+    if isinstance(error, BadRequest):
+        if any(text in error.message.lower() for text in UNREACHABLE_MESSAGES):
+            return 'unreachable'
+        return 'failed'
+    if isinstance(error, (RetryAfter, NetworkError)):
+        return 'retry'
+    return 'failed'
+
+
+class TokenBucket:
+    """Token bucket rate limiter: rate tokens per second, bursts up to capacity"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Take a token if one is available right now"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        async with self._lock:
+            while not self.try_acquire():
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ChatLimiter:
+    """Keeps at least interval seconds between messages to the same chat"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_allowed = {}
+
+    async def wait(self, chat_id):
+        now = time.monotonic()
+        next_allowed = self._next_allowed.get(chat_id, now)
+        self._next_allowed[chat_id] = max(now, next_allowed) + self.interval
+        if next_allowed > now:
+            await asyncio.sleep(next_allowed - now)
+        if len(self._next_allowed) > 10000:
+            self._prune(now)
+
+    def _prune(self, now):
+        self._next_allowed = {chat: t for chat, t in self._next_allowed.items() if t > now}
+
+
+class BroadcastJob:
+    """A single broadcast: what to send and how far it got
+
+    Recipients are processed in ascending user id order. cursor is the
+    highest id such that every recipient up to it is processed; done_ids
+    holds recipients above the cursor that finished out of order. Together
+    they let a restarted job skip exactly the users already handled.
+    """
+
+    PERSISTED = ('job_id', 'kind', 'text', 'media', 'total', 'sent', 'failed', 'unreachable', 'state',
+                 'cursor', 'status_chat_id', 'status_message_id', 'finished_at')
+    FINISHED = ('done', 'cancelled')
+
+    def __init__(self, job_id, kind, text=None, media=None, total=0):
+        self.job_id = job_id
+        self.kind = kind  # 'text', 'photo' или 'video'
+        self.text = text
+        self.media = media
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.unreachable = 0
+        self.state = 'running'  # running, paused, cancelled, done
+        self.cursor = None
+        self.done_ids = set()
+        self.status_chat_id = None
+        self.status_message_id = None
+        self.finished_at = None  # Время (time.time()) завершения или отмены
+        self.stop_requested = False
+        self.started = time.monotonic()
+        self._inflight = deque()
+
+    @property
+    def done(self):
+        return self.sent + self.failed + self.unreachable
+
+    @property
+    def active(self):
+        return self.state == 'running' and not self.stop_requested
+
+    def begin(self):
+        """Forget in-flight recipients of a previous run before dispatching again"""
+        self._inflight.clear()
+
+    def dispatched(self, user_id):
+        """Record that user_id is handed to a worker"""
+        self._inflight.append(user_id)
+
+    def skip(self, user_id):
+        """Pass over a recipient processed before a restart"""
+        self._inflight.append(user_id)
+        self._advance()
+
+    def finished(self, user_id, result):
+        """Record the outcome ('sent', 'failed' or 'unreachable') for user_id and move the cursor"""
+        if result == 'sent':
+            self.sent += 1
+        elif result == 'unreachable':
+            self.unreachable += 1
+        else:
+            self.failed += 1
+        self.done_ids.add(user_id)
+        self._advance()
+
+    def _advance(self):
+        while self._inflight and self._inflight[0] in self.done_ids:
+            self.cursor = self._inflight.popleft()
+            self.done_ids.discard(self.cursor)
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in self.PERSISTED}
+        data['done_ids'] = sorted(self.done_ids)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data['job_id'], data['kind'])
+        for name in cls.PERSISTED:
+            setattr(job, name, data.get(name, getattr(job, name)))
+        job.done_ids = set(data.get('done_ids', []))
+        return job
+
+
+class BroadcastEngine:
+    """Sends broadcast jobs with bounded concurrency under Telegram rate limits
+
+    All jobs share one global token bucket and per-chat limiter. RetryAfter
+    pauses every worker for the requested time; network errors are retried
+    with exponential backoff. Blocked, deleted and unknown chats are reported
+    as unreachable; other Telegram errors fail that recipient.
+    """
+
+    def __init__(self, concurrency=20, rate=25, per_chat_interval=1.0,
+                 max_retries=3, backoff=1.0, progress_interval=3.0):
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate)
+        self.chats = ChatLimiter(per_chat_interval)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.progress_interval = progress_interval
+        self.pause_until = 0
+
+    async def run(self, bot, job, user_ids, on_progress=None, on_unreachable=None):
+        """Send job to user ids in ascending order until done, paused or cancelled
+
+        on_progress(job) is called periodically and once at the end;
+        on_unreachable(user_id) for every recipient that can't be reached.
+        """
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [
+            asyncio.create_task(self._worker(bot, job, queue, on_unreachable))
+            for _ in range(self.concurrency)
+        ]
+        reporter = asyncio.create_task(self._report(job, on_progress)) if on_progress else None
+        job.begin()
+        try:
+            for user_id in user_ids:
+                if not job.active:
+                    break
+                user_id = int(user_id)
+                if user_id in job.done_ids:
+                    job.skip(user_id)
+                    continue
+                job.dispatched(user_id)
+                await queue.put(user_id)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            if job.active:
+                job.state = 'done'
+        finally:
+            for task in workers:
+                task.cancel()
+            if reporter:
+                reporter.cancel()
+
+        if on_progress:
+            await self._notify(job, on_progress)
+        logger.info(
+            f"Broadcast {job.job_id} {job.state}: {job.sent} sent, "
+            f"{job.failed} failed, {job.unreachable} unreachable"
+        )
+
+    async def deliver(self, bot, job, user_id):
+        """Send job to one user with retries, return 'sent', 'failed' or 'unreachable'"""
+        for attempt in range(self.max_retries + 1):
+            delay = self.pause_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.bucket.acquire()
+            await self.chats.wait(user_id)
+            try:
+                await self._send(bot, job, user_id)
+                return 'sent'
+            except RetryAfter as e:
+                BROADCAST_RETRIES.inc()
+                logger.warning(f"Flood control in broadcast {job.job_id}, pausing {e.retry_after}s")
+                self.pause_until = max(self.pause_until, time.monotonic() + e.retry_after)
+            except TelegramError as e:
+                result = classify_error(e)
+                if result == 'retry':
+                    BROADCAST_RETRIES.inc()
+                    logger.warning(f"Network error sending to {user_id}, retrying: {e}")
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+                elif result == 'unreachable':
+                    logger.info(f"User {user_id} is unreachable: {e}")
+                    return result
+                else:
+                    logger.error(f"Failed to send {job.kind} to {user_id}: {e}")
+                    return result
+        logger.error(f"Failed to send {job.kind} to {user_id}: retries exhausted")
+        return 'failed'
+
+    async def _worker(self, bot, job, queue, on_unreachable):
+        while True:
+            user_id = await queue.get()
+            if user_id is None:
+                return
+            if not job.active:
+                # Остаток очереди не отправляем: он останется за курсором до продолжения
+                continue
+            result = await self.deliver(bot, job, user_id)
+            BROADCAST_MESSAGES.labels(result).inc()
+            job.finished(user_id, result)
+            if result == 'unreachable' and on_unreachable:
+                on_unreachable(user_id)
+
+    async def _send(self, bot, job, user_id):
+        if job.kind == 'photo':
+            await bot.send_photo(chat_id=user_id, photo=job.media, caption=job.text)
+        elif job.kind == 'video':
+            await bot.send_video(chat_id=user_id, video=job.media, caption=job.text)
+        else:
+            await bot.send_message(chat_id=user_id, text=job.text)
+
+    async def _report(self, job, on_progress):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            await self._notify(job, on_progress)
+
+    async def _notify(self, job, on_progress):
+        try:
+            await on_progress(job)
+        except Exception as e:
+            logger.error(f"Error reporting broadcast progress: {e}")
+
+
+class BroadcastManager:
+    """Owns broadcast jobs, their background tasks and persisted checkpoints
+
+    recipients(after) must yield user ids in ascending order starting after
+    the given id (or from the beginning for None). format_status(job)
+    returns the text of the admin's status message. on_unreachable(user_id)
+    is called for recipients that blocked the bot or no longer exist.
+    Done and cancelled jobs are forgotten retention seconds after they
+    finished, so checkpoints don't grow with every broadcast ever sent.
+    """
+
+    def __init__(self, engine, jobs_file, recipients, format_status, on_unreachable=None, retention=30 * 86400):
+        self.engine = engine
+        self.jobs_file = jobs_file
+        self.recipients = recipients
+        self.format_status = format_status
+        self.on_unreachable = on_unreachable
+        self.retention = retention
+        self.jobs = {}
+        self._tasks = {}
+        self._status_texts = {}
+        self._write_lock = threading.Lock()  # Чекпоинты разных задач пишут один файл
+
+    def load(self):
+        """Load persisted jobs"""
+        try:
+            if os.path.exists(self.jobs_file):
+                with open(self.jobs_file, 'r', encoding='utf-8') as f:
+                    for data in json.load(f):
+                        job = BroadcastJob.from_dict(data)
+                        self.jobs[job.job_id] = job
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Error loading broadcast jobs: {e}")
+
+    def restore(self, bot):
+        """Resume jobs that were running when the process stopped"""
+        for job in self.jobs.values():
+            if job.state == 'running':
+                logger.info(f"Resuming broadcast {job.job_id} after user {job.cursor}")
+                self._spawn(bot, job)
+
+    def start(self, bot, job):
+        """Register a new job and start sending it"""
+        self.jobs[job.job_id] = job
+        self._spawn(bot, job)
+
+    def pause(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.state != 'running':
+            return False
+        job.state = 'paused'
+        return True
+
+    def resume(self, bot, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.state != 'paused' or job_id in self._tasks:
+            return False
+        job.state = 'running'
+        self._spawn(bot, job)
+        return True
+
+    async def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.state not in ('running', 'paused'):
+            return False
+        job.state = 'cancelled'
+        if job_id not in self._tasks:
+            await self.checkpoint()
+        return True
+
+    async def shutdown(self):
+        """Stop dispatching, let in-flight sends finish and save checkpoints"""
+        for job in self.jobs.values():
+            job.stop_requested = True
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        await self.checkpoint()
+
+    def listed(self, limit):
+        """Return (running and paused jobs plus the limit most recently finished, number of finished left out)"""
+        finished = [job for job in self.jobs.values() if job.state in BroadcastJob.FINISHED]
+        finished.sort(key=lambda job: job.finished_at or float('inf'))
+        shown = finished[-limit:] if limit > 0 else []
+        active = [job for job in self.jobs.values() if job.state not in BroadcastJob.FINISHED]
+        return active + shown[::-1], len(finished) - len(shown)
+
+    async def checkpoint(self):
+        """Drop expired finished jobs and persist the rest"""
+        self._expire()
+        data = [job.to_dict() for job in self.jobs.values()]
+        try:
+            await asyncio.to_thread(self._write, data)
+        except OSError as e:
+            logger.error(f"Error saving broadcast jobs: {e}")
+
+    def _expire(self):
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.state not in BroadcastJob.FINISHED or job_id in self._tasks:
+                continue
+            if job.finished_at is None:
+                # Задачи из старых чекпоинтов получают отметку при первом сохранении
+                job.finished_at = now
+            elif now - job.finished_at > self.retention:
+                del self.jobs[job_id]
+                self._status_texts.pop(job_id, None)
+
+    def _write(self, data):
+        tmp_path = f"{self.jobs_file}.tmp"
+        with self._write_lock:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.jobs_file)
+
+    def _spawn(self, bot, job):
+        job.stop_requested = False
+        self._tasks[job.job_id] = asyncio.create_task(self._run(bot, job))
+
+    async def _run(self, bot, job):
+        async def on_progress(job):
+            await self.checkpoint()
+            await self._edit_status(bot, job)
+
+        try:
+            await self.engine.run(bot, job, self.recipients(job.cursor), on_progress, self.on_unreachable)
+        except Exception as e:
+            logger.error(f"Error in broadcast {job.job_id}: {e}")
+        finally:
+            self._tasks.pop(job.job_id, None)
+            await self.checkpoint()
+
+    async def _edit_status(self, bot, job):
+        if job.status_chat_id is None:
+            return
+        text = self.format_status(job)
+        if self._status_texts.get(job.job_id) == text:
+            return
+        await bot.edit_message_text(chat_id=job.status_chat_id, message_id=job.status_message_id, text=text)
+        self._status_texts[job.job_id] = text
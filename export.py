@@ -0,0 +1,85 @@
+import io
+import csv
+import gzip
+import json
+import tempfile
+
+import messages as msg
+
+EXPORT_FORMATS = ('txt', 'csv', 'jsonl')
+EXPORT_FIELDS = ('user_id', 'username', 'first_name', 'last_name', 'active')
+
+# До этого размера выгрузка держится в памяти, дальше уходит во временный файл
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
+def _row(user_id, user_info):
+    return {
+        'user_id': user_id,
+        'username': user_info.get('username', ''),
+        'first_name': user_info.get('first_name', ''),
+        'last_name': user_info.get('last_name', ''),
+        'active': not user_info.get('inactive', False),
+    }
+
+
+def iter_txt(users):
+    yield "Список пользователей\n"
+    yield "==================\n\n"
+    for user_id, user_info in users:
+        row = _row(user_id, user_info)
+        yield msg.ADMIN_USER_INFO.format(
+            user_id=row['user_id'],
+            username=row['username'],
+            first_name=row['first_name'],
+            last_name=row['last_name']
+        )
+        yield "\n" + "=" * 40 + "\n\n"
+
+
+def iter_csv(users):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for user_id, user_info in users:
+        row = _row(user_id, user_info)
+        writer.writerow([row[field] for field in EXPORT_FIELDS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_jsonl(users):
+    for user_id, user_info in users:
+        yield json.dumps(_row(user_id, user_info), ensure_ascii=False) + "\n"
+
+
+EXPORTERS = {
+    'txt': iter_txt,
+    'csv': iter_csv,
+    'jsonl': iter_jsonl,
+}
+
+
+def export_filename(fmt, compress):
+    """Return the document name for an export"""
+    name = 'users_list.txt' if fmt == 'txt' else f'users.{fmt}'
+    return f'{name}.gz' if compress else name
+
+
+def build_export(users, fmt='txt', compress=False):
+    """Stream (user_id, profile) pairs into a private spooled file, return it rewound
+
+    Rows are encoded one at a time, so memory stays bounded for large user
+    bases. Each call gets its own file, so concurrent exports don't race.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    sink = gzip.GzipFile(fileobj=spool, mode='wb') if compress else spool
+    for chunk in EXPORTERS[fmt](users):
+        if chunk:
+            sink.write(chunk.encode('utf-8'))
+    if compress:
+        sink.close()
+    spool.seek(0)
+    return spool
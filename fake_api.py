@@ -0,0 +1,234 @@
+"""Local stand-in for the Telegram Bot API, for load tests
+
+Point the bot at it with BOT_API_URL=http://127.0.0.1:<port>/bot and feed
+it updates with push_update(); everything the bot sends is recorded per
+chat and can be awaited with wait_for(). After setWebhook, updates are
+POSTed to the bot's webhook instead of being served by getUpdates.
+"""
+import json
+import random
+import asyncio
+import logging
+import itertools
+from email import policy
+from email.parser import BytesParser
+from urllib.parse import parse_qsl
+
+import httpx
+
+from http_server import HttpServer, Response
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}
+# Методы, на которые можно ответить 429, как настоящий API при превышении лимитов
+LIMITED_PREFIXES = ('send', 'edit', 'answer', 'copy', 'forward')
+
+
+def parse_params(headers, body):
+    """Decode Bot API method parameters from a form, multipart or JSON body"""
+    content_type = headers.get('content-type', '')
+    if content_type.startswith('application/json'):
+        return json.loads(body) if body else {}
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser(policy=policy.HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            if part.get_filename():
+                params[name] = part.get_content()
+            else:
+                params[name] = part.get_payload(decode=True).decode('utf-8')
+        return params
+    return dict(parse_qsl(body.decode('utf-8')))
+
+
+class FakeBotApi(HttpServer):
+    """Bot API server that serves updates and records the bot's replies
+
+    latency (+ random jitter) is added to every method except getUpdates.
+    A rate_limit_ratio share of send/edit/answer calls fails with 429 and
+    retry_after seconds, like Telegram's flood control.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0,
+                 rate_limit_ratio=0.0, retry_after=1, seed=None):
+        super().__init__(host, port, max_body=50 * 1024 * 1024)
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.counters = {}
+        self.rate_limited = 0
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self._inboxes = {}
+        self._client = None
+        self._deliveries = set()
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/bot"
+
+    def watch(self, chat_id):
+        """Start recording messages the bot sends to chat_id"""
+        self._inboxes.setdefault(int(chat_id), asyncio.Queue())
+
+    async def stop(self):
+        if self._deliveries:
+            await asyncio.gather(*self._deliveries, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        await super().stop()
+
+    def push_update(self, update):
+        """Queue an update dict for the bot; update_id is assigned here"""
+        update = dict(update, update_id=next(self._update_ids))
+        if self.webhook_url:
+            task = asyncio.create_task(self._deliver(update))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+        else:
+            self._updates.append(update)
+            self._new_updates.set()
+        return update['update_id']
+
+    async def _deliver(self, update):
+        if self._client is None:
+            self._client = httpx.AsyncClient(limits=httpx.Limits(max_connections=40))
+        headers = {'X-Telegram-Bot-Api-Secret-Token': self.webhook_secret} if self.webhook_secret else {}
+        try:
+            response = await self._client.post(self.webhook_url, json=update, headers=headers)
+            if response.status_code != 200:
+                logger.warning(f"Webhook answered {response.status_code} to update {update['update_id']}")
+        except httpx.HTTPError as e:
+            logger.error(f"Webhook delivery failed: {e}")
+
+    async def wait_for(self, chat_id, predicate, timeout):
+        """Return the first recorded (method, params, message_id) for chat_id matching predicate
+
+        Earlier non-matching calls are discarded. Raises asyncio.TimeoutError.
+        """
+        inbox = self._inboxes[int(chat_id)]
+
+        async def next_match():
+            while True:
+                call = await inbox.get()
+                if predicate(call[0], call[1]):
+                    return call
+
+        return await asyncio.wait_for(next_match(), timeout)
+
+    async def handle(self, request):
+        parts = request.path.rsplit('/', 2)
+        if len(parts) != 3 or not parts[1].startswith('bot'):
+            return Response(404)
+        name = parts[2]
+        try:
+            params = parse_params(request.headers, request.body)
+        except Exception as e:
+            logger.error(f"Bad {name} request: {e}")
+            return self._reply(400, {'ok': False, 'error_code': 400, 'description': 'Bad Request'})
+        self.counters[name] = self.counters.get(name, 0) + 1
+
+        if name == 'getUpdates':
+            return self._reply(200, {'ok': True, 'result': await self._get_updates(params)})
+
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        if (self.rate_limit_ratio and name.startswith(LIMITED_PREFIXES)
+                and self.random.random() < self.rate_limit_ratio):
+            self.rate_limited += 1
+            return self._reply(429, {
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            })
+
+        result = self._call(name, params)
+        return self._reply(200, {'ok': True, 'result': result})
+
+    def _reply(self, status, payload):
+        return Response(status, json.dumps(payload, ensure_ascii=False).encode('utf-8'), 'application/json')
+
+    async def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+        # Подтверждённые обновления больше не нужны
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates and timeout > 0:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    def _call(self, name, params):
+        if name == 'getMe':
+            return BOT_USER
+        if name == 'setWebhook':
+            self.webhook_url = params.get('url') or None
+            self.webhook_secret = params.get('secret_token')
+            return True
+        if name == 'deleteWebhook':
+            self.webhook_url = None
+            return True
+        if name in ('answerCallbackQuery', 'setMyCommands', 'deleteMessage'):
+            return True
+
+        chat_id = params.get('chat_id')
+        message = {
+            'message_id': int(params.get('message_id') or next(self._message_ids)),
+            'date': 0,
+            'chat': {'id': int(chat_id or 0), 'type': 'private'},
+            'from': BOT_USER,
+        }
+        if 'text' in params:
+            message['text'] = params['text']
+        if 'caption' in params:
+            message['caption'] = params['caption']
+        if params.get('reply_markup'):
+            # В ответе Telegram у сообщения бывает только inline-клавиатура
+            markup = json.loads(params['reply_markup'])
+            if 'inline_keyboard' in markup:
+                message['reply_markup'] = markup
+
+        if name == 'sendPhoto':
+            message['photo'] = [self._file('photo')]
+        elif name == 'sendDocument':
+            message['document'] = self._file('document')
+        elif name == 'sendMediaGroup':
+            media = json.loads(params['media'])
+            result = []
+            for item in media:
+                result.append(dict(message, message_id=next(self._message_ids), photo=[self._file(item['type'])]))
+            self._record(chat_id, name, params, result[0]['message_id'])
+            return result
+
+        self._record(chat_id, name, params, message['message_id'])
+        return message
+
+    def _file(self, kind):
+        file_id = f"{kind}-{next(self._file_ids)}"
+        return {'file_id': file_id, 'file_unique_id': file_id, 'width': 1, 'height': 1}
+
+    def _record(self, chat_id, name, params, message_id):
+        try:
+            inbox = self._inboxes.get(int(chat_id))
+        except (TypeError, ValueError):
+            return
+        if inbox is not None:
+            inbox.put_nowait((name, params, message_id))
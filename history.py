@@ -0,0 +1,364 @@
+"""Rating history: every rating as a timestamped event in columnar arrays
+
+Events are kept in memory as parallel arrays (time, user, location, kind,
+value) and appended to disk in segments, one per flush:
+
+    header   magic, event count, size of the location table, CRC32 of the rest
+    names    JSON list of location keys; location column indexes into it, the
+             table of the last segment applies to all events
+    columns  int64 time, int64 user, uint16 location, uint8 kind, int8 value
+
+Analytics work on a per-day histogram of values for every location and
+kind, built on first use with numpy.bincount (numpy is imported only
+then; a plain loop stands in if it is missing) and updated incrementally
+afterwards. Queries then cost O(days) no matter how many events there are.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import array
+import struct
+import logging
+import datetime
+import threading
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('drink', 'service')
+MAX_RATING = 5
+DAY = 86400
+SEGMENT_MAGIC = b'RHS1'
+SEGMENT_HEADER = struct.Struct('<4sIII')  # magic, count, names size, crc32
+COLUMNS = (('time', 'q'), ('user', 'q'), ('location', 'H'), ('kind', 'B'), ('value', 'b'))
+
+
+def _local_offset():
+    return int(datetime.datetime.now().astimezone().utcoffset().total_seconds())
+
+
+class RatingHistory:
+    """Append-only store of rating events with per-day aggregates
+
+    Days are counted in local time (utc_offset seconds east of UTC). Like
+    Storage, record() calls on_dirty when set so a WriteBehind can flush
+    in the background, and flushes immediately otherwise.
+    """
+
+    on_dirty = None
+
+    def __init__(self, path, utc_offset=None):
+        self.path = path
+        self.utc_offset = _local_offset() if utc_offset is None else utc_offset
+        self.locations = []
+        self.columns = {name: array.array(typecode) for name, typecode in COLUMNS}
+        self._location_ids = {}
+        self._flushed = 0
+        self._names_changed = False
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._fp = None
+        self._first_day = None
+        self._rollup = None  # (location id, kind id) -> array: day * MAX_RATING + value - 1 -> count
+
+    def __len__(self):
+        return len(self.columns['time'])
+
+    def load(self):
+        """Read all segments
+
+        A segment with a bad checksum is skipped and the ones after it are
+        still read. Only an incomplete tail left by a crash is cut off, and
+        its bytes are appended to <path>.damaged first.
+        """
+        self.columns = {name: array.array(typecode) for name, typecode in COLUMNS}
+        self.locations = []
+        self._rollup = None
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            position = 0
+            while position < len(data):
+                end = self._segment_end(data, position)
+                if end is not None and self._read_segment(data, position, end):
+                    position = end
+                    continue
+                # Испорченный заголовок мог дать неверную длину, поэтому ищем следующий целый сегмент
+                following = self._find_segment(data, position + 1)
+                if following is not None:
+                    logger.warning(f"Damaged rating history at bytes {position}-{following}, skipping")
+                    position = following
+                elif end is not None:
+                    logger.warning(f"Damaged last rating history segment at byte {position}, skipping")
+                    break
+                else:
+                    self._cut_tail(data, position)
+                    break
+        self._location_ids = {name: index for index, name in enumerate(self.locations)}
+        self._flushed = len(self)
+
+    def _segment_end(self, data, position):
+        """Return where the segment at position ends, or None if it can't be a complete segment"""
+        if len(data) - position < SEGMENT_HEADER.size:
+            return None
+        magic, count, names_size, _ = SEGMENT_HEADER.unpack_from(data, position)
+        end = position + SEGMENT_HEADER.size + names_size + count * sum(array.array(t).itemsize for _, t in COLUMNS)
+        if magic != SEGMENT_MAGIC or end > len(data):
+            return None
+        return end
+
+    def _segment_valid(self, data, position, end):
+        crc = SEGMENT_HEADER.unpack_from(data, position)[3]
+        return zlib.crc32(memoryview(data)[position + SEGMENT_HEADER.size:end]) == crc
+
+    def _find_segment(self, data, start):
+        """Return the position of the next complete segment with a valid checksum, or None"""
+        position = data.find(SEGMENT_MAGIC, start)
+        while position != -1:
+            end = self._segment_end(data, position)
+            if end is not None and self._segment_valid(data, position, end):
+                return position
+            position = data.find(SEGMENT_MAGIC, position + 1)
+        return None
+
+    def _cut_tail(self, data, position):
+        logger.warning(f"Incomplete rating history tail at byte {position}, moving it to {self.path}.damaged")
+        with open(f"{self.path}.damaged", 'ab') as f:
+            f.write(data[position:])
+        with open(self.path, 'r+b') as f:
+            f.truncate(position)
+
+    def _read_segment(self, data, position, end):
+        """Append the events of a complete segment; return False if its checksum is wrong"""
+        if not self._segment_valid(data, position, end):
+            return False
+        _, count, names_size, _ = SEGMENT_HEADER.unpack_from(data, position)
+        body = memoryview(data)[position + SEGMENT_HEADER.size:end]
+
+        self.locations = json.loads(bytes(body[:names_size]))
+        offset = names_size
+        for name, typecode in COLUMNS:
+            column = array.array(typecode)
+            size = count * column.itemsize
+            column.frombytes(body[offset:offset + size])
+            if sys.byteorder == 'big':
+                column.byteswap()
+            self.columns[name].extend(column)
+            offset += size
+        return True
+
+    def record(self, user_id, location, kind, value, timestamp=None):
+        """Append one rating event (kind is 'drink' or 'service')"""
+        timestamp = int(time.time() if timestamp is None else timestamp)
+        with self._lock:
+            location_id = self._location_ids.get(location)
+            if location_id is None:
+                location_id = self._location_ids[location] = len(self.locations)
+                self.locations.append(location)
+            kind_id = KINDS.index(kind)
+            self.columns['time'].append(timestamp)
+            self.columns['user'].append(int(user_id))
+            self.columns['location'].append(location_id)
+            self.columns['kind'].append(kind_id)
+            self.columns['value'].append(value)
+            if self._rollup is not None:
+                self._add_to_rollup(location_id, kind_id, self._day(timestamp), value)
+        if self.on_dirty is None:
+            self.flush()
+        else:
+            self.on_dirty()
+
+    def flush(self):
+        """Append events recorded since the last flush as one segment"""
+        with self._io_lock:
+            with self._lock:
+                start, end = self._flushed, len(self)
+                if start == end and not self._names_changed:
+                    return
+                self._names_changed = False
+                parts = [json.dumps(self.locations, ensure_ascii=False).encode('utf-8')]
+                names_size = len(parts[0])
+                for name, _ in COLUMNS:
+                    column = self.columns[name][start:end]
+                    if sys.byteorder == 'big':
+                        column.byteswap()
+                    parts.append(column.tobytes())
+            body = b''.join(parts)
+            if self._fp is None:
+                self._fp = open(self.path, 'ab')
+            self._fp.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, end - start, names_size, zlib.crc32(body)) + body)
+            self._fp.flush()
+            os.fsync(self._fp.fileno())
+            self._flushed = end
+
+    def rename_location(self, old, new):
+        """Show all events of location old under new; return False if old is unknown or new is taken"""
+        with self._lock:
+            location_id = self._location_ids.get(old)
+            if location_id is None or new in self._location_ids:
+                return False
+            # События ссылаются на индекс в таблице имён, достаточно заменить имя в ней
+            self.locations[location_id] = new
+            self._location_ids[new] = self._location_ids.pop(old)
+            self._names_changed = True
+        self.flush()
+        return True
+
+    def close(self):
+        """Flush outstanding events and close the file"""
+        self.flush()
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def _day(self, timestamp):
+        return (timestamp + self.utc_offset) // DAY
+
+    def _add_to_rollup(self, location_id, kind_id, day, value):
+        if not 1 <= value <= MAX_RATING:
+            return
+        if self._first_day is None:
+            self._first_day = day
+        series = self._rollup.setdefault((location_id, kind_id), array.array('q'))
+        index = (day - self._first_day) * MAX_RATING + value - 1
+        if index < 0:
+            # Событие раньше начала свёртки: пересоберём её целиком
+            self._rollup = None
+            return
+        if index >= len(series):
+            series.extend([0] * ((index // MAX_RATING + 1) * MAX_RATING - len(series)))
+        series[index] += 1
+
+    def _build_rollup(self, columns):
+        """Return (first day, per-day value histograms for every (location, kind)) of columns"""
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+
+        times, values = columns['time'], columns['value']
+        rollup = {}
+        if not times:
+            return None, rollup
+        first_day = self._day(min(times))
+        if numpy is not None:
+            # Все события раскладываются по корзинам одним bincount
+            days = (numpy.frombuffer(times, dtype=numpy.int64) + self.utc_offset) // DAY - first_day
+            value = numpy.frombuffer(values, dtype=numpy.int8).astype(numpy.int64)
+            series_id = (numpy.frombuffer(columns['location'], dtype=numpy.uint16).astype(numpy.int64) * len(KINDS)
+                         + numpy.frombuffer(columns['kind'], dtype=numpy.uint8))
+            valid = (value >= 1) & (value <= MAX_RATING)
+            width = (int(days.max()) + 1) * MAX_RATING
+            keys = series_id[valid] * width + days[valid] * MAX_RATING + value[valid] - 1
+            counts = numpy.bincount(keys, minlength=(int(series_id.max()) + 1) * width).reshape(-1, width)
+            for index in numpy.flatnonzero(counts.any(axis=1)):
+                rollup[divmod(int(index), len(KINDS))] = array.array('q', counts[index].tobytes())
+        else:
+            width_days = self._day(max(times)) - first_day + 1
+            locations, kinds = columns['location'], columns['kind']
+            for timestamp, location_id, kind_id, value in zip(times, locations, kinds, values):
+                if 1 <= value <= MAX_RATING:
+                    series = rollup.get((location_id, kind_id))
+                    if series is None:
+                        series = rollup[(location_id, kind_id)] = array.array('q', bytes(8 * width_days * MAX_RATING))
+                    series[(self._day(timestamp) - first_day) * MAX_RATING + value - 1] += 1
+        return first_day, rollup
+
+    def _ensure_rollup(self):
+        """Build the rollup if needed without holding the lock while it is computed"""
+        with self._lock:
+            if self._rollup is not None:
+                return
+            # Копии столбцов: массив, отданный numpy через буфер, нельзя дописывать
+            count = len(self)
+            columns = {name: column[:count] for name, column in self.columns.items()}
+        first_day, rollup = self._build_rollup(columns)
+        with self._lock:
+            if self._rollup is not None:
+                return
+            self._first_day, self._rollup = first_day, rollup
+            # События, записанные пока свёртка строилась
+            times, locations = self.columns['time'], self.columns['location']
+            kinds, values = self.columns['kind'], self.columns['value']
+            for index in range(count, len(self)):
+                if self._rollup is None:
+                    break
+                self._add_to_rollup(locations[index], kinds[index], self._day(times[index]), values[index])
+
+    def _histograms(self, location, kind):
+        """Return (first day, per-day histograms) for location and kind"""
+        while True:
+            self._ensure_rollup()
+            with self._lock:
+                # Свёртку могло сбросить событие раньше её начала, тогда строим заново
+                if self._rollup is not None:
+                    location_id = self._location_ids.get(location)
+                    series = self._rollup.get((location_id, KINDS.index(kind)), array.array('q'))
+                    return self._first_day, [series[i:i + MAX_RATING] for i in range(0, len(series), MAX_RATING)]
+
+    def _select_days(self, location, kind, since, until):
+        first_day, days = self._histograms(location, kind)
+        if first_day is None:
+            return []
+        selected = []
+        for offset, histogram in enumerate(days):
+            date = datetime.date.fromordinal(datetime.date(1970, 1, 1).toordinal() + first_day + offset)
+            if (since is None or date >= since) and (until is None or date <= until):
+                selected.append((date, histogram))
+        return selected
+
+    def timeline(self, location, kind, period='day', window=7, since=None, until=None):
+        """Return [(period start date, count, mean, rolling mean over window periods)]
+
+        period is 'day' or 'week' (weeks start on Monday); since and until
+        are dates. Means are None for periods without ratings.
+        """
+        buckets = {}
+        for date, histogram in self._select_days(location, kind, since, until):
+            start = date - datetime.timedelta(days=date.weekday()) if period == 'week' else date
+            total = buckets.setdefault(start, [0, 0])
+            total[0] += sum(histogram)
+            total[1] += sum(count * (value + 1) for value, count in enumerate(histogram))
+
+        rows = []
+        window_counts, window_sums = [], []
+        for start in sorted(buckets):
+            count, value_sum = buckets[start]
+            window_counts.append(count)
+            window_sums.append(value_sum)
+            rolling_count = sum(window_counts[-window:])
+            rows.append((
+                start,
+                count,
+                value_sum / count if count else None,
+                sum(window_sums[-window:]) / rolling_count if rolling_count else None,
+            ))
+        return rows
+
+    def distribution(self, location, kind, since=None, until=None):
+        """Return counts of ratings 1..MAX_RATING"""
+        totals = [0] * MAX_RATING
+        for _, histogram in self._select_days(location, kind, since, until):
+            for value, count in enumerate(histogram):
+                totals[value] += count
+        return totals
+
+    def percentiles(self, location, kind, qs=(50, 90), since=None, until=None):
+        """Return {q: rating} for percentiles q in 0..100, None without ratings"""
+        totals = self.distribution(location, kind, since, until)
+        count = sum(totals)
+        result = {}
+        for q in qs:
+            if not count:
+                result[q] = None
+                continue
+            # Ближайший ранг по отсортированным оценкам
+            rank = max(1, -(-q * count // 100))
+            cumulative = 0
+            for value, value_count in enumerate(totals, 1):
+                cumulative += value_count
+                if cumulative >= rank:
+                    result[q] = value
+                    break
+        return result
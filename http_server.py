@@ -0,0 +1,141 @@
+import asyncio
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1024 * 1024
+MAX_HEADER_LINES = 100
+KEEPALIVE_TIMEOUT = 75  # Telegram держит соединения открытыми между запросами
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    429: 'Too Many Requests',
+    500: 'Internal Server Error',
+}
+
+Request = namedtuple('Request', 'method path query headers body')
+Response = namedtuple('Response', 'status body content_type', defaults=(b'', 'text/plain; charset=utf-8'))
+
+
+class HttpError(Exception):
+    """Malformed request; the connection is answered with status and closed"""
+
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+class HttpServer:
+    """Minimal asyncio HTTP/1.1 server with keep-alive
+
+    Subclasses implement handle(request) and return a Response. Bodies
+    must carry Content-Length; chunked uploads are not supported.
+    """
+
+    def __init__(self, host, port, max_body=MAX_BODY_SIZE):
+        self.host = host
+        self.port = port
+        self.max_body = max_body
+        self._server = None
+        self._connections = {}  # writer -> connection task
+
+    async def handle(self, request):
+        raise NotImplementedError
+
+    async def start(self):
+        """Start listening"""
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        if not self.port:
+            self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop accepting requests and close open connections"""
+        if self._server is None:
+            return
+        self._server.close()
+        # Долгие запросы (например, getUpdates в fake_api) прерываем
+        tasks = list(self._connections.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _handle_connection(self, reader, writer):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                try:
+                    request, keep_alive = await self._read_request(request_line, reader)
+                    response = await self.handle(request)
+                except HttpError as e:
+                    response, keep_alive = Response(e.status), False
+                self._write_response(writer, response, keep_alive)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logger.error(f"Error in HTTP connection: {e}")
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def _read_request(self, request_line, reader):
+        """Read one request, return (request, keep connection open)"""
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            raise HttpError(400)
+
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise HttpError(400)
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+        if 'content-length' not in headers:
+            if method in ('POST', 'PUT'):
+                # Тело без длины не вычитать, соединение дальше не использовать
+                raise HttpError(411)
+            headers['content-length'] = '0'
+        try:
+            length = int(headers['content-length'])
+        except ValueError:
+            raise HttpError(400)
+        if length < 0:
+            raise HttpError(400)
+        if length > self.max_body:
+            raise HttpError(413)
+        body = await reader.readexactly(length)
+
+        path, _, query = target.partition('?')
+        return Request(method, path, query, headers, body), keep_alive
+
+    def _write_response(self, writer, response, keep_alive):
+        head = (
+            f"HTTP/1.1 {response.status} {REASONS.get(response.status, 'Unknown')}\r\n"
+            f"Content-Type: {response.content_type}\r\n"
+            f"Content-Length: {len(response.body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('ascii') + response.body)
@@ -0,0 +1,97 @@
+"""Import-time audit of bot startup
+
+Imports the bot module in a fresh interpreter with -X importtime and
+reports what it costs: total time, the bot's direct imports by cumulative
+time and the most expensive modules by their own time. Modules listed in
+DEFERRED must only load on first use (image rendering, rating analytics,
+admin exports, webhook server); if any of them is imported eagerly the
+audit fails.
+
+    python import_audit.py
+    python import_audit.py --top 30 --json imports.json
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFERRED = ('PIL', 'numpy', 'export', 'csv', 'gzip', 'webhook')
+
+
+def parse_importtime(output):
+    """Parse -X importtime output into (module, self_us, cumulative_us, depth) tuples"""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue  # Заголовок таблицы
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def audit(module):
+    """Import module in a subprocess, return parsed rows"""
+    env = dict(os.environ, PYTHONPATH=HERE)
+    # bot.py читает токен только в main(), но подставим его на случай проверок при импорте
+    env.setdefault('BOT_TOKEN', '123456:audit')
+    # Импорт создаёт лог и файлы хранилища, пусть они появятся во временном каталоге
+    with tempfile.TemporaryDirectory(prefix='import-audit-') as workdir:
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        )
+    rows = parse_importtime(result.stderr)
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr[-2000:])
+        raise RuntimeError(f"import {module} failed with code {result.returncode}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='bot', help='module to import (default: %(default)s)')
+    parser.add_argument('--top', type=int, default=20, help='rows per table (default: %(default)s)')
+    parser.add_argument('--json', metavar='PATH', help='also write all rows to PATH')
+    args = parser.parse_args()
+
+    rows = audit(args.module)
+    target = next((row for row in rows if row[0] == args.module), None)
+    if target is None:
+        sys.exit(f"{args.module} not found in import log")
+    # Прямые импорты целевого модуля идут перед ним на следующем уровне вложенности
+    position = rows.index(target)
+    direct = []
+    for row in reversed(rows[:position]):
+        if row[3] <= target[3]:
+            break
+        if row[3] == target[3] + 1:
+            direct.append(row)
+
+    print(f"import {args.module}: {target[2] / 1000:.1f} ms, {len(rows)} modules")
+    print(f"\n{'direct import':<40}{'cumulative ms':>15}")
+    for name, _, cumulative_us, _ in sorted(direct, key=lambda row: -row[2])[:args.top]:
+        print(f"{name:<40}{cumulative_us / 1000:>15.1f}")
+    print(f"\n{'module':<40}{'self ms':>15}")
+    for name, self_us, _, _ in sorted(rows, key=lambda row: -row[1])[:args.top]:
+        print(f"{name:<40}{self_us / 1000:>15.1f}")
+
+    eager = sorted({row[0] for row in rows if row[0].split('.')[0] in DEFERRED})
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'module': args.module, 'total_ms': target[2] / 1000, 'eager_deferred': eager,
+                       'rows': [dict(zip(('module', 'self_us', 'cumulative_us', 'depth'), row)) for row in rows]},
+                      f, ensure_ascii=False, indent=2)
+    if eager:
+        print(f"\nimported eagerly, should load on first use: {', '.join(eager)}")
+        sys.exit(1)
+    print("\ndeferred modules are not imported at startup")
+
+
+if __name__ == '__main__':
+    main()
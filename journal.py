@@ -0,0 +1,199 @@
+import os
+import json
+import logging
+import threading
+
+import snapshot
+
+logger = logging.getLogger(__name__)
+
+
+def apply_record(users_data, record):
+    """Apply one journal record to users data, return the previous rating or active value"""
+    op = record['op']
+    if op == 'rename_location':
+        # Оценки под старым ключом переносятся на новый; повторное применение ничего не меняет
+        renamed = [
+            user_id for user_id, user_info in users_data.items()
+            if any(entry.get('location') == record['from'] for entry in user_info.get('ratings', []))
+        ]
+        for user_id in renamed:
+            for entry in users_data.setdefault(user_id, {})['ratings']:
+                if entry.get('location') == record['from']:
+                    entry['location'] = record['to']
+        return None
+
+    user_info = users_data.setdefault(record['id'], {})
+
+    if op == 'user':
+        # Профиль обновляется, оценки пользователя сохраняются
+        user_info.update(record['data'])
+        return None
+
+    if op == 'rating':
+        ratings = user_info.setdefault('ratings', [])
+        for entry in ratings:
+            if entry.get('location') == record['location']:
+                break
+        else:
+            entry = {'location': record['location']}
+            ratings.append(entry)
+        previous = entry.get(record['field'])
+        entry[record['field']] = record['value']
+        return previous
+
+    if op == 'active':
+        # Флаг хранится только у неактивных, чтобы не раздувать снимок
+        previous = not user_info.get('inactive')
+        if record['value']:
+            user_info.pop('inactive', None)
+        else:
+            user_info['inactive'] = True
+        return previous
+
+    raise ValueError(f"Unknown journal op: {op}")
+
+
+class UsersJournal:
+    """Binary snapshot file plus an append-only journal of mutations since the snapshot
+
+    Records are buffered by append() and written by flush(), which may run on
+    a worker thread. Callers mutate users data while holding self.lock so a
+    snapshot never sees a half-applied record. snapshot_meta() is called
+    under the same lock and its result is stored in the snapshot.
+
+    Without a binary snapshot, users are read from legacy_path, the JSON
+    snapshot of earlier versions; the next compaction replaces it.
+    """
+
+    def __init__(self, snapshot_path, journal_path, compact_every=1000, legacy_path=None, snapshot_meta=dict):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        self.legacy_path = legacy_path
+        self.snapshot_meta = snapshot_meta
+        self.meta = None  # meta из загруженного снимка, None для JSON и пустого старта
+        self.migrated = False
+        self.loaded = False
+        self.needs_compact = False
+        self.pending = 0  # Записей в файле журнала после последнего снимка
+        self.lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._buffer = []
+        self._file = None
+
+    def load(self, on_record=None):
+        """Load the snapshot and replay the journal on top of it
+
+        on_record(record, previous) is called for every replayed record.
+        Nothing is written here; needs_compact tells the caller that the
+        journal is damaged or long, or the snapshot came from legacy JSON.
+        Until a load succeeds, flush() and compact() refuse to write, so a
+        snapshot that failed to load is never replaced.
+        """
+        self.meta = None
+        self.migrated = False
+        self.loaded = False
+        if os.path.exists(self.snapshot_path):
+            users_data, self.meta = snapshot.load(self.snapshot_path)
+        elif self.legacy_path and os.path.exists(self.legacy_path):
+            with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                users_data = snapshot.LazyUsers.from_dict(json.load(f))
+            self.migrated = True
+        else:
+            users_data = snapshot.LazyUsers()
+
+        self.pending = 0
+        damaged = False
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line_no, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                        previous = apply_record(users_data, record)
+                        self.pending += 1
+                        if on_record is not None:
+                            on_record(record, previous)
+                    except (ValueError, KeyError) as e:
+                        # Обычно это недописанная строка после аварийной остановки
+                        logger.warning(f"Skipping bad journal line {line_no}: {e}")
+                        damaged = True
+
+        # Повреждённый хвост нельзя дописывать, снимок нужно пересобрать до первой записи
+        self.needs_compact = damaged or self.migrated or self.pending >= self.compact_every
+        self.loaded = True
+        return users_data
+
+    def append(self, record):
+        """Buffer one already applied record until the next flush"""
+        self._buffer.append(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def flush(self, users_data):
+        """Write buffered records, compacting when the journal grows"""
+        self._check_loaded()
+        with self._io_lock:
+            with self.lock:
+                lines, self._buffer = self._buffer, []
+                if self.pending + len(lines) < self.compact_every:
+                    dump = None
+                else:
+                    # Снимок уже содержит все буферизованные записи
+                    dump = self._dump(users_data)
+            if dump is not None:
+                self._write_snapshot(dump, users_data)
+            elif lines:
+                if self._file is None:
+                    self._file = open(self.journal_path, 'a', encoding='utf-8')
+                self._file.writelines(lines)
+                self._file.flush()
+                self.pending += len(lines)
+
+    def compact(self, users_data):
+        """Atomically write a new snapshot and truncate the journal"""
+        self._check_loaded()
+        with self._io_lock:
+            with self.lock:
+                self._buffer = []
+                dump = self._dump(users_data)
+            self._write_snapshot(dump, users_data)
+
+    def close(self, users_data):
+        """Flush outstanding records, compact and close the journal"""
+        self.flush(users_data)
+        if self.pending:
+            self.compact(users_data)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _check_loaded(self):
+        if not self.loaded:
+            raise RuntimeError(f"{self.snapshot_path} was not loaded, refusing to overwrite it")
+
+    def _dump(self, users_data):
+        # Под блокировкой только копируем изменённых пользователей, кодирование идёт без неё
+        return users_data.freeze(), self.snapshot_meta()
+
+    def _write_snapshot(self, dump, users_data):
+        data = snapshot.encode(*dump)
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+        # Дальше данные читаются из нового снимка, в памяти остаются только изменённые после freeze()
+        columns, _ = snapshot.decode(data, self.snapshot_path)
+        with self.lock:
+            users_data.rebase(columns)
+
+        # Записи идемпотентны: если упасть до усечения журнала,
+        # повторное применение поверх нового снимка ничего не изменит
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.journal_path, 'w', encoding='utf-8')
+        self.pending = 0
+        self.needs_compact = False
@@ -0,0 +1,131 @@
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
+
+import messages as msg
+
+
+def _reply(rows):
+    return ReplyKeyboardMarkup(rows, resize_keyboard=True)
+
+
+def _rating(kind):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(str(i), callback_data=f"rate_{kind}_{i}") for i in range(1, 6)]
+    ])
+
+
+# Статические клавиатуры строятся один раз; объекты telegram неизменяемы,
+# поэтому один экземпляр безопасно отдавать во все ответы
+MAIN_MENU = _reply([
+    [msg.BUTTON_FEEDBACK],
+    [msg.BUTTON_MENU, msg.BUTTON_VACANCIES],
+    [msg.BUTTON_COOPERATION, msg.BUTTON_SUGGESTIONS],
+])
+ADMIN_MAIN_MENU = _reply([
+    [msg.BUTTON_FEEDBACK],
+    [msg.BUTTON_MENU, msg.BUTTON_VACANCIES],
+    [msg.BUTTON_COOPERATION, msg.BUTTON_SUGGESTIONS],
+    [msg.ADMIN_BUTTON_BROADCAST, msg.ADMIN_BUTTON_USERS],
+])
+VACANCIES = _reply([
+    [msg.BUTTON_SEND_RESUME],
+    [msg.BUTTON_CONTACT_ADMIN],
+    [msg.BUTTON_BACK],
+])
+COOPERATION = _reply([
+    [msg.BUTTON_BUY_FRANCHISE],
+    [msg.BUTTON_OTHER_QUESTION],
+    [msg.BUTTON_BACK],
+])
+FEEDBACK_TYPES = _reply([
+    [msg.BUTTON_QUALITY],
+    [msg.BUTTON_SERVICE],
+    [msg.BUTTON_BACK],
+])
+BACK = _reply([[msg.BUTTON_BACK]])
+DRINK_RATING = _rating('drink')
+SERVICE_RATING = _rating('service')
+
+
+def main_menu(is_admin_user=False):
+    """Return the main menu keyboard for a regular user or the admin"""
+    return ADMIN_MAIN_MENU if is_admin_user else MAIN_MENU
+
+
+# Данные кнопок выбора локации: loc:<id>, locpage:<номер страницы>
+LOCATION_CALLBACK = 'loc:'
+LOCATION_PAGE_CALLBACK = 'locpage:'
+LOCATION_BACK_CALLBACK = 'locback'
+LOCATION_NOOP_CALLBACK = 'locnoop'
+
+
+class LocationKeyboard:
+    """Paginated inline location keyboard with the current rating in each button
+
+    Button labels are cached per location and markups per page.
+    invalidate() marks a location whose aggregate changed; the next get()
+    recomputes only those labels and rebuilds only the pages where a label
+    actually changed, so a rating costs one page however many locations
+    there are.
+    """
+
+    def __init__(self, registry, label, page_size=8):
+        self.registry = registry
+        self.label = label  # Location -> button text
+        self.page_size = max(1, page_size)
+        self.pages = -(-len(registry) // self.page_size)
+        self._labels = {}  # location id -> button text
+        self._by_label = {}  # button text -> location
+        self._stale = set(registry.by_id)
+        self._markups = {}  # page -> markup
+
+    def page_of(self, location):
+        """Return the page showing location"""
+        return location.index // self.page_size
+
+    def get(self, page=0):
+        """Return the keyboard for page (clamped to the existing pages)"""
+        page = min(max(page, 0), self.pages - 1)
+        self._refresh()
+        markup = self._markups.get(page)
+        if markup is None:
+            markup = self._markups[page] = self._build(page)
+        return markup
+
+    def find(self, text):
+        """Return the location for a button label or a name sent as text, or None"""
+        self._refresh()
+        return self._by_label.get(text) or self.registry.find(text)
+
+    def invalidate(self, location_id=None):
+        """Mark one location (by id), or all of them, as changed"""
+        if location_id is None:
+            self._stale.update(self.registry.by_id)
+        elif location_id in self.registry.by_id:
+            self._stale.add(location_id)
+
+    def _refresh(self):
+        for location_id in self._stale:
+            location = self.registry.get(location_id)
+            text = self.label(location)
+            previous = self._labels.get(location_id)
+            if text != previous:
+                self._by_label.pop(previous, None)
+                self._labels[location_id] = text
+                self._by_label[text] = location
+                self._markups.pop(self.page_of(location), None)
+        self._stale.clear()
+
+    def _build(self, page):
+        start = page * self.page_size
+        rows = [
+            [InlineKeyboardButton(self._labels[location.id], callback_data=LOCATION_CALLBACK + location.id)]
+            for location in self.registry.locations[start:start + self.page_size]
+        ]
+        if self.pages > 1:
+            rows.append([
+                InlineKeyboardButton('‹', callback_data=f"{LOCATION_PAGE_CALLBACK}{(page - 1) % self.pages}"),
+                InlineKeyboardButton(f"{page + 1}/{self.pages}", callback_data=LOCATION_NOOP_CALLBACK),
+                InlineKeyboardButton('›', callback_data=f"{LOCATION_PAGE_CALLBACK}{(page + 1) % self.pages}"),
+            ])
+        rows.append([InlineKeyboardButton(msg.BUTTON_BACK, callback_data=LOCATION_BACK_CALLBACK)])
+        return InlineKeyboardMarkup(rows)
@@ -0,0 +1,237 @@
+"""Load generator: virtual users walking the feedback conversation
+
+Starts fake_api.FakeBotApi, runs bot.py against it in a temporary working
+directory and drives every virtual user through
+
+    /start -> feedback -> location -> drink rating -> service rating -> text
+
+Reports end-to-end throughput and per-step latency (update pushed until
+the bot's matching reply arrives at the fake API).
+
+    python loadgen.py --users 2000 --concurrency 500
+    python loadgen.py --latency-ms 40 --jitter-ms 20 --rate-limit 0.01
+    python loadgen.py --webhook
+"""
+import os
+import sys
+import json
+import time
+import random
+import signal
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+
+import messages as msg
+from fake_api import FakeBotApi
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOKEN = '123456:load'
+ADMIN_ID = 1
+FIRST_USER_ID = 100000
+STEPS = ('start', 'feedback', 'location', 'drink', 'service', 'text')
+
+
+def message(user_id, text):
+    return {'message': {
+        'message_id': 1,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'username': f'load{user_id}'},
+        'text': text,
+        **({'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]} if text.startswith('/') else {}),
+    }}
+
+
+def callback(user_id, data, message_id):
+    return {'callback_query': {
+        'id': f'{user_id}-{message_id}',
+        'chat_instance': str(user_id),
+        'data': data,
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load'},
+        'message': {'message_id': message_id, 'date': 0, 'chat': {'id': user_id, 'type': 'private'}, 'text': '-'},
+    }}
+
+
+def markup_contains(params, prefix):
+    markup = json.loads(params.get('reply_markup') or '{}')
+    return any(button.get('callback_data', '').startswith(prefix)
+               for row in markup.get('inline_keyboard', []) for button in row)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class VirtualUser:
+    def __init__(self, api, user_id, rng, timeout):
+        self.api = api
+        self.user_id = user_id
+        self.rng = rng
+        self.timeout = timeout
+        self.latencies = {}
+
+    async def step(self, name, update, predicate):
+        started = time.perf_counter()
+        self.api.push_update(update)
+        call = await self.api.wait_for(self.user_id, predicate, self.timeout)
+        self.latencies[name] = time.perf_counter() - started
+        return call
+
+    async def run(self):
+        user_id = self.user_id
+        self.api.watch(user_id)
+
+        await self.step('start', message(user_id, '/start'),
+                        lambda name, params: params.get('text') == msg.WELCOME_MESSAGE)
+        _, params, message_id = await self.step('feedback', message(user_id, msg.BUTTON_FEEDBACK),
+                                                lambda name, params: params.get('text') == msg.SELECT_LOCATION)
+        # Нажимаем одну из кнопок локаций на первой странице клавиатуры
+        locations = [button['callback_data'] for row in json.loads(params['reply_markup'])['inline_keyboard']
+                     for button in row if button['callback_data'].startswith('loc:')]
+        await self.step('location', callback(user_id, self.rng.choice(locations), message_id),
+                        lambda name, params: name == 'editMessageText' and markup_contains(params, 'rate_drink_'))
+        await self.step('drink', callback(user_id, f'rate_drink_{self.rng.randint(1, 5)}', message_id),
+                        lambda name, params: name == 'editMessageText' and markup_contains(params, 'rate_service_'))
+        # Оценка обслуживания не выше 4, чтобы бот попросил отзыв
+        await self.step('service', callback(user_id, f'rate_service_{self.rng.randint(1, 4)}', message_id),
+                        lambda name, params: name == 'editMessageText' and params.get('text') in (
+                            msg.FEEDBACK_SERVICE_REQUEST, msg.FEEDBACK_QUALITY_REQUEST))
+        await self.step('text', message(user_id, 'Load test feedback'),
+                        lambda name, params: params.get('text') == msg.THANKS_FEEDBACK)
+
+
+def percentile(samples, q):
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def wait_ready(api, process, webhook, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.returncode is not None:
+            raise RuntimeError(f"bot.py exited with code {process.returncode}")
+        if (api.webhook_url if webhook else api.counters.get('getUpdates')):
+            return
+        await asyncio.sleep(0.1)
+    raise RuntimeError("bot.py did not start polling in time")
+
+
+async def run(args):
+    api = FakeBotApi(
+        port=args.api_port,
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        rate_limit_ratio=args.rate_limit,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    await api.start()
+
+    workdir = tempfile.mkdtemp(prefix='loadgen-')
+    for name in ('welcome.jpg', 'menu1.jpg', 'menu2.jpg', 'menu3.jpg'):
+        if os.path.exists(os.path.join(HERE, name)):
+            os.symlink(os.path.join(HERE, name), os.path.join(workdir, name))
+    env = dict(
+        os.environ,
+        BOT_TOKEN=TOKEN,
+        ADMIN_ID=str(ADMIN_ID),
+        BOT_API_URL=api.base_url,
+        STORAGE_BACKEND=args.backend,
+        PYTHONPATH=HERE,
+    )
+    if args.webhook:
+        env.update(BOT_MODE='webhook', WEBHOOK_LISTEN='127.0.0.1', WEBHOOK_PORT=str(free_port()),
+                   WEBHOOK_PATH='/webhook', WEBHOOK_SECRET='load-secret')
+        env['WEBHOOK_URL'] = f"http://127.0.0.1:{env['WEBHOOK_PORT']}/webhook"
+    else:
+        env['BOT_MODE'] = 'polling'
+
+    log = open(os.path.join(workdir, 'bot.stderr'), 'wb')
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(HERE, 'bot.py'), cwd=workdir, env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=log,
+    )
+    try:
+        await wait_ready(api, process, args.webhook)
+
+        rng = random.Random(args.seed)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        users = [VirtualUser(api, FIRST_USER_ID + i, random.Random(rng.random()), args.timeout)
+                 for i in range(args.users)]
+        failures = {}
+
+        async def drive(user):
+            async with semaphore:
+                try:
+                    await user.run()
+                    return True
+                except asyncio.TimeoutError:
+                    step = STEPS[len(user.latencies)]
+                    failures[step] = failures.get(step, 0) + 1
+                    return False
+
+        started = time.perf_counter()
+        completed = sum(await asyncio.gather(*(drive(user) for user in users)))
+        elapsed = time.perf_counter() - started
+    finally:
+        if process.returncode is None:
+            process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(process.wait(), 30)
+            except asyncio.TimeoutError:
+                process.kill()
+        log.close()
+        await api.stop()
+        if args.keep:
+            print(f"Bot working directory kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    steps_done = sum(len(user.latencies) for user in users)
+    mode = 'webhook' if args.webhook else 'polling'
+    print(f"{args.users} users, concurrency {args.concurrency}, {mode}, {args.backend} storage, "
+          f"API latency {args.latency_ms:g}+{args.jitter_ms:g} ms, 429 ratio {args.rate_limit:g}")
+    print(f"completed flows: {completed}/{args.users} in {elapsed:.2f}s "
+          f"({completed / elapsed:.1f} flows/s, {steps_done / elapsed:.1f} updates/s)")
+    if failures:
+        print("timed out at step: " + ", ".join(f"{step} {count}" for step, count in failures.items()))
+    print(f"API calls: {sum(api.counters.values())}, answered 429: {api.rate_limited}")
+    print(f"{'step':<10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for step in STEPS + ('flow',):
+        if step == 'flow':
+            samples = [sum(user.latencies.values()) for user in users if len(user.latencies) == len(STEPS)]
+        else:
+            samples = [user.latencies[step] for user in users if step in user.latencies]
+        print(f"{step:<10}" + ''.join(
+            f"{percentile(samples, q) * 1000:>10.1f}" for q in (0.50, 0.95, 0.99, 1.0)
+        ))
+    return completed == args.users
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000, help='virtual users (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=200, help='users active at once (default: %(default)s)')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='fake API latency per call')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='random extra latency up to this value')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='share of send/edit calls answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='retry_after of injected 429 responses')
+    parser.add_argument('--timeout', type=float, default=30.0, help='seconds to wait for each reply')
+    parser.add_argument('--backend', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--webhook', action='store_true', help='run the bot in webhook mode')
+    parser.add_argument('--api-port', type=int, default=0, help='fake API port (default: any free port)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true', help="keep the bot's working directory and logs")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+
+if __name__ == '__main__':
+    main()
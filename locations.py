@@ -0,0 +1,94 @@
+"""Coffee shop locations loaded from config
+
+LOCATIONS_FILE is a JSON list of {"id": ..., "name": ...} objects in the
+order they are shown. The id is stable: ratings, aggregates and rating
+history are stored under it and it travels in callback data, so a shop
+can be renamed or the list reordered without losing anything. The name
+is only shown to users. Without the file the two original shops are used.
+"""
+import os
+import re
+import json
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+Location = namedtuple('Location', 'id name index')
+
+DEFAULT_LOCATIONS = [
+    {'id': 'degtyarev', 'name': 'Дегтярев'},
+    {'id': 'city-mall', 'name': 'Сити Молл'},
+]
+# callback_data ограничена 64 байтами, вместе с префиксом id должен в неё помещаться
+ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,48}')
+
+
+class LocationRegistry:
+    """Ordered locations with dict lookups by id and by name"""
+
+    def __init__(self, entries):
+        self.locations = []
+        self.by_id = {}
+        self.by_name = {}
+        for entry in entries:
+            location_id = str(entry.get('id', ''))
+            name = str(entry.get('name', '')).strip()
+            if not ID_PATTERN.fullmatch(location_id):
+                raise ValueError(f"Invalid location id: {location_id!r}")
+            if not name:
+                raise ValueError(f"Location {location_id} has no name")
+            if location_id in self.by_id or name in self.by_name:
+                raise ValueError(f"Duplicate location: {location_id} {name}")
+            location = Location(location_id, name, len(self.locations))
+            self.locations.append(location)
+            self.by_id[location_id] = location
+            self.by_name[name] = location
+        if not self.locations:
+            raise ValueError("No locations configured")
+
+    @classmethod
+    def load(cls, path):
+        """Read the registry from a JSON file, or use DEFAULT_LOCATIONS if there is none"""
+        if not os.path.exists(path):
+            return cls(DEFAULT_LOCATIONS)
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        try:
+            return cls(entries)
+        except (AttributeError, ValueError) as e:
+            raise ValueError(f"{path}: {e}") from e
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __iter__(self):
+        return iter(self.locations)
+
+    def get(self, location_id):
+        """Return the location with this id or None"""
+        return self.by_id.get(location_id)
+
+    def find(self, name):
+        """Return the location with this name or None"""
+        return self.by_name.get(name.strip())
+
+    def names(self):
+        return [location.name for location in self.locations]
+
+
+def migrate_name_keys(registry, storage, history):
+    """Move ratings stored under location names by earlier versions to location ids
+
+    Runs at every start and does nothing once the data is keyed by ids.
+    A location is only moved while nothing is stored under its id yet.
+    """
+    for location in registry:
+        if location.name == location.id:
+            continue
+        counts = storage.location_rating(location.name)[1::2]
+        if any(counts) and not any(storage.location_rating(location.id)[1::2]):
+            storage.rename_location(location.name, location.id)
+            logger.info(f"Moved ratings of {location.name} to location id {location.id}")
+        if history.rename_location(location.name, location.id):
+            logger.info(f"Moved rating history of {location.name} to location id {location.id}")
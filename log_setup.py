@@ -0,0 +1,80 @@
+import re
+import queue
+import atexit
+import logging
+import logging.handlers
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# getUpdates и остальные запросы httpx логирует на INFO вместе с токеном в URL
+DEFAULT_LOGGER_LEVELS = {'httpx': 'WARNING', 'httpcore': 'WARNING'}
+TOKEN_PATTERN = re.compile(r'\d{5,}:[A-Za-z0-9_-]{30,}')
+REDACTED = '<redacted>'
+
+
+def parse_logger_levels(value):
+    """Parse 'name=LEVEL,name=LEVEL' into a dict"""
+    levels = {}
+    for item in (value or '').split(','):
+        name, sep, level = item.partition('=')
+        if sep and name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+class RedactingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that renders the message and strips secrets before enqueueing
+
+    Rendering happens on the calling thread, as in QueueHandler, so the
+    queued record carries plain text; bot tokens and the configured secrets
+    are replaced by <redacted>.
+    """
+
+    def __init__(self, log_queue, secrets=()):
+        super().__init__(log_queue)
+        self.secrets = [secret for secret in secrets if secret]
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        message = TOKEN_PATTERN.sub(REDACTED, record.msg)
+        for secret in self.secrets:
+            message = message.replace(secret, REDACTED)
+        record.msg = message
+        return record
+
+
+def setup_logging(log_file, level='INFO', logger_levels=None, max_bytes=5 * 1024 * 1024,
+                  backup_count=5, rotate_when='', secrets=()):
+    """Route all logging through a queue to a background writer thread
+
+    The file is rotated by size, or by time when rotate_when is set (e.g.
+    'midnight'). logger_levels overrides levels of individual loggers on top
+    of DEFAULT_LOGGER_LEVELS. Returns the started QueueListener.
+    """
+    formatter = logging.Formatter(LOG_FORMAT)
+    if rotate_when:
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            log_file, when=rotate_when, backupCount=backup_count, encoding='utf-8'
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+        )
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(RedactingQueueHandler(log_queue, secrets))
+    root.setLevel(level.upper())
+    for name, logger_level in {**DEFAULT_LOGGER_LEVELS, **(logger_levels or {})}.items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    listener.start()
+    # Дописываем очередь в файл при выходе
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,219 @@
+import os
+import io
+import json
+import asyncio
+import hashlib
+import logging
+import signal
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+MAX_IMAGE_SIZE = 1280  # Telegram recommended size
+JPEG_QUALITY = 75  # Значение Pillow по умолчанию
+
+
+def file_digest(path):
+    """Return sha256 hex digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def resize_image(image_path, max_size=MAX_IMAGE_SIZE, quality=JPEG_QUALITY, progressive=False):
+    """Resize image to fit Telegram requirements and return JPEG bytes"""
+    # Pillow нужен только при отрисовке, готовые копии берутся из кэша на диске
+    from PIL import Image
+
+    with Image.open(image_path) as img:
+        # Уменьшаем только если большая сторона превышает max_size
+        width, height = img.size
+        scale = max_size / max(width, height)
+        new_size = (max(1, int(width * scale)), max(1, int(height * scale))) if scale < 1 else img.size
+        if scale < 1:
+            # JPEG сразу декодируется в масштабе 1/2..1/8, но не меньше new_size
+            img.draft('RGB', new_size)
+
+        # Convert to RGB if needed
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if img.size != new_size:
+            img = img.resize(new_size, Image.Resampling.LANCZOS)
+
+        bio = io.BytesIO()
+        img.save(bio, 'JPEG', quality=quality, progressive=progressive, optimize=progressive)
+        return bio.getvalue()
+
+
+def create_image_executor(kind='thread', workers=2):
+    """Bounded pool for resize_image, kind is 'thread' or 'process'
+
+    Pillow releases the GIL while decoding and resampling, so threads are
+    usually enough; processes also keep Python-level work off the bot's
+    interpreter.
+    """
+    if kind == 'process':
+        # Ctrl+C получает вся группа процессов, останавливает пул сам бот
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=signal.signal, initargs=(signal.SIGINT, signal.SIG_IGN)
+        )
+    if kind == 'thread':
+        return concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image')
+    raise ValueError(f"Unknown image pool: {kind}")
+
+
+class ImageCache:
+    """Resized renditions of source images, rendered once per source version
+
+    Renditions are kept in memory and on disk under cache_dir, keyed by the
+    source content hash and encoder settings, so restarts reuse them. A
+    changed mtime or size triggers a rehash and, if the content changed, a
+    new rendition. Rendering runs on executor when one is given; handlers
+    use aget()/akey(), which never block the event loop.
+    """
+
+    def __init__(self, cache_dir, max_size=MAX_IMAGE_SIZE, quality=JPEG_QUALITY, progressive=False,
+                 executor=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.quality = quality
+        self.progressive = progressive
+        self.executor = executor
+        self.variant = f"{max_size}-q{quality}{'p' if progressive else ''}"
+        self._entries = {}  # path -> (stat key, digest, bytes)
+        self._pending = {}  # path -> задача отрисовки, общая для одновременных запросов
+
+    def get(self, path):
+        """Return resized JPEG bytes for path, or None if it can't be rendered"""
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            logger.error(f"Image not found {path}: {e}")
+            return None
+
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == stat_key:
+            return entry[2]
+
+        try:
+            digest = file_digest(path)
+            if entry is not None and entry[1] == digest:
+                data = entry[2]
+            else:
+                data = self._load_or_render(path, digest)
+        except Exception as e:
+            logger.error(f"Error resizing image {path}: {e}")
+            return None
+
+        self._entries[path] = (stat_key, digest, data)
+        return data
+
+    async def aget(self, path):
+        """Async get(): cached renditions are returned directly, the rest is prepared off the loop"""
+        entry = self._entries.get(path)
+        if entry is not None:
+            try:
+                stat = os.stat(path)
+                if entry[0] == (stat.st_mtime_ns, stat.st_size):
+                    return entry[2]
+            except OSError:
+                pass
+
+        task = self._pending.get(path)
+        if task is None:
+            task = self._pending[path] = asyncio.ensure_future(asyncio.to_thread(self.get, path))
+            task.add_done_callback(lambda _: self._pending.pop(path, None))
+        return await asyncio.shield(task)
+
+    async def akey(self, path):
+        """Return the content key of the current rendition of path, or None"""
+        if await self.aget(path) is None:
+            return None
+        return f"{self._entries[path][1][:32]}-{self.variant}"
+
+    def warm(self, paths):
+        """Render all paths ahead of the first request"""
+        for path in paths:
+            self.get(path)
+
+    def _load_or_render(self, path, digest):
+        cache_path = os.path.join(self.cache_dir, f"{digest[:32]}-{self.variant}.jpg")
+        if os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                return f.read()
+
+        args = (path, self.max_size, self.quality, self.progressive)
+        if self.executor is not None:
+            data = self.executor.submit(resize_image, *args).result()
+        else:
+            data = resize_image(*args)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            # Кэш на диске необязателен, работаем из памяти
+            logger.warning(f"Could not write image cache {cache_path}: {e}")
+        return data
+
+
+class MediaRegistry:
+    """Persistent map of content keys to Telegram file_id of uploaded media
+
+    Once a file has been uploaded, later sends reuse the file_id Telegram
+    returned instead of uploading the bytes again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file_ids = {}
+        self._digests = {}  # path -> (stat key, digest)
+
+    def load(self):
+        """Load the registry from disk"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._file_ids = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading media registry, starting empty: {e}")
+            self._file_ids = {}
+
+    def get(self, key):
+        """Return cached file_id for key or None"""
+        return self._file_ids.get(key)
+
+    def set(self, key, file_id):
+        """Remember file_id for key"""
+        if self._file_ids.get(key) != file_id:
+            self._file_ids[key] = file_id
+            self._save()
+
+    def discard(self, key):
+        """Forget a file_id that Telegram rejected"""
+        if self._file_ids.pop(key, None) is not None:
+            self._save()
+
+    def file_key(self, path):
+        """Return content key of a source file, rehashing only when it changes"""
+        stat = os.stat(path)
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._digests.get(path)
+        if cached is None or cached[0] != stat_key:
+            cached = (stat_key, file_digest(path)[:32])
+            self._digests[path] = cached
+        return cached[1]
+
+    def _save(self):
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._file_ids, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Error saving media registry: {e}")
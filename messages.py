@@ -7,6 +7,8 @@ CMD_SERVICE = "service"
 CMD_ADMIN = "admin"
 CMD_BROADCAST = "broadcast"
 CMD_USERS = "users"
+CMD_JOBS = "jobs"
+CMD_STATS = "stats"
 CMD_BACK = "back"
 CMD_FRANCHISE = "franchise"
 CMD_OTHER = "other"
@@ -50,6 +52,8 @@ WELCOME_MESSAGE = "Выберите интересующий вас раздел
 
 # Сообщения для оценки
 SELECT_LOCATION = "Выберите адрес:"
+CHOOSE_LOCATION = "Хотите оценить другой адрес? Выберите адрес:"
+INVALID_LOCATION = "Пожалуйста, выберите адрес с помощью кнопок ниже."
 RATE_DRINK = "Понравился ли Вам напиток?"
 RATE_SERVICE = "Понравилось ли Вам обслуживание?"
 RATE_QUALITY = "Оцените качество напитка от 1 до 5 (отправьте цифру):"
@@ -99,9 +103,36 @@ ADMIN_BROADCAST_USAGE = """Отправьте сообщение для расс
 - Фото с подписью (или без) для рассылки с картинкой
 - Видео с подписью (или без) для рассылки с видео"""
 ADMIN_BROADCAST_CONFIRM = "Подтвердите отправку рассылки:\n\n{text}"
-ADMIN_BROADCAST_COMPLETE = "Рассылка завершена\nУспешно: {success}\nОшибок: {fail}"
+ADMIN_BROADCAST_STARTED = "Рассылка {job_id} запущена\nПолучателей: {total}\nНеактивных (пропущены): {inactive}"
+ADMIN_BROADCAST_PROGRESS = "Рассылка {job_id}: {done}/{total}\nУспешно: {success}\nОшибок: {fail}\nНедоступны: {unreachable}"
+ADMIN_BROADCAST_COMPLETE = "Рассылка завершена\nУспешно: {success}\nОшибок: {fail}\nНедоступны: {unreachable}"
 ADMIN_BROADCAST_CANCEL = "Рассылка отменена"
-ADMIN_USERS_LIST_HEADER = "Список пользователей сохранен в файл users_list.txt"
+ADMIN_BROADCAST_PAUSED = "Рассылка {job_id} приостановлена: {done}/{total}\nУспешно: {success}\nОшибок: {fail}\nНедоступны: {unreachable}"
+ADMIN_BROADCAST_CANCELLED = "Рассылка {job_id} отменена: {done}/{total}\nУспешно: {success}\nОшибок: {fail}\nНедоступны: {unreachable}"
+ADMIN_JOBS_USAGE = """Рассылки:
+/jobs - список
+/jobs pause <id> - приостановить
+/jobs resume <id> - продолжить
+/jobs cancel <id> - отменить"""
+ADMIN_JOBS_EMPTY = "Рассылок нет"
+ADMIN_JOBS_MORE = "…и ещё завершённых: {count}"
+ADMIN_JOBS_ITEM = "{job_id} [{state}] {kind}: {done}/{total}, ошибок: {fail}, недоступны: {unreachable}"
+ADMIN_JOB_UPDATED = "Рассылка {job_id}: готово"
+ADMIN_JOB_NOT_UPDATED = "Рассылка {job_id} не найдена или уже в этом состоянии"
+ADMIN_USERS_LIST_HEADER = "Список пользователей во вложении"
+ADMIN_USERS_STATS = "Активных: {active}\nНеактивных: {inactive}"
+ADMIN_USERS_USAGE = """Выгрузка пользователей:
+/users [txt|csv|jsonl] [gz]
+Например: /users csv gz"""
+ADMIN_STATS_HEADER = "📊 Оценки по локациям (столбики — за {days} дн.)"
+ADMIN_STATS_CHART_TOP = "На графике {shown} локаций с наибольшим числом оценок за период из {total}"
+ADMIN_STATS_LOCATION = """{location}
+Напитки: {drink} {drink_trend}
+Обслуживание: {service} {service_trend}
+Всего оценок: {total}, за период: {recent}"""
+ADMIN_STATS_DRINK_TITLE = "Напитки: среднее за {days} дн."
+ADMIN_STATS_SERVICE_TITLE = "Обслуживание: среднее за {days} дн."
+ADMIN_STATS_VOLUME_TITLE = "Оценок напитков в день"
 ADMIN_USER_INFO = """ID: {user_id}
 Username: @{username}
 Имя: {first_name} {last_name}
@@ -122,4 +153,5 @@ ADMIN_NEW_TICKET = """Новое обращение #{ticket_id}
 # Сообщения об ошибках
 ERROR_BROADCAST_TEXT_NOT_FOUND = "Ошибка: текст рассылки не найден"
 ERROR_GENERAL = """Произошла ошибка. Пожалуйста, попробуйте позже или свяжитесь с администратором: @rfatyhov"""
+ERROR_MESSAGE = ERROR_GENERAL
 ERROR_INVALID_RATING = "Пожалуйста, отправьте число от 1 до 5"
@@ -0,0 +1,281 @@
+import time
+import bisect
+import functools
+import threading
+
+from telegram.error import TelegramError
+from telegram.ext import ApplicationHandlerStop, ConversationHandler
+from telegram.request import HTTPXRequest
+
+from http_server import HttpServer, Response
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Set of metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            # Метрика без меток видна со значением 0 ещё до первого события
+            self.labels()
+        registry.register(self)
+
+    def labels(self, *values):
+        """Return the child for one combination of label values"""
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _items(self):
+        with self._lock:
+            return list(self._children.items())
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    """Monotonic counter, optionally computed at scrape time by a callback
+
+    callback() returns {label values tuple: value} for labelled counters or
+    a single number otherwise.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY, callback=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.callback = callback
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        if self.callback is not None:
+            values = self.callback()
+            items = values.items() if isinstance(values, dict) else [((), values)]
+        else:
+            items = [(values, child.value) for values, child in self._items()]
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}"
+                for values, value in items]
+
+
+class Gauge(Counter):
+    """Value that can go up and down; see Counter for callback"""
+
+    kind = 'gauge'
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, callback):
+        self.callback = callback
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def samples(self):
+        lines = []
+        for values, child in self._items():
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+HANDLER_SECONDS = Histogram(
+    'bot_handler_duration_seconds', 'Time spent in update handlers', ['handler']
+)
+HANDLER_ERRORS = Counter(
+    'bot_handler_exceptions_total', 'Exceptions that escaped update handlers', ['handler']
+)
+API_SECONDS = Histogram(
+    'bot_api_request_duration_seconds', 'Bot API call latency', ['method']
+)
+API_REQUESTS = Counter(
+    'bot_api_requests_total', 'Bot API calls by outcome (ok or error class)', ['method', 'result']
+)
+UPDATE_QUEUE = Gauge('bot_update_queue_size', 'Updates waiting to be processed')
+
+
+def timed_handler(name, callback):
+    """Wrap a handler callback to record its latency and escaped exceptions"""
+    seconds = HANDLER_SECONDS.labels(name)
+    errors = HANDLER_ERRORS.labels(name)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            # Штатная остановка обработки (например, антифлуд), не ошибка
+            raise
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+def instrument_handlers(handlers):
+    """Time every handler callback, including those nested in conversations"""
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                instrument_handlers(state_handlers)
+            instrument_handlers(handler.fallbacks)
+        elif not hasattr(handler.callback, '__wrapped__'):
+            handler.callback = timed_handler(handler.callback.__name__, handler.callback)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records latency and outcome of every Bot API call"""
+
+    async def post(self, url, *args, **kwargs):
+        method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            result = await super().post(url, *args, **kwargs)
+        except TelegramError as e:
+            API_REQUESTS.labels(method, type(e).__name__).inc()
+            raise
+        finally:
+            API_SECONDS.labels(method).observe(time.perf_counter() - started)
+        API_REQUESTS.labels(method, 'ok').inc()
+        return result
+
+
+class MetricsServer(HttpServer):
+    """Serves REGISTRY at /metrics"""
+
+    def __init__(self, host, port, registry=REGISTRY):
+        super().__init__(host, port)
+        self.registry = registry
+
+    async def handle(self, request):
+        if request.path != '/metrics':
+            return Response(404)
+        if request.method != 'GET':
+            return Response(405)
+        return Response(200, self.registry.render().encode('utf-8'), CONTENT_TYPE)
@@ -0,0 +1,35 @@
+from telegram.ext import filters
+
+
+class ButtonFilter(filters.MessageFilter):
+    """Match messages whose text is exactly one of the given button labels"""
+
+    __slots__ = ('texts',)
+
+    def __init__(self, texts):
+        self.texts = frozenset(texts)
+        super().__init__(name=f"ButtonFilter({len(self.texts)} buttons)")
+
+    def filter(self, message):
+        return message.text in self.texts
+
+
+class ButtonRouter:
+    """Dispatch a message to the handler registered for its exact button text
+
+    Lookup is a single dict access, so the cost doesn't grow with the number
+    of buttons, and labels are compared as plain strings rather than being
+    interpolated into regexes. Messages without a route go to default; if
+    there is no default they are ignored and the conversation state is kept.
+    """
+
+    def __init__(self, routes, default=None):
+        self.routes = dict(routes)
+        self.default = default
+        self.filter = ButtonFilter(self.routes)
+
+    async def dispatch(self, update, context):
+        handler = self.routes.get(update.effective_message.text, self.default)
+        if handler is None:
+            return None
+        return await handler(update, context)
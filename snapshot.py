@@ -0,0 +1,317 @@
+"""Binary snapshot of users data
+
+Layout (little-endian):
+
+    header   magic, format version, user count, meta and blob sizes, CRC32 of the payload
+    meta     JSON object supplied by the storage (rating aggregates)
+    ids      int64 user ids, ascending
+    flags    one byte per user, 1 = inactive
+    lengths  uint32 size of each profile in blob
+    blob     compact JSON profiles (without the inactive flag), one after another
+
+Loading reads the columns into arrays; profiles stay encoded in the blob
+until a user is looked up (see LazyUsers), so startup does not depend on
+how many users have to be decoded.
+"""
+import sys
+import json
+import zlib
+import array
+import bisect
+import struct
+import itertools
+
+MAGIC = b'BBUS'
+VERSION = 1
+HEADER = struct.Struct('<4sHHQQQI')  # magic, version, reserved, count, meta size, blob size, crc32
+_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+class SnapshotError(ValueError):
+    """Snapshot file is not ours, of an unknown version or damaged"""
+
+
+def _column(typecode, data):
+    column = array.array(typecode)
+    column.frombytes(data)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+def _column_bytes(column):
+    if sys.byteorder == 'big':
+        column = array.array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _encode_profile(user_info):
+    if 'inactive' in user_info:
+        user_info = {key: value for key, value in user_info.items() if key != 'inactive'}
+    return _ENCODER.encode(user_info).encode('utf-8')
+
+
+def _copy_profile(user_info):
+    """Copy a profile deep enough that later journal records don't change it"""
+    user_info = dict(user_info)
+    if 'ratings' in user_info:
+        user_info['ratings'] = [dict(entry) for entry in user_info['ratings']]
+    return user_info
+
+
+def _empty_columns():
+    return array.array('q'), b'', array.array('I'), array.array('Q', [0]), b''
+
+
+def _index(ids, user_id):
+    try:
+        key = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    index = bisect.bisect_left(ids, key)
+    if index < len(ids) and ids[index] == key:
+        return index
+    return None
+
+
+def _decode(columns, index):
+    _, flags, _, offsets, blob = columns
+    user_info = json.loads(bytes(blob[offsets[index]:offsets[index + 1]]))
+    if flags[index]:
+        user_info['inactive'] = True
+    return user_info
+
+
+def _iter_users(columns, dirty):
+    """Yield (user_id, user_info) from snapshot columns, dirty profiles taking precedence"""
+    for index, key in enumerate(columns[0]):
+        user_id = str(key)
+        user_info = dirty.pop(user_id, None)
+        yield user_id, user_info if user_info is not None else _decode(columns, index)
+    # Остались пользователи, которых нет в снимке
+    yield from dirty.items()
+
+
+class LazyUsers:
+    """users_data mapping backed by a snapshot
+
+    Supports the dict operations storage and journal use. Reads decode a
+    user from the snapshot on every access and keep nothing. setdefault()
+    and item assignment are the write paths (apply_record goes through
+    setdefault) and hold the user in memory as dirty until a snapshot
+    written from freeze() is swapped in with rebase(), so memory and
+    compaction cost follow writes rather than reads.
+    """
+
+    def __init__(self, columns=None):
+        # ids, flags, lengths, offsets, blob одним кортежем: читатель без блокировки
+        # не смешает столбцы старого и нового снимка
+        self._columns = columns if columns is not None else _empty_columns()
+        self._dirty = {}  # user_id -> dict, изменённые и новые пользователи
+        self._new = 0  # Сколько из них нет в снимке
+        self._touched = None  # Изменённые после freeze()
+
+    @classmethod
+    def from_dict(cls, users):
+        """Wrap users data read from the legacy JSON snapshot"""
+        lazy = cls()
+        lazy._dirty = dict(users)
+        lazy._new = len(lazy._dirty)
+        return lazy
+
+    def _index(self, user_id):
+        return _index(self._columns[0], user_id)
+
+    def _touch(self, user_id):
+        if self._touched is not None:
+            self._touched.add(user_id)
+
+    def get(self, user_id, default=None):
+        """Return the user's profile; for users not written since the snapshot it is a fresh copy"""
+        user_info = self._dirty.get(user_id)
+        if user_info is not None:
+            return user_info
+        columns = self._columns
+        index = _index(columns[0], user_id)
+        if index is None:
+            return default
+        return _decode(columns, index)
+
+    def setdefault(self, user_id, default=None):
+        """Return the user's profile for modification, creating it from default if missing"""
+        user_info = self._dirty.get(user_id)
+        if user_info is None:
+            index = self._index(user_id)
+            if index is None:
+                user_info = default
+                self._new += 1
+            else:
+                user_info = _decode(self._columns, index)
+            self._dirty[user_id] = user_info
+        self._touch(user_id)
+        return user_info
+
+    def __getitem__(self, user_id):
+        user_info = self.get(user_id)
+        if user_info is None:
+            raise KeyError(user_id)
+        return user_info
+
+    def __setitem__(self, user_id, user_info):
+        if user_id not in self:
+            self._new += 1
+        self._dirty[user_id] = user_info
+        self._touch(user_id)
+
+    def __contains__(self, user_id):
+        return user_id in self._dirty or self._index(user_id) is not None
+
+    def __len__(self):
+        return len(self._columns[0]) + self._new
+
+    def view(self):
+        """Return an iterator over (user_id, user_info) as of now
+
+        Call under the journal lock: only dirty profiles are copied here,
+        the snapshot part is decoded as the iterator is consumed, which
+        may happen later on another thread without the lock.
+        """
+        dirty = {user_id: _copy_profile(user_info) for user_id, user_info in self._dirty.items()}
+        return _iter_users(self._columns, dirty)
+
+    def items(self):
+        """Iterate over (user_id, user_info); snapshot users are decoded but not kept"""
+        return _iter_users(self._columns, dict(self._dirty))
+
+    def keys(self):
+        return (user_id for user_id, _ in self.items())
+
+    __iter__ = keys
+
+    def values(self):
+        return (user_info for _, user_info in self.items())
+
+    def sorted_ids(self, active_only=False):
+        """Return user ids as ints in ascending order without decoding profiles"""
+        ids, flags = self._columns[:2]
+        overrides = {int(user_id): user_info for user_id, user_info in self._dirty.items()}
+        user_ids = [
+            key for key, inactive in zip(ids, flags)
+            if key not in overrides and not (active_only and inactive)
+        ]
+        user_ids.extend(
+            key for key, user_info in overrides.items()
+            if not (active_only and user_info.get('inactive'))
+        )
+        user_ids.sort()
+        return user_ids
+
+    def count_inactive(self):
+        """Return the number of users flagged inactive"""
+        flags = self._columns[1]
+        count = flags.count(1)
+        for user_id, user_info in self._dirty.items():
+            index = self._index(user_id)
+            if index is not None:
+                count -= flags[index]
+            if user_info.get('inactive'):
+                count += 1
+        return count
+
+    def freeze(self):
+        """Capture the current state for encode(); call under the journal lock
+
+        Copies only the dirty profiles, the snapshot columns are immutable
+        and shared. Users written from now on are tracked, so rebase()
+        knows which dirty users the new snapshot does not cover.
+        """
+        self._touched = set()
+        profiles = {int(user_id): _copy_profile(user_info) for user_id, user_info in self._dirty.items()}
+        return self._columns, profiles
+
+    def rebase(self, columns):
+        """Switch to columns of a snapshot encoded from freeze(); call under the journal lock
+
+        Dirty users not written since freeze() are in the new snapshot and
+        are dropped from memory.
+        """
+        touched = self._touched or set()
+        dirty = {user_id: self._dirty[user_id] for user_id in touched if user_id in self._dirty}
+        # Сначала столбцы, потом dirty: get() без блокировки смотрит в обратном порядке
+        self._columns = columns
+        self._dirty = dirty
+        self._new = sum(1 for user_id in dirty if self._index(user_id) is None)
+        self._touched = None
+
+
+def encode(frozen, meta):
+    """Build snapshot bytes from LazyUsers.freeze() and a JSON-serialisable meta dict"""
+    (ids, flags, lengths, offsets, blob), profiles = frozen
+    out_ids = array.array('q')
+    out_flags = bytearray()
+    out_lengths = array.array('I')
+    chunks = []
+
+    # Нетронутые пользователи между изменёнными копируются из старого снимка целыми срезами
+    start = 0
+    for key in sorted(profiles):
+        index = bisect.bisect_left(ids, key, start)
+        out_ids.extend(ids[start:index])
+        out_flags += flags[start:index]
+        out_lengths.extend(lengths[start:index])
+        chunks.append(blob[offsets[start]:offsets[index]])
+
+        profile = profiles[key]
+        chunk = _encode_profile(profile)
+        out_ids.append(key)
+        out_flags.append(1 if profile.get('inactive') else 0)
+        out_lengths.append(len(chunk))
+        chunks.append(chunk)
+        start = index + 1 if index < len(ids) and ids[index] == key else index
+    out_ids.extend(ids[start:])
+    out_flags += flags[start:]
+    out_lengths.extend(lengths[start:])
+    chunks.append(blob[offsets[start]:offsets[len(ids)]])
+
+    meta_bytes = _ENCODER.encode(meta).encode('utf-8')
+    blob_size = sum(len(chunk) for chunk in chunks)
+    payload = b''.join([
+        meta_bytes, _column_bytes(out_ids), bytes(out_flags), _column_bytes(out_lengths), *chunks
+    ])
+    header = HEADER.pack(MAGIC, VERSION, 0, len(out_ids), len(meta_bytes), blob_size, zlib.crc32(payload))
+    return header + payload
+
+
+def decode(data, name='snapshot'):
+    """Parse snapshot bytes, return (columns for LazyUsers, meta dict)"""
+    if len(data) < HEADER.size:
+        raise SnapshotError(f"{name}: truncated header")
+    magic, version, _, count, meta_size, blob_size, crc = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SnapshotError(f"{name}: not a users snapshot")
+    if version != VERSION:
+        raise SnapshotError(f"{name}: unsupported snapshot version {version}")
+
+    payload = memoryview(data)[HEADER.size:]
+    if len(payload) != meta_size + count * 13 + blob_size or zlib.crc32(payload) != crc:
+        raise SnapshotError(f"{name}: checksum mismatch, snapshot is damaged")
+
+    meta = json.loads(bytes(payload[:meta_size]))
+    position = meta_size
+    ids = _column('q', payload[position:position + count * 8])
+    position += count * 8
+    flags = bytes(payload[position:position + count])
+    position += count
+    lengths = _column('I', payload[position:position + count * 4])
+    position += count * 4
+    offsets = array.array('Q', itertools.accumulate(lengths, initial=0))
+    return (ids, flags, lengths, offsets, payload[position:]), meta
+
+
+def load(path):
+    """Read a snapshot file, return (LazyUsers, meta dict)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    columns, meta = decode(data, path)
+    return LazyUsers(columns), meta
@@ -0,0 +1,249 @@
+"""Admin /stats: per-location rating averages, volume and trend charts
+
+build_report() collects the numbers from storage aggregates and the rating
+history, render_chart() draws them with Pillow and StatsCache keeps the
+last result, together with the file_id Telegram assigned to the chart, so
+repeated /stats calls with unchanged data are a single cached send.
+"""
+import io
+import asyncio
+import datetime
+import logging
+
+from telegram.error import BadRequest
+
+import messages as msg
+
+logger = logging.getLogger(__name__)
+
+TREND_DAYS = 7
+ROLLING_DAYS = 7
+CAPTION_LIMIT = 1024  # Telegram ограничивает подпись к фото
+MESSAGE_LIMIT = 4096  # и длину текстового сообщения
+CHART_SIZE = (1000, 760)
+FONT_NAME = 'DejaVuSans.ttf'  # Есть кириллица; если шрифта нет, Pillow возьмёт встроенный
+COLORS = [(214, 39, 40), (31, 119, 180), (44, 160, 44), (255, 127, 14), (148, 103, 189), (140, 86, 75)]
+CHART_LOCATIONS = len(COLORS)  # Больше линий на графике не различить
+LEGEND_ITEM_WIDTH = 250  # Три подписи в строке, две строки
+
+
+def _mean(rows):
+    count = sum(row[1] for row in rows)
+    return sum(row[1] * row[2] for row in rows if row[1]) / count if count else None
+
+
+def _trend(rows, today):
+    """Arrow comparing the mean of the last TREND_DAYS days with the days before"""
+    recent_start = today - datetime.timedelta(days=TREND_DAYS - 1)
+    previous_start = recent_start - datetime.timedelta(days=TREND_DAYS)
+    recent = _mean([row for row in rows if row[0] >= recent_start])
+    previous = _mean([row for row in rows if previous_start <= row[0] < recent_start])
+    if recent is None or previous is None or abs(recent - previous) < 0.05:
+        return '→'
+    return '↑' if recent > previous else '↓'
+
+
+def build_report(history, locations, location_rating, days, today=None):
+    """Return (caption, dates, series, titles) for the last days days
+
+    locations are registry entries: data is looked up by id, names are
+    shown. location_rating(location_id) gives storage aggregates as in
+    Storage.location_rating. The caption covers every location; series
+    holds, per location name, a list aligned with dates of (rolling drink
+    mean, rolling service mean, ratings that day) for at most
+    CHART_LOCATIONS locations with the most ratings in the period; titles
+    are the captions of the chart panels.
+    """
+    today = today or datetime.date.today()
+    dates = [today - datetime.timedelta(days=offset) for offset in range(days - 1, -1, -1)]
+    # Скользящее среднее в начале периода учитывает и предыдущие дни
+    since = dates[0] - datetime.timedelta(days=max(ROLLING_DAYS, 2 * TREND_DAYS))
+
+    lines = [msg.ADMIN_STATS_HEADER.format(days=days)]
+    series = []
+    for location in locations:
+        drink_sum, drink_count, service_sum, service_count = location_rating(location.id)
+        drink = history.timeline(location.id, 'drink', 'day', ROLLING_DAYS, since, today)
+        service = history.timeline(location.id, 'service', 'day', ROLLING_DAYS, since, today)
+        drink_by_date = {row[0]: row for row in drink}
+        service_by_date = {row[0]: row for row in service}
+        series.append((location.name, [
+            (
+                drink_by_date[date][3] if date in drink_by_date else None,
+                service_by_date[date][3] if date in service_by_date else None,
+                drink_by_date[date][1] if date in drink_by_date else 0,
+            )
+            for date in dates
+        ]))
+        lines.append(msg.ADMIN_STATS_LOCATION.format(
+            location=location.name,
+            drink=f"{drink_sum / drink_count:.1f}" if drink_count else '—',
+            service=f"{service_sum / service_count:.1f}" if service_count else '—',
+            drink_trend=_trend(drink, today),
+            service_trend=_trend(service, today),
+            total=max(drink_count, service_count),
+            recent=sum(row[1] for row in drink if row[0] >= dates[0]),
+        ))
+    if len(series) > CHART_LOCATIONS:
+        ranked = sorted(range(len(series)), key=lambda i: -sum(point[2] for point in series[i][1]))
+        shown = sorted(ranked[:CHART_LOCATIONS])
+        lines[0] += '\n' + msg.ADMIN_STATS_CHART_TOP.format(shown=len(shown), total=len(series))
+        series = [series[i] for i in shown]
+    titles = (
+        msg.ADMIN_STATS_DRINK_TITLE.format(days=ROLLING_DAYS),
+        msg.ADMIN_STATS_SERVICE_TITLE.format(days=ROLLING_DAYS),
+        msg.ADMIN_STATS_VOLUME_TITLE,
+    )
+    return '\n\n'.join(lines), dates, series, titles
+
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    """Split text into messages of at most limit characters, between paragraphs where possible"""
+    chunks = []
+    current = ''
+    for paragraph in text.split('\n\n'):
+        candidate = f"{current}\n\n{paragraph}" if current else paragraph
+        if len(candidate) <= limit:
+            current = candidate
+            continue
+        if current:
+            chunks.append(current)
+        # Абзац длиннее лимита режется как есть
+        while len(paragraph) > limit:
+            chunks.append(paragraph[:limit])
+            paragraph = paragraph[limit:]
+        current = paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _font(size):
+    from PIL import ImageFont
+
+    try:
+        return ImageFont.truetype(FONT_NAME, size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def render_chart(dates, series, titles):
+    """Draw rolling means and daily volume per location, return PNG bytes
+
+    titles are the captions of the drink, service and volume panels.
+    Module-level and fed with plain data, so it can run in a process pool.
+    """
+    from PIL import Image, ImageDraw
+
+    width, height = CHART_SIZE
+    image = Image.new('RGB', CHART_SIZE, 'white')
+    draw = ImageDraw.Draw(image)
+    font, small = _font(16), _font(12)
+    left, right = 50, width - 20
+    panels = [(30, 230), (270, 470), (510, 670)]
+    step = (right - left) / max(1, len(dates) - 1)
+
+    def x_at(index):
+        return left + index * step
+
+    for (top, bottom), title in zip(panels, titles):
+        draw.text((left, top - 24), title, fill='black', font=font)
+        draw.line([(left, bottom), (right, bottom)], fill=(120, 120, 120))
+
+    # Средние оценки: шкала 1..5
+    for panel, value_index in ((panels[0], 0), (panels[1], 1)):
+        top, bottom = panel
+        for grade in range(1, 6):
+            y = bottom - (grade - 1) / 4 * (bottom - top)
+            draw.line([(left, y), (right, y)], fill=(230, 230, 230))
+            draw.text((left - 20, y - 7), str(grade), fill='black', font=small)
+        for color, (_, points) in zip(COLORS * len(series), series):
+            previous = None
+            for index, point in enumerate(points):
+                value = point[value_index]
+                if value is None:
+                    previous = None
+                    continue
+                current = (x_at(index), bottom - (value - 1) / 4 * (bottom - top))
+                if previous is not None:
+                    draw.line([previous, current], fill=color, width=3)
+                draw.ellipse([current[0] - 2, current[1] - 2, current[0] + 2, current[1] + 2], fill=color)
+                previous = current
+
+    # Количество оценок по дням: столбики локаций рядом
+    top, bottom = panels[2]
+    peak = max([point[2] for _, points in series for point in points] + [1])
+    draw.text((left - 45, top - 7), str(peak), fill='black', font=small)
+    draw.text((left - 20, bottom - 7), '0', fill='black', font=small)
+    bar = max(1.0, step * 0.8 / max(1, len(series)))
+    for number, (color, (_, points)) in enumerate(zip(COLORS * len(series), series)):
+        for index, point in enumerate(points):
+            if point[2]:
+                x = x_at(index) - step * 0.4 + number * bar
+                draw.rectangle([x, bottom - point[2] / peak * (bottom - top), x + bar - 1, bottom], fill=color)
+
+    label_every = max(1, len(dates) // 10)
+    for index in range(0, len(dates), label_every):
+        draw.text((x_at(index) - 15, panels[2][1] + 6), dates[index].strftime('%d.%m'), fill='black', font=small)
+
+    # Легенда: длинные названия обрезаются, не поместившиеся в строку переносятся на следующую
+    x, y = left, height - 60
+    for color, (location, _) in zip(COLORS * len(series), series):
+        label = location
+        while len(label) > 1 and draw.textlength(label, font=font) > LEGEND_ITEM_WIDTH:
+            label = label[:-2] + '…'
+        item_width = 40 + draw.textlength(label, font=font)
+        if x > left and x + item_width > right:
+            x, y = left, y + 26
+        draw.rectangle([x, y, x + 14, y + 14], fill=color)
+        draw.text((x + 20, y - 2), label, fill='black', font=font)
+        x += item_width
+
+    output = io.BytesIO()
+    image.save(output, 'PNG', optimize=True)
+    return output.getvalue()
+
+
+class StatsCache:
+    """Last /stats report and chart, rebuilt only when the key changes
+
+    The key should be cheap to compute and change whenever the aggregates
+    behind the report do (see bot.stats_key); it is taken before the
+    report is built, so changes made meanwhile trigger the next rebuild.
+    build() runs on a worker thread (it usually closes over live objects,
+    which a process pool could not pickle) and rendering runs on executor.
+    """
+
+    def __init__(self, executor=None):
+        self.executor = executor
+        self._key = None
+        self._caption = None
+        self._chart = None
+        self._file_id = None
+        self._lock = asyncio.Lock()
+
+    async def send(self, message, key, build):
+        """Reply with the chart and caption; build() -> build_report() result runs on a key change"""
+        async with self._lock:
+            if key != self._key:
+                caption, dates, series, titles = await asyncio.to_thread(build)
+                chart = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, render_chart, dates, series, titles
+                )
+                self._key, self._caption, self._chart, self._file_id = key, caption, chart, None
+            caption, chart, file_id = self._caption, self._chart, self._file_id
+
+        photo_caption = caption if len(caption) <= CAPTION_LIMIT else None
+        sent = None
+        if file_id:
+            try:
+                sent = await message.reply_photo(photo=file_id, caption=photo_caption)
+            except BadRequest as e:
+                logger.warning(f"Cached stats chart rejected, uploading again: {e}")
+        if sent is None:
+            sent = await message.reply_photo(photo=chart, caption=photo_caption, filename='stats.png')
+            if sent.photo and self._key == key:
+                self._file_id = sent.photo[-1].file_id
+        if photo_caption is None:
+            for text in split_message(caption):
+                await message.reply_text(text)
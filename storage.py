@@ -0,0 +1,618 @@
+import os
+import json
+import bisect
+import sqlite3
+import asyncio
+import logging
+import threading
+
+from journal import UsersJournal, apply_record
+from snapshot import LazyUsers
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+STORAGE_CHANGES = Counter('bot_storage_changes_total', 'Storage mutations handed to the writer')
+STORAGE_FLUSH_SECONDS = Histogram('bot_storage_flush_duration_seconds', 'Time to flush storage to disk')
+STORAGE_FLUSH_ERRORS = Counter('bot_storage_flush_errors_total', 'Failed storage flushes')
+
+RATING_KINDS = ('drink', 'service')
+
+
+def read_feedbacks(path):
+    """Read the JSON lines feedback file into {feedback_id: feedback}"""
+    feedbacks = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    feedback = json.loads(line)
+                    feedbacks[feedback.pop('id')] = feedback
+                except (ValueError, KeyError):
+                    logger.warning("Skipping bad feedback line")
+    return feedbacks
+
+
+class Storage:
+    """Persistence interface for users, ratings and feedback
+
+    Mutations are applied in memory (or to an open transaction) and made
+    durable by flush(). When on_dirty is set, flushing is left to its owner
+    (see WriteBehind); otherwise every mutation is flushed immediately.
+    """
+
+    on_dirty = None
+
+    def load(self):
+        """Open the storage and load whatever has to be resident"""
+        raise NotImplementedError
+
+    def flush(self):
+        """Make buffered changes durable; safe to call from a worker thread"""
+        raise NotImplementedError
+
+    def close(self):
+        """Flush outstanding changes and release resources"""
+        raise NotImplementedError
+
+    def _mark_dirty(self):
+        if self.on_dirty is None:
+            self.flush()
+        else:
+            self.on_dirty()
+
+    def upsert_user(self, user_id, profile):
+        """Create a user or update profile fields, keeping ratings"""
+        raise NotImplementedError
+
+    def get_user(self, user_id):
+        """Return profile dict for user_id or None"""
+        raise NotImplementedError
+
+    def set_rating(self, user_id, location, kind, value):
+        """Store a drink/service rating, return the previous value or None"""
+        raise NotImplementedError
+
+    def get_rating(self, user_id, location):
+        """Return {'drink_rating': .., 'service_rating': ..} or None"""
+        raise NotImplementedError
+
+    def location_rating(self, location):
+        """Return (drink_sum, drink_count, service_sum, service_count)"""
+        raise NotImplementedError
+
+    def rename_location(self, old, new):
+        """Move all ratings stored under location key old to new, which must have none"""
+        raise NotImplementedError
+
+    def iter_user_ids(self, after=None, active_only=False):
+        """Iterate over user ids as strings in ascending numeric order, optionally after an id"""
+        raise NotImplementedError
+
+    def iter_users(self):
+        """Iterate over (user_id, profile) pairs"""
+        raise NotImplementedError
+
+    def user_count(self):
+        """Return number of known users"""
+        raise NotImplementedError
+
+    def set_active(self, user_id, active):
+        """Mark a user reachable or unreachable for broadcasts"""
+        raise NotImplementedError
+
+    def count_users(self):
+        """Return (active, inactive) user counts"""
+        raise NotImplementedError
+
+    def save_feedback(self, feedback_id, feedback):
+        """Store a feedback entry"""
+        raise NotImplementedError
+
+    def get_feedback(self, feedback_id):
+        """Return feedback dict or None"""
+        raise NotImplementedError
+
+
+class JsonStorage(Storage):
+    """Users in a binary snapshot plus append-only journal, feedback in JSON lines
+
+    Profiles are decoded from the snapshot on first access (see
+    snapshot.LazyUsers); rating aggregates are stored in the snapshot, so
+    load() does not touch every user. A legacy users_data.json is migrated
+    on the first load and kept next to the new snapshot as *.migrated.
+    """
+
+    def __init__(self, snapshot_file, journal_file, feedbacks_file, compact_every=1000, legacy_users_file=None):
+        self.users_data = LazyUsers()
+        self.feedbacks = {}
+        self.location_stats = {}  # Агрегаты оценок по локациям: суммы и количества
+        self.inactive_count = 0
+        self.journal = UsersJournal(
+            snapshot_file, journal_file, compact_every, legacy_users_file, self._snapshot_meta
+        )
+        self.feedbacks_file = feedbacks_file
+        self._feedbacks_buffer = []
+        self._feedbacks_fp = None
+
+    def load(self):
+        replayed = []
+        self.users_data = self.journal.load(lambda record, previous: replayed.append((record, previous)))
+        self.feedbacks = read_feedbacks(self.feedbacks_file)
+
+        stats = (self.journal.meta or {}).get('location_stats')
+        if stats is None:
+            self.rebuild_location_stats()
+        else:
+            # Агрегаты из снимка плюс изменения из журнала
+            self.location_stats = {location: dict(values) for location, values in stats.items()}
+            for record, previous in replayed:
+                self._apply_stats(record, previous)
+        self.inactive_count = self.users_data.count_inactive()
+
+        if self.journal.needs_compact:
+            self.journal.compact(self.users_data)
+        if self.journal.migrated:
+            legacy_file = self.journal.legacy_path
+            os.replace(legacy_file, f"{legacy_file}.migrated")
+            logger.info(f"Migrated {len(self.users_data)} users from {legacy_file} to {self.journal.snapshot_path}")
+
+    def _snapshot_meta(self):
+        return {'location_stats': {location: dict(values) for location, values in self.location_stats.items()}}
+
+    def flush(self):
+        self.journal.flush(self.users_data)
+        with self.journal.lock:
+            lines, self._feedbacks_buffer = self._feedbacks_buffer, []
+        if lines:
+            if self._feedbacks_fp is None:
+                self._feedbacks_fp = open(self.feedbacks_file, 'a', encoding='utf-8')
+            self._feedbacks_fp.writelines(lines)
+            self._feedbacks_fp.flush()
+
+    def close(self):
+        self.flush()
+        self.journal.close(self.users_data)
+        if self._feedbacks_fp is not None:
+            self._feedbacks_fp.close()
+            self._feedbacks_fp = None
+
+    def _record(self, record):
+        with self.journal.lock:
+            previous = apply_record(self.users_data, record)
+            # Агрегаты меняются под той же блокировкой, что и данные, для согласованного снимка
+            self._apply_stats(record, previous)
+            self.journal.append(record)
+        self._mark_dirty()
+        return previous
+
+    def _apply_stats(self, record, previous):
+        if record['op'] == 'rating':
+            kind = record['field'].rsplit('_', 1)[0]
+            self.update_location_stats(record['location'], kind, previous, record['value'])
+        elif record['op'] == 'rename_location':
+            stats = self.location_stats.pop(record['from'], None)
+            if stats is not None:
+                target = self.location_stats.setdefault(record['to'], dict.fromkeys(stats, 0))
+                for key, value in stats.items():
+                    target[key] += value
+
+    def rebuild_location_stats(self):
+        """Rebuild per-location rating aggregates from users data"""
+        self.location_stats.clear()
+        for user_info in self.users_data.values():
+            for entry in user_info.get('ratings', []):
+                for kind in RATING_KINDS:
+                    value = entry.get(f'{kind}_rating')
+                    if value is not None:
+                        self.update_location_stats(entry.get('location'), kind, None, value)
+
+    def update_location_stats(self, location, kind, old_rating, new_rating):
+        """Apply one rating change (kind is 'drink' or 'service') to location aggregates"""
+        stats = self.location_stats.setdefault(location, {
+            'drink_sum': 0, 'drink_count': 0,
+            'service_sum': 0, 'service_count': 0
+        })
+        if old_rating is not None:
+            stats[f'{kind}_sum'] -= old_rating
+            stats[f'{kind}_count'] -= 1
+        if new_rating is not None:
+            stats[f'{kind}_sum'] += new_rating
+            stats[f'{kind}_count'] += 1
+
+    def upsert_user(self, user_id, profile):
+        self._record({'op': 'user', 'id': str(user_id), 'data': profile})
+        # Пользователь снова написал боту, значит он доступен
+        self.set_active(user_id, True)
+
+    def get_user(self, user_id):
+        return self.users_data.get(str(user_id))
+
+    def set_rating(self, user_id, location, kind, value):
+        return self._record({
+            'op': 'rating',
+            'id': str(user_id),
+            'location': location,
+            'field': f'{kind}_rating',
+            'value': value
+        })
+
+    def get_rating(self, user_id, location):
+        user_info = self.users_data.get(str(user_id), {})
+        for entry in user_info.get('ratings', []):
+            if entry.get('location') == location:
+                return dict(entry)
+        return None
+
+    def location_rating(self, location):
+        stats = self.location_stats.get(location)
+        if not stats:
+            return 0, 0, 0, 0
+        return stats['drink_sum'], stats['drink_count'], stats['service_sum'], stats['service_count']
+
+    def rename_location(self, old, new):
+        # Разовая операция: проходит по всем пользователям и помечает изменёнными тех, у кого есть оценки
+        self._record({'op': 'rename_location', 'id': None, 'from': old, 'to': new})
+
+    def iter_user_ids(self, after=None, active_only=False):
+        with self.journal.lock:
+            user_ids = self.users_data.sorted_ids(active_only)
+        start = 0 if after is None else bisect.bisect_right(user_ids, int(after))
+        return (str(user_id) for user_id in user_ids[start:])
+
+    def iter_users(self):
+        # Профили из снимка декодируются по мере чтения, то есть в потоке выгрузки, а не здесь
+        with self.journal.lock:
+            return self.users_data.view()
+
+    def user_count(self):
+        return len(self.users_data)
+
+    def set_active(self, user_id, active):
+        user_info = self.users_data.get(str(user_id))
+        if user_info is None or bool(user_info.get('inactive')) != active:
+            return
+        self._record({'op': 'active', 'id': str(user_id), 'value': active})
+        self.inactive_count += -1 if active else 1
+
+    def count_users(self):
+        return len(self.users_data) - self.inactive_count, self.inactive_count
+
+    def save_feedback(self, feedback_id, feedback):
+        self.feedbacks[feedback_id] = feedback
+        line = json.dumps(dict(feedback, id=feedback_id), ensure_ascii=False) + '\n'
+        with self.journal.lock:
+            self._feedbacks_buffer.append(line)
+        self._mark_dirty()
+
+    def get_feedback(self, feedback_id):
+        return self.feedbacks.get(feedback_id)
+
+
+class SqliteStorage(Storage):
+    """SQLite database in WAL mode, nothing kept resident
+
+    Writes go into an open transaction on the event loop thread and flush()
+    commits it; self.lock serialises use of the shared connection.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL DEFAULT '',
+            first_name TEXT NOT NULL DEFAULT '',
+            last_name TEXT NOT NULL DEFAULT '',
+            inactive INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS ratings (
+            user_id INTEGER NOT NULL,
+            location TEXT NOT NULL,
+            drink_rating INTEGER,
+            service_rating INTEGER,
+            PRIMARY KEY (user_id, location)
+        );
+        CREATE INDEX IF NOT EXISTS ratings_location
+            ON ratings (location, drink_rating, service_rating);
+        CREATE TABLE IF NOT EXISTS feedbacks (
+            feedback_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            text TEXT,
+            timestamp TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS feedbacks_user_id ON feedbacks (user_id);
+    """
+
+    # Запросы с параметрами: sqlite3 кэширует подготовленные выражения по тексту
+    SQL_UPSERT_USER = """
+        INSERT INTO users (user_id, username, first_name, last_name) VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            username = excluded.username,
+            first_name = excluded.first_name,
+            last_name = excluded.last_name,
+            inactive = 0
+    """
+    # Перенос из json сохраняет признак неактивности, в отличие от SQL_UPSERT_USER
+    SQL_MIGRATE_USER = """
+        INSERT OR REPLACE INTO users (user_id, username, first_name, last_name, inactive) VALUES (?, ?, ?, ?, ?)
+    """
+    SQL_ENSURE_USER = "INSERT OR IGNORE INTO users (user_id) VALUES (?)"
+    SQL_GET_USER = "SELECT username, first_name, last_name FROM users WHERE user_id = ?"
+    SQL_GET_RATING = "SELECT drink_rating, service_rating FROM ratings WHERE user_id = ? AND location = ?"
+    SQL_SET_RATING = {
+        kind: f"""
+            INSERT INTO ratings (user_id, location, {kind}_rating) VALUES (?, ?, ?)
+            ON CONFLICT (user_id, location) DO UPDATE SET {kind}_rating = excluded.{kind}_rating
+        """
+        for kind in RATING_KINDS
+    }
+    SQL_LOCATION_RATING = """
+        SELECT COALESCE(SUM(drink_rating), 0), COUNT(drink_rating),
+               COALESCE(SUM(service_rating), 0), COUNT(service_rating)
+        FROM ratings WHERE location = ?
+    """
+    SQL_RENAME_LOCATION = "UPDATE OR IGNORE ratings SET location = ? WHERE location = ?"
+    SQL_USERS_PAGE = """
+        SELECT user_id, username, first_name, last_name, inactive FROM users
+        WHERE user_id > ? ORDER BY user_id LIMIT ?
+    """
+    SQL_ACTIVE_USER_IDS_PAGE = """
+        SELECT user_id FROM users
+        WHERE inactive = 0 AND user_id > ? ORDER BY user_id LIMIT ?
+    """
+    SQL_SET_ACTIVE = "UPDATE users SET inactive = ? WHERE user_id = ?"
+    SQL_COUNT_USERS = "SELECT COUNT(*) - COALESCE(SUM(inactive), 0), COALESCE(SUM(inactive), 0) FROM users"
+    PAGE_SIZE = 1000
+    SQL_USER_COUNT = "SELECT COUNT(*) FROM users"
+    SQL_SAVE_FEEDBACK = """
+        INSERT OR REPLACE INTO feedbacks (feedback_id, user_id, type, text, timestamp)
+        VALUES (?, ?, ?, ?, ?)
+    """
+    SQL_GET_FEEDBACK = "SELECT user_id, type, text, timestamp FROM feedbacks WHERE feedback_id = ?"
+
+    def __init__(self, db_file, legacy_users_file=None, legacy_journal_file=None, legacy_json_file=None,
+                 legacy_feedbacks_file=None):
+        self.db_file = db_file
+        self.legacy_users_file = legacy_users_file
+        self.legacy_journal_file = legacy_journal_file
+        self.legacy_json_file = legacy_json_file
+        self.legacy_feedbacks_file = legacy_feedbacks_file
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def load(self):
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False, cached_statements=64)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(users)")]
+        if 'inactive' not in columns:
+            self.conn.execute("ALTER TABLE users ADD COLUMN inactive INTEGER NOT NULL DEFAULT 0")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS users_inactive ON users (inactive, user_id)")
+        self.conn.commit()
+        self._migrate_from_json()
+
+    def flush(self):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.flush()
+            self.conn.close()
+            self.conn = None
+
+    def _execute(self, sql, params):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _migrate_from_json(self):
+        """Import users, ratings and feedback from the json backend into an empty database"""
+        if not self.legacy_users_file or self.user_count():
+            return
+        legacy_files = (self.legacy_users_file, self.legacy_journal_file, self.legacy_json_file, self.legacy_feedbacks_file)
+        if not any(path and os.path.exists(path) for path in legacy_files):
+            return
+
+        # Журнал только читается: исходные файлы остаются как резервная копия
+        journal = UsersJournal(self.legacy_users_file, self.legacy_journal_file, float('inf'), self.legacy_json_file)
+        users_data = journal.load()
+        feedbacks = read_feedbacks(self.legacy_feedbacks_file) if self.legacy_feedbacks_file else {}
+        with self.conn:
+            for user_id, user_info in users_data.items():
+                self.conn.execute(self.SQL_MIGRATE_USER, (
+                    int(user_id),
+                    user_info.get('username', ''),
+                    user_info.get('first_name', ''),
+                    user_info.get('last_name', ''),
+                    1 if user_info.get('inactive', False) else 0
+                ))
+                for entry in user_info.get('ratings', []):
+                    for kind in RATING_KINDS:
+                        value = entry.get(f'{kind}_rating')
+                        if value is not None:
+                            self.conn.execute(self.SQL_SET_RATING[kind], (int(user_id), entry.get('location'), value))
+            for feedback_id, feedback in feedbacks.items():
+                self.conn.execute(self.SQL_SAVE_FEEDBACK, (
+                    feedback_id,
+                    int(feedback['user_id']),
+                    feedback['type'],
+                    feedback.get('text'),
+                    feedback['timestamp']
+                ))
+        logger.info(f"Migrated {len(users_data)} users and {len(feedbacks)} feedbacks "
+                    f"from {self.legacy_users_file} to {self.db_file}")
+
+    def upsert_user(self, user_id, profile):
+        self._execute(self.SQL_UPSERT_USER, (
+            int(user_id),
+            profile.get('username', ''),
+            profile.get('first_name', ''),
+            profile.get('last_name', '')
+        ))
+        self._mark_dirty()
+
+    def get_user(self, user_id):
+        rows = self._execute(self.SQL_GET_USER, (int(user_id),))
+        if not rows:
+            return None
+        row = rows[0]
+        return {'username': row[0], 'first_name': row[1], 'last_name': row[2]}
+
+    def set_rating(self, user_id, location, kind, value):
+        previous = self.get_rating(user_id, location)
+        self._execute(self.SQL_ENSURE_USER, (int(user_id),))
+        self._execute(self.SQL_SET_RATING[kind], (int(user_id), location, value))
+        self._mark_dirty()
+        return previous.get(f'{kind}_rating') if previous else None
+
+    def get_rating(self, user_id, location):
+        rows = self._execute(self.SQL_GET_RATING, (int(user_id), location))
+        if not rows:
+            return None
+        row = rows[0]
+        entry = {'location': location}
+        if row[0] is not None:
+            entry['drink_rating'] = row[0]
+        if row[1] is not None:
+            entry['service_rating'] = row[1]
+        return entry
+
+    def location_rating(self, location):
+        return tuple(self._execute(self.SQL_LOCATION_RATING, (location,))[0])
+
+    def rename_location(self, old, new):
+        self._execute(self.SQL_RENAME_LOCATION, (new, old))
+        self._mark_dirty()
+
+    def iter_user_ids(self, after=None, active_only=False):
+        if not active_only:
+            for user_id, _ in self.iter_users(after):
+                yield user_id
+            return
+
+        last_id = -1 if after is None else int(after)
+        while True:
+            rows = self._execute(self.SQL_ACTIVE_USER_IDS_PAGE, (last_id, self.PAGE_SIZE))
+            for (user_id,) in rows:
+                yield str(user_id)
+            if len(rows) < self.PAGE_SIZE:
+                return
+            last_id = rows[-1][0]
+
+    def iter_users(self, after=None):
+        # Постраничный обход по ключу: курсор не держится открытым между await
+        last_id = -1 if after is None else int(after)
+        while True:
+            rows = self._execute(self.SQL_USERS_PAGE, (last_id, self.PAGE_SIZE))
+            for user_id, username, first_name, last_name, inactive in rows:
+                profile = {'username': username, 'first_name': first_name, 'last_name': last_name}
+                if inactive:
+                    profile['inactive'] = True
+                yield str(user_id), profile
+            if len(rows) < self.PAGE_SIZE:
+                return
+            last_id = rows[-1][0]
+
+    def user_count(self):
+        return self._execute(self.SQL_USER_COUNT, ())[0][0]
+
+    def set_active(self, user_id, active):
+        self._execute(self.SQL_SET_ACTIVE, (0 if active else 1, int(user_id)))
+        self._mark_dirty()
+
+    def count_users(self):
+        return tuple(self._execute(self.SQL_COUNT_USERS, ())[0])
+
+    def save_feedback(self, feedback_id, feedback):
+        self._execute(self.SQL_SAVE_FEEDBACK, (
+            feedback_id,
+            int(feedback['user_id']),
+            feedback['type'],
+            feedback['text'],
+            feedback['timestamp']
+        ))
+        self._mark_dirty()
+
+    def get_feedback(self, feedback_id):
+        rows = self._execute(self.SQL_GET_FEEDBACK, (feedback_id,))
+        if not rows:
+            return None
+        row = rows[0]
+        return {'user_id': row[0], 'type': row[1], 'text': row[2], 'timestamp': row[3]}
+
+
+class WriteBehind:
+    """Background task that coalesces storage changes and flushes them on a worker thread
+
+    A flush happens at most every interval_ms after the first change, or as
+    soon as max_pending changes have accumulated.
+    """
+
+    def __init__(self, storage, interval_ms=200, max_pending=500):
+        self.storage = storage
+        self.interval = interval_ms / 1000
+        self.max_pending = max_pending
+        self.pending = 0
+        self._dirty = None
+        self._full = None
+        self._stopping = False
+        self._task = None
+
+    def start(self):
+        """Start the writer task on the running event loop"""
+        self._dirty = asyncio.Event()
+        self._full = asyncio.Event()
+        self._stopping = False
+        self.storage.on_dirty = self.mark_dirty
+        self._task = asyncio.create_task(self._run())
+
+    def mark_dirty(self):
+        """Register one change to be flushed"""
+        self.pending += 1
+        STORAGE_CHANGES.inc()
+        self._dirty.set()
+        if self.pending >= self.max_pending:
+            self._full.set()
+
+    async def stop(self):
+        """Run a final flush and stop the writer task"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._dirty.set()
+        self._full.set()
+        await self._task
+        self._task = None
+        self.storage.on_dirty = None
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._dirty.clear()
+            self._full.clear()
+            self.pending = 0
+            # stop() во время flush мог прийти вместе с новыми изменениями: тогда нужен ещё один проход
+            stopping = self._stopping
+            try:
+                with STORAGE_FLUSH_SECONDS.time():
+                    await asyncio.to_thread(self.storage.flush)
+            except Exception as e:
+                STORAGE_FLUSH_ERRORS.inc()
+                logger.error(f"Error flushing storage: {e}")
+            if stopping:
+                return
+
+
+def create_storage(backend, snapshot_file, journal_file, feedbacks_file, sqlite_file, compact_every=1000,
+                   legacy_users_file=None):
+    """Create storage for the configured backend ('json' or 'sqlite')"""
+    if backend == 'sqlite':
+        return SqliteStorage(sqlite_file, snapshot_file, journal_file, legacy_users_file, feedbacks_file)
+    if backend == 'json':
+        return JsonStorage(snapshot_file, journal_file, feedbacks_file, compact_every, legacy_users_file)
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,160 @@
+"""Broadcast jobs: cursor and done_ids, resuming after a restart, expiry of finished jobs"""
+import json
+import time
+import asyncio
+
+from telegram.error import BadRequest, Forbidden
+
+from broadcast import BroadcastEngine, BroadcastJob, BroadcastManager
+
+
+class FakeBot:
+    """Records recipients; stop_after requests a stop like a shutdown would"""
+
+    def __init__(self, blocked=(), broken=(), stop_after=None):
+        self.sent = []
+        self.blocked = set(blocked)
+        self.broken = set(broken)
+        self.stop_after = stop_after
+        self.job = None
+
+    async def send_message(self, chat_id, text):
+        # Разная задержка, чтобы отправки завершались не по порядку
+        await asyncio.sleep(0.001 * (chat_id % 3))
+        if chat_id in self.blocked:
+            raise Forbidden('Forbidden: bot was blocked by the user')
+        if chat_id in self.broken:
+            raise BadRequest('Message text is empty')
+        self.sent.append(chat_id)
+        if self.stop_after is not None and len(self.sent) >= self.stop_after:
+            self.job.stop_requested = True
+
+
+def engine():
+    return BroadcastEngine(concurrency=4, rate=10000, per_chat_interval=0)
+
+
+def recipients(user_ids):
+    def after(cursor):
+        return (user_id for user_id in user_ids if cursor is None or user_id > cursor)
+    return after
+
+
+def test_job_cursor_and_done_ids():
+    job = BroadcastJob(1, 'text', 'Привет')
+    for user_id in (1, 2, 3, 4):
+        job.dispatched(user_id)
+    job.finished(2, 'sent')
+    job.finished(4, 'failed')
+    assert job.cursor is None
+    assert job.done_ids == {2, 4}
+
+    job.finished(1, 'unreachable')
+    assert job.cursor == 2
+    assert job.done_ids == {4}
+    job.finished(3, 'sent')
+    assert job.cursor == 4
+    assert job.done_ids == set()
+    assert (job.sent, job.failed, job.unreachable) == (2, 1, 1)
+
+
+def test_job_persistence():
+    job = BroadcastJob(7, 'photo', 'Акция', 'file-id', total=5)
+    for user_id in (1, 2, 3):
+        job.dispatched(user_id)
+    job.finished(1, 'sent')
+    job.finished(3, 'sent')
+    job.state = 'paused'
+
+    restored = BroadcastJob.from_dict(job.to_dict())
+    assert restored.to_dict() == job.to_dict()
+    assert (restored.cursor, restored.done_ids, restored.state) == (1, {3}, 'paused')
+
+
+def test_resume_skips_done_ids():
+    # Чекпоинт до перезапуска: 1 и 2 обработаны подряд, 4 и 6 - с опережением
+    job = BroadcastJob.from_dict({
+        'job_id': 1, 'kind': 'text', 'text': 'Привет', 'total': 8, 'sent': 4,
+        'state': 'running', 'cursor': 2, 'done_ids': [4, 6],
+    })
+    bot = FakeBot()
+    user_ids = list(range(1, 9))
+    asyncio.run(engine().run(bot, job, recipients(user_ids)(job.cursor)))
+
+    assert sorted(bot.sent) == [3, 5, 7, 8]
+    assert job.state == 'done'
+    assert job.cursor == 8
+    assert job.done_ids == set()
+    assert job.sent == 8
+
+
+def test_interrupted_broadcast_reaches_everyone_once(tmp_path):
+    user_ids = list(range(1, 41))
+    jobs_file = str(tmp_path / 'broadcasts.json')
+    unreachable = []
+    delivered = []
+
+    async def run_until_stopped(stop_after):
+        manager = BroadcastManager(
+            engine(), jobs_file, recipients(user_ids), str, on_unreachable=unreachable.append
+        )
+        manager.load()
+        bot = FakeBot(blocked={5}, broken={17}, stop_after=stop_after)
+        if not manager.jobs:
+            manager.start(bot, BroadcastJob(1, 'text', 'Привет', total=len(user_ids)))
+        else:
+            manager.restore(bot)
+        bot.job = manager.jobs[1]
+        await asyncio.gather(*manager._tasks.values())
+        await manager.shutdown()
+        delivered.extend(bot.sent)
+        return manager.jobs[1]
+
+    job = asyncio.run(run_until_stopped(10))
+    assert job.state == 'running'
+    assert job.cursor < 40
+
+    job = asyncio.run(run_until_stopped(None))
+    assert job.state == 'done'
+    assert sorted(delivered) == [user_id for user_id in user_ids if user_id not in (5, 17)]
+    assert (job.sent, job.failed, job.unreachable) == (38, 1, 1)
+    assert unreachable == [5]
+
+
+def test_finished_jobs_expire(tmp_path):
+    jobs_file = tmp_path / 'broadcasts.json'
+    now = time.time()
+    jobs = [
+        dict(job_id=f'old{number}', kind='text', state='done', finished_at=now - 40 * 86400) for number in range(100)
+    ] + [
+        dict(job_id='legacy', kind='text', state='cancelled'),
+        dict(job_id='recent', kind='text', state='done', finished_at=now - 86400),
+        dict(job_id='paused', kind='text', state='paused', cursor=10),
+    ]
+    jobs_file.write_text(json.dumps(jobs), encoding='utf-8')
+
+    manager = BroadcastManager(engine(), str(jobs_file), recipients([]), str, retention=30 * 86400)
+    manager.load()
+    asyncio.run(manager.checkpoint())
+    assert list(manager.jobs) == ['legacy', 'recent', 'paused']
+    # Задача без отметки времени из старого чекпоинта удаляется только после нового срока
+    assert manager.jobs['legacy'].finished_at >= now
+
+    reloaded = BroadcastManager(engine(), str(jobs_file), recipients([]), str)
+    reloaded.load()
+    assert list(reloaded.jobs) == ['legacy', 'recent', 'paused']
+    assert reloaded.jobs['paused'].cursor == 10
+
+
+def test_listed_jobs(tmp_path):
+    manager = BroadcastManager(engine(), str(tmp_path / 'broadcasts.json'), recipients([]), str)
+    for number in range(15):
+        job = BroadcastJob(f'done{number}', 'text')
+        job.state, job.finished_at = 'done', 1000 + number
+        manager.jobs[job.job_id] = job
+    running = manager.jobs['running'] = BroadcastJob('running', 'text')
+
+    jobs, hidden = manager.listed(3)
+    assert [job.job_id for job in jobs] == ['running', 'done14', 'done13', 'done12']
+    assert hidden == 12
+    assert manager.listed(0) == ([running], 15)
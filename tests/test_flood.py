@@ -0,0 +1,103 @@
+"""Anti-flood token buckets and duplicate callback suppression"""
+import asyncio
+import datetime
+
+import pytest
+from telegram import CallbackQuery, Chat, Message, Update, User
+from telegram.ext import ApplicationHandlerStop
+
+from flood import AntiFlood, SWEEP_INTERVAL
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def message_update(user_id, text='Привет'):
+    message = Message(
+        message_id=1,
+        date=datetime.datetime.now(datetime.timezone.utc),
+        chat=Chat(user_id, Chat.PRIVATE),
+        from_user=User(user_id, 'Анна', False),
+        text=text,
+    )
+    return Update(1, message=message)
+
+
+def callback_update(user_id, data, message_id=10):
+    message = Message(
+        message_id=message_id,
+        date=datetime.datetime.now(datetime.timezone.utc),
+        chat=Chat(user_id, Chat.PRIVATE),
+    )
+    query = CallbackQuery('1', User(user_id, 'Анна', False), 'chat', message=message, data=data)
+    return Update(2, callback_query=query)
+
+
+def test_burst_then_refill():
+    clock = Clock()
+    flood = AntiFlood(rate=1.0, burst=3.0, clock=clock)
+    assert [flood.check(message_update(1)) for _ in range(4)] == [None, None, None, 'rate']
+    # Другой пользователь ограничивается отдельно
+    assert flood.check(message_update(2)) is None
+
+    clock.now += 0.5
+    assert flood.check(message_update(1)) == 'rate'
+    clock.now += 0.5
+    assert flood.check(message_update(1)) is None
+    assert flood.check(message_update(1)) == 'rate'
+
+
+def test_commands_cost_more():
+    clock = Clock()
+    flood = AntiFlood(rate=1.0, burst=5.0, command_cost=3.0, clock=clock)
+    assert flood.check(message_update(1, '/start')) is None
+    assert flood.check(message_update(1, '/start')) == 'rate'
+    assert flood.check(message_update(1, 'Меню')) is None
+    assert flood.check(message_update(1, 'Меню')) is None
+    assert flood.check(message_update(1, 'Меню')) == 'rate'
+
+
+def test_duplicate_callbacks():
+    clock = Clock()
+    flood = AntiFlood(duplicate_window=2.0, clock=clock)
+    assert flood.check(callback_update(1, 'rate_drink_5')) is None
+    assert flood.check(callback_update(1, 'rate_drink_5')) == 'duplicate'
+    # Другие данные или другое сообщение - не повтор
+    assert flood.check(callback_update(1, 'rate_drink_4')) is None
+    assert flood.check(callback_update(1, 'rate_drink_4', message_id=11)) is None
+
+    clock.now += 2.0
+    assert flood.check(callback_update(1, 'rate_drink_4', message_id=11)) is None
+
+
+def test_exempt_users():
+    flood = AntiFlood(burst=1.0, exempt=lambda user_id: user_id == 42, clock=Clock())
+    assert [flood.check(message_update(42)) for _ in range(5)] == [None] * 5
+    assert flood.check(callback_update(42, 'x')) is None
+    assert flood.check(callback_update(42, 'x')) is None
+
+
+def test_sweep_forgets_idle_users():
+    clock = Clock()
+    flood = AntiFlood(rate=1.0, burst=10.0, clock=clock)
+    for user_id in range(100):
+        flood.check(callback_update(user_id, 'loc:degtyarev'))
+    flood.check(message_update(1000, '/start'))
+    assert len(flood._buckets) == 101
+
+    clock.now += SWEEP_INTERVAL
+    flood.check(message_update(1))
+    assert set(flood._buckets) == {1}
+    assert flood._callbacks == {}
+
+
+def test_guard_update_stops_processing():
+    flood = AntiFlood(burst=1.0, clock=Clock())
+    asyncio.run(flood.guard_update(message_update(1), None))
+    with pytest.raises(ApplicationHandlerStop):
+        asyncio.run(flood.guard_update(message_update(1), None))
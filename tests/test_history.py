@@ -0,0 +1,159 @@
+"""Rating history segments and per-day aggregates"""
+import os
+import datetime
+
+from history import RatingHistory, DAY
+
+# 2024-03-04, понедельник, полночь UTC
+MONDAY = 1709510400
+
+
+def open_history(tmp_path):
+    history = RatingHistory(str(tmp_path / 'history.bin'), utc_offset=0)
+    history.load()
+    return history
+
+
+def events(history):
+    return [tuple(history.columns[name][i] for name in history.columns) for i in range(len(history))]
+
+
+def test_round_trip(tmp_path):
+    history = open_history(tmp_path)
+    history.on_dirty = lambda: None
+    history.record(1, 'degtyarev', 'drink', 5, MONDAY)
+    history.record(2, 'degtyarev', 'service', 3, MONDAY + 60)
+    history.flush()
+    history.record(3, 'city-mall', 'drink', 4, MONDAY + DAY)
+    history.record(1, 'degtyarev', 'drink', 2, MONDAY + DAY)
+    history.close()
+
+    reloaded = open_history(tmp_path)
+    assert reloaded.locations == ['degtyarev', 'city-mall']
+    assert events(reloaded) == events(history)
+    assert reloaded.distribution('degtyarev', 'drink') == [0, 1, 0, 0, 1]
+    monday = datetime.date(2024, 3, 4)
+    assert reloaded.timeline('degtyarev', 'drink') == [
+        (monday, 1, 5.0, 5.0),
+        (monday + datetime.timedelta(days=1), 1, 2.0, 3.5),
+    ]
+    assert reloaded.timeline('degtyarev', 'drink', period='week') == [(monday, 2, 3.5, 3.5)]
+
+
+def test_aggregates_follow_new_events(tmp_path):
+    history = open_history(tmp_path)
+    history.record(1, 'degtyarev', 'drink', 4, MONDAY)
+    assert history.distribution('degtyarev', 'drink') == [0, 0, 0, 1, 0]
+    # Событие после построения свёртки, в том числе на более ранний день
+    history.record(2, 'degtyarev', 'drink', 1, MONDAY - DAY)
+    history.record(3, 'degtyarev', 'drink', 4, MONDAY + 2 * DAY)
+    assert history.distribution('degtyarev', 'drink') == [1, 0, 0, 2, 0]
+    assert history.percentiles('degtyarev', 'drink') == {50: 4, 90: 4}
+    assert history.distribution('city-mall', 'drink') == [0] * 5
+
+
+def test_damaged_tail_is_cut_off(tmp_path):
+    history = open_history(tmp_path)
+    history.record(1, 'degtyarev', 'drink', 5, MONDAY)
+    history.record(2, 'degtyarev', 'drink', 4, MONDAY)
+    size = os.path.getsize(history.path)
+    history.record(3, 'city-mall', 'service', 1, MONDAY)
+    history.close()
+
+    # Последний сегмент дописан наполовину
+    with open(history.path, 'r+b') as f:
+        f.truncate(size + 10)
+    reloaded = open_history(tmp_path)
+    assert len(reloaded) == 2
+    assert os.path.getsize(history.path) == size
+
+    reloaded.record(4, 'city-mall', 'service', 2, MONDAY)
+    reloaded.close()
+    again = open_history(tmp_path)
+    assert len(again) == 3
+    assert again.distribution('city-mall', 'service') == [0, 1, 0, 0, 0]
+
+
+def test_damaged_last_segment_is_skipped(tmp_path):
+    history = open_history(tmp_path)
+    history.record(1, 'degtyarev', 'drink', 5, MONDAY)
+    history.record(2, 'degtyarev', 'drink', 4, MONDAY)
+    history.close()
+    size = os.path.getsize(history.path)
+
+    with open(history.path, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b'\x7f')
+    reloaded = open_history(tmp_path)
+    assert len(reloaded) == 1
+    # Целый сегмент с неверной суммой не обрезается, новые события пишутся после него
+    assert os.path.getsize(history.path) == size
+    reloaded.record(3, 'degtyarev', 'drink', 3, MONDAY)
+    assert len(open_history(tmp_path)) == 2
+
+
+def flip(path, position):
+    with open(path, 'r+b') as f:
+        f.seek(position)
+        byte = f.read(1)
+        f.seek(position)
+        f.write(bytes([byte[0] ^ 0x01]))
+
+
+def write_segments(tmp_path, count):
+    history = open_history(tmp_path)
+    bounds = []
+    for user_id in range(count):
+        history.record(user_id, 'degtyarev', 'drink', user_id % 5 + 1, MONDAY)
+        bounds.append(os.path.getsize(history.path))
+    history.close()
+    return history.path, bounds
+
+
+def test_damaged_segment_in_the_middle(tmp_path):
+    path, bounds = write_segments(tmp_path, 10)
+    flip(path, 40)
+
+    reloaded = open_history(tmp_path)
+    assert list(reloaded.columns['user']) == list(range(1, 10))
+    assert os.path.getsize(path) == bounds[-1]
+
+
+def test_damaged_segment_header_in_the_middle(tmp_path):
+    path, bounds = write_segments(tmp_path, 10)
+    # У пятого сегмента испорчено число событий, у седьмого - сигнатура
+    flip(path, bounds[3] + 4)
+    flip(path, bounds[5])
+
+    reloaded = open_history(tmp_path)
+    assert list(reloaded.columns['user']) == [0, 1, 2, 3, 5, 7, 8, 9]
+    assert os.path.getsize(path) == bounds[-1]
+
+
+def test_cut_tail_is_kept_aside(tmp_path):
+    path, bounds = write_segments(tmp_path, 3)
+    with open(path, 'ab') as f:
+        f.write(b'RHS1\x05')
+
+    reloaded = open_history(tmp_path)
+    assert len(reloaded) == 3
+    assert os.path.getsize(path) == bounds[-1]
+    with open(f"{path}.damaged", 'rb') as f:
+        assert f.read() == b'RHS1\x05'
+
+
+def test_rename_location(tmp_path):
+    history = open_history(tmp_path)
+    history.record(1, 'Дегтярев', 'drink', 5, MONDAY)
+    history.record(2, 'degtyarev', 'drink', 4, MONDAY)
+    assert not history.rename_location('Дегтярев', 'degtyarev')
+    assert not history.rename_location('Сити Молл', 'city-mall')
+
+    history.record(3, 'Сити Молл', 'drink', 3, MONDAY)
+    assert history.rename_location('Сити Молл', 'city-mall')
+    assert history.distribution('city-mall', 'drink') == [0, 0, 1, 0, 0]
+    history.close()
+
+    reloaded = open_history(tmp_path)
+    assert reloaded.locations == ['Дегтярев', 'degtyarev', 'city-mall']
+    assert reloaded.distribution('city-mall', 'drink') == [0, 0, 1, 0, 0]
@@ -0,0 +1,137 @@
+"""Location registry and the paginated location keyboard"""
+import json
+
+import pytest
+
+import keyboards
+from keyboards import LocationKeyboard
+from locations import DEFAULT_LOCATIONS, LocationRegistry
+
+
+def registry_of(count, rename=None):
+    rename = rename or {}
+    return LocationRegistry([
+        {'id': f'shop-{number}', 'name': rename.get(number, f'Кофейня {number}')} for number in range(count)
+    ])
+
+
+class Labels:
+    """Button text as bot.get_location_button_text builds it, with ratings kept by location id"""
+
+    def __init__(self):
+        self.ratings = {}
+        self.calls = []
+
+    def __call__(self, location):
+        self.calls.append(location.id)
+        total = self.ratings.get(location.id)
+        return f"{location.name} (👤 {total})" if total else location.name
+
+
+def button_rows(markup):
+    return [[(button.text, button.callback_data) for button in row] for row in markup.inline_keyboard]
+
+
+def test_registry_lookups(tmp_path):
+    registry = registry_of(3)
+    assert len(registry) == 3
+    assert registry.get('shop-1').name == 'Кофейня 1'
+    assert registry.get('shop-9') is None
+    assert registry.find(' Кофейня 2 ').id == 'shop-2'
+    assert [location.index for location in registry] == [0, 1, 2]
+
+    assert [location.id for location in LocationRegistry.load(str(tmp_path / 'missing.json'))] == [
+        entry['id'] for entry in DEFAULT_LOCATIONS
+    ]
+    path = tmp_path / 'locations.json'
+    path.write_text(json.dumps([{'id': 'bad id', 'name': 'x'}]), encoding='utf-8')
+    with pytest.raises(ValueError, match='locations.json'):
+        LocationRegistry.load(str(path))
+
+
+@pytest.mark.parametrize('entries', [
+    [],
+    [{'id': 'a', 'name': ''}],
+    [{'id': 'a', 'name': 'x'}, {'id': 'a', 'name': 'y'}],
+    [{'id': 'a', 'name': 'x'}, {'id': 'b', 'name': 'x'}],
+    [{'id': 'a' * 49, 'name': 'x'}],
+])
+def test_registry_rejects_bad_config(entries):
+    with pytest.raises(ValueError):
+        LocationRegistry(entries)
+
+
+def test_pages():
+    keyboard = LocationKeyboard(registry_of(20), Labels(), page_size=8)
+    assert keyboard.pages == 3
+    assert [keyboard.page_of(location) for location in keyboard.registry.locations[6:10]] == [0, 0, 1, 1]
+
+    rows = button_rows(keyboard.get(2))
+    assert rows[:4] == [[(f'Кофейня {number}', f'loc:shop-{number}')] for number in range(16, 20)]
+    assert rows[4] == [('‹', 'locpage:1'), ('3/3', keyboards.LOCATION_NOOP_CALLBACK), ('›', 'locpage:0')]
+    assert rows[5][0][1] == keyboards.LOCATION_BACK_CALLBACK
+    # Номер страницы за пределами ограничивается
+    assert keyboard.get(7) is keyboard.get(2)
+    assert keyboard.get(-1) is keyboard.get(0)
+
+    single = LocationKeyboard(registry_of(2), Labels())
+    assert single.pages == 1
+    assert len(button_rows(single.get())) == 3
+
+
+def test_lookup_by_label_and_callback():
+    labels = Labels()
+    labels.ratings['shop-5'] = 3
+    keyboard = LocationKeyboard(registry_of(300), labels)
+    assert keyboard.find('Кофейня 5 (👤 3)').id == 'shop-5'
+    assert keyboard.find('Кофейня 5').id == 'shop-5'
+    assert keyboard.find('Кофейня 5 (👤 2)') is None
+    for (text, data), in button_rows(keyboard.get(keyboard.pages - 1))[:-2]:
+        location = keyboard.registry.get(data[len(keyboards.LOCATION_CALLBACK):])
+        assert keyboard.find(text) is location
+
+
+def test_invalidate_refreshes_stale_label():
+    labels = Labels()
+    keyboard = LocationKeyboard(registry_of(20), labels, page_size=8)
+    pages = [keyboard.get(page) for page in range(3)]
+    labels.calls.clear()
+
+    labels.ratings['shop-9'] = 1
+    # Без invalidate() подпись не пересчитывается
+    assert keyboard.get(1) is pages[1]
+    keyboard.invalidate('shop-9')
+    keyboard.invalidate('unknown')
+    updated = keyboard.get(1)
+    assert labels.calls == ['shop-9']
+    assert updated is not pages[1]
+    assert button_rows(updated)[1] == [('Кофейня 9 (👤 1)', 'loc:shop-9')]
+    assert keyboard.get(0) is pages[0] and keyboard.get(2) is pages[2]
+    assert keyboard.find('Кофейня 9 (👤 1)').id == 'shop-9'
+    assert keyboard.find('Кофейня 9').id == 'shop-9'
+
+    # Метка не изменилась: страница остаётся прежней
+    keyboard.invalidate('shop-9')
+    assert keyboard.get(1) is updated
+
+    labels.calls.clear()
+    keyboard.invalidate()
+    keyboard.get(0)
+    assert sorted(labels.calls) == sorted(f'shop-{number}' for number in range(20))
+
+
+def test_rename_keeps_id():
+    labels = Labels()
+    labels.ratings['shop-3'] = 7
+    before = LocationKeyboard(registry_of(10), labels)
+    old_rows = button_rows(before.get())
+
+    # После переименования в конфиге и перезапуска id, оценки и callback data прежние
+    after = LocationKeyboard(registry_of(10, rename={3: 'Кофейня на Ленина'}), labels)
+    rows = button_rows(after.get())
+    assert rows[3] == [('Кофейня на Ленина (👤 7)', 'loc:shop-3')]
+    assert old_rows[3][0][1] == rows[3][0][1]
+    # Кнопка из уже отправленной клавиатуры ведёт на ту же локацию
+    assert after.registry.get(old_rows[3][0][1][len(keyboards.LOCATION_CALLBACK):]).name == 'Кофейня на Ленина'
+    assert after.find('Кофейня 3 (👤 7)') is None
+    assert after.find('Кофейня на Ленина').id == 'shop-3'
@@ -0,0 +1,63 @@
+"""Menu image resizing and the rendition cache"""
+import io
+import os
+import asyncio
+
+from PIL import Image
+
+from media import ImageCache, resize_image
+
+
+def save_image(path, size, mode='RGB', fmt='JPEG'):
+    Image.new(mode, size, (200, 120, 40) if mode == 'RGB' else (200, 120, 40, 128)).save(path, fmt)
+    return str(path)
+
+
+def rendered_size(data):
+    with Image.open(io.BytesIO(data)) as img:
+        assert img.format == 'JPEG'
+        return img.size
+
+
+def test_small_images_are_not_upscaled(tmp_path):
+    assert rendered_size(resize_image(save_image(tmp_path / 'small.jpg', (300, 200)))) == (300, 200)
+    assert rendered_size(resize_image(save_image(tmp_path / 'edge.jpg', (1280, 640)))) == (1280, 640)
+
+
+def test_downscaling_keeps_aspect_ratio(tmp_path):
+    # Уменьшение больше чем вдвое идёт через draft-декодирование JPEG
+    assert rendered_size(resize_image(save_image(tmp_path / 'wide.jpg', (4000, 1000)))) == (1280, 320)
+    assert rendered_size(resize_image(save_image(tmp_path / 'tall.jpg', (1500, 4500)))) == (426, 1280)
+    assert rendered_size(resize_image(save_image(tmp_path / 'odd.jpg', (2561, 1707)), max_size=640)) == (640, 426)
+
+
+def test_transparent_png_is_converted(tmp_path):
+    path = save_image(tmp_path / 'logo.png', (2000, 1000), mode='RGBA', fmt='PNG')
+    assert rendered_size(resize_image(path)) == (1280, 640)
+
+
+def test_cache_renders_once_per_content(tmp_path):
+    source = save_image(tmp_path / 'menu.jpg', (3000, 2000))
+    cache_dir = str(tmp_path / 'cache')
+    cache = ImageCache(cache_dir)
+    first = cache.get(source)
+    assert rendered_size(first) == (1280, 853)
+    assert cache.get(source) is first
+    assert len(os.listdir(cache_dir)) == 1
+
+    # После перезапуска копия берётся с диска
+    restarted = ImageCache(cache_dir)
+    assert restarted.get(source) == first
+    key = asyncio.run(restarted.akey(source))
+
+    save_image(source, (1000, 3000))
+    os.utime(source, ns=(0, 0))
+    assert rendered_size(restarted.get(source)) == (426, 1280)
+    assert asyncio.run(restarted.akey(source)) != key
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_missing_image(tmp_path):
+    cache = ImageCache(str(tmp_path / 'cache'))
+    assert cache.get(str(tmp_path / 'missing.jpg')) is None
+    assert asyncio.run(cache.akey(str(tmp_path / 'missing.jpg'))) is None
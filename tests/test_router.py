@@ -0,0 +1,60 @@
+"""Exact-text button routing"""
+import asyncio
+import datetime
+
+from telegram import Chat, Message, Update, User
+
+from router import ButtonFilter, ButtonRouter
+
+
+def text_update(text, update_id=1):
+    message = Message(
+        message_id=update_id,
+        date=datetime.datetime.now(datetime.timezone.utc),
+        chat=Chat(1, Chat.PRIVATE),
+        from_user=User(1, 'Анна', False),
+        text=text,
+    )
+    return Update(update_id, message=message)
+
+
+def test_filter_matches_exact_labels():
+    button_filter = ButtonFilter(['📋 Меню', 'Назад'])
+    assert button_filter.check_update(text_update('📋 Меню'))
+    assert button_filter.check_update(text_update('Назад'))
+    assert not button_filter.check_update(text_update('назад'))
+    assert not button_filter.check_update(text_update('Назад '))
+    # Метки сравниваются как строки, а не как регулярные выражения
+    assert not ButtonFilter(['(.*)']).check_update(text_update('anything'))
+    assert ButtonFilter(['(.*)']).check_update(text_update('(.*)'))
+
+
+def test_router_dispatches_by_text():
+    calls = []
+
+    def handler(name, result):
+        async def handle(update, context):
+            calls.append((name, update.effective_message.text, context))
+            return result
+        return handle
+
+    router = ButtonRouter({'Меню': handler('menu', 1), 'Вакансии': handler('jobs', 2)})
+    assert router.filter.check_update(text_update('Меню'))
+    assert not router.filter.check_update(text_update('Другое'))
+
+    assert asyncio.run(router.dispatch(text_update('Вакансии'), 'ctx')) == 2
+    assert asyncio.run(router.dispatch(text_update('Меню'), 'ctx')) == 1
+    assert calls == [('jobs', 'Вакансии', 'ctx'), ('menu', 'Меню', 'ctx')]
+
+
+def test_router_without_route():
+    calls = []
+
+    async def fallback(update, context):
+        calls.append(update.effective_message.text)
+        return 'fallback'
+
+    # Без обработчика по умолчанию состояние разговора не меняется
+    assert asyncio.run(ButtonRouter({}).dispatch(text_update('Что-то'), None)) is None
+    assert asyncio.run(ButtonRouter({}, fallback).dispatch(text_update('Что-то'), None)) == 'fallback'
+    assert calls == ['Что-то']
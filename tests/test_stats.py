@@ -0,0 +1,81 @@
+"""/stats report: caption splitting and the chart with many locations"""
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+from history import RatingHistory
+from locations import LocationRegistry
+from stats import CHART_LOCATIONS, MESSAGE_LIMIT, StatsCache, build_report, render_chart, split_message
+
+TODAY = datetime.date(2024, 3, 10)
+
+
+def many_locations(tmp_path, count):
+    registry = LocationRegistry([
+        {'id': f'shop-{number}', 'name': f'Кофейня на очень длинной улице имени кого-то, дом {number}'}
+        for number in range(count)
+    ])
+    history = RatingHistory(str(tmp_path / 'history.bin'), utc_offset=0)
+    history.load()
+    history.on_dirty = lambda: None
+    noon = datetime.datetime(2024, 3, 9, 12, tzinfo=datetime.timezone.utc).timestamp()
+    # У локаций с большими номерами больше оценок
+    for number in range(count):
+        for user_id in range(number % 10):
+            history.record(user_id, f'shop-{number}', 'drink', 4, noon)
+    return registry, history
+
+
+def location_rating(location_id):
+    return 40, 10, 35, 10
+
+
+def test_split_message():
+    text = '\n\n'.join(['a' * 1000] * 9)
+    chunks = split_message(text)
+    assert [len(chunk) for chunk in chunks] == [4006, 4006, 1000]
+    assert '\n\n'.join(chunks) == text
+    assert split_message('x' * 9000) == ['x' * 4096, 'x' * 4096, 'x' * 808]
+    assert split_message('short') == ['short']
+
+
+def test_report_for_many_locations(tmp_path):
+    registry, history = many_locations(tmp_path, 300)
+    caption, dates, series, titles = build_report(history, registry.locations, location_rating, 30, TODAY)
+
+    assert len(dates) == 30
+    assert len(caption) > MESSAGE_LIMIT
+    for number in (0, 150, 299):
+        assert f'дом {number}\n' in caption
+    # На график попадают локации с наибольшим числом оценок, в порядке реестра
+    assert [name.rsplit(' ', 1)[1] for name, _ in series] == ['9', '19', '29', '39', '49', '59']
+    assert len(series) == CHART_LOCATIONS
+    assert render_chart(dates, series, titles).startswith(b'\x89PNG')
+
+
+class FakeMessage:
+    def __init__(self):
+        self.photos = []
+        self.texts = []
+
+    async def reply_photo(self, photo, caption=None, filename=None):
+        self.photos.append(caption)
+        return SimpleNamespace(photo=[SimpleNamespace(file_id='chart')])
+
+    async def reply_text(self, text):
+        assert len(text) <= MESSAGE_LIMIT
+        self.texts.append(text)
+
+
+def test_long_caption_is_sent_in_parts(tmp_path):
+    registry, history = many_locations(tmp_path, 300)
+    message = FakeMessage()
+
+    def build():
+        return build_report(history, registry.locations, location_rating, 30, TODAY)
+
+    asyncio.run(StatsCache().send(message, 'key', build))
+    caption = build()[0]
+    assert message.photos == [None]
+    assert len(message.texts) > 1
+    assert '\n\n'.join(message.texts) == caption
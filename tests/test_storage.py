@@ -0,0 +1,316 @@
+"""Storage backends: behaviour shared by both, plus snapshot, journal and compaction of JsonStorage"""
+import os
+import sqlite3
+
+import pytest
+
+import snapshot
+from storage import JsonStorage, create_storage
+from history import RatingHistory
+from locations import LocationRegistry, migrate_name_keys
+
+BACKENDS = ('json', 'sqlite')
+
+
+def open_storage(tmp_path, compact_every=1000, backend='json', legacy_users_file=None):
+    storage = create_storage(
+        backend, str(tmp_path / 'users.snap'), str(tmp_path / 'users.journal'),
+        str(tmp_path / 'feedbacks.jsonl'), str(tmp_path / 'users.db'), compact_every, legacy_users_file
+    )
+    storage.load()
+    return storage
+
+
+def fill(storage):
+    storage.upsert_user(1, {'username': 'anna', 'first_name': 'Анна'})
+    storage.upsert_user(2, {'username': 'boris'})
+    storage.upsert_user(10, {'username': 'vera'})
+    storage.set_rating(1, 'degtyarev', 'drink', 5)
+    storage.set_rating(1, 'degtyarev', 'service', 4)
+    storage.set_rating(2, 'degtyarev', 'drink', 3)
+    storage.set_rating(2, 'city-mall', 'service', 2)
+    storage.set_active(10, False)
+
+
+def contents(storage):
+    return (
+        {user_id: user_info for user_id, user_info in storage.iter_users()},
+        {location: storage.location_rating(location) for location in ('degtyarev', 'city-mall')},
+        storage.count_users(),
+    )
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_round_trip(tmp_path, backend):
+    storage = open_storage(tmp_path, backend=backend)
+    fill(storage)
+    storage.save_feedback('f1', {'user_id': 2, 'type': 'service_quality', 'text': 'Долго', 'timestamp': 't'})
+    expected = contents(storage)
+    storage.flush()
+
+    # Без close(): для json всё, что не попало в снимок, восстанавливается из журнала
+    reloaded = open_storage(tmp_path, backend=backend)
+    assert contents(reloaded) == expected
+    assert reloaded.location_rating('degtyarev') == (8, 2, 4, 1)
+    assert reloaded.location_rating('unknown') == (0, 0, 0, 0)
+    assert reloaded.count_users() == (2, 1)
+    assert reloaded.user_count() == 3
+    assert reloaded.get_rating(2, 'city-mall') == {'location': 'city-mall', 'service_rating': 2}
+    assert reloaded.get_rating(10, 'city-mall') is None
+    assert reloaded.get_user(1)['username'] == 'anna'
+    assert reloaded.get_feedback('f1') == {
+        'user_id': 2, 'type': 'service_quality', 'text': 'Долго', 'timestamp': 't'
+    }
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_ratings_and_activity(tmp_path, backend):
+    storage = open_storage(tmp_path, backend=backend)
+    fill(storage)
+    assert storage.set_rating(1, 'degtyarev', 'drink', 2) == 5
+    assert storage.set_rating(3, 'city-mall', 'drink', 4) is None
+    assert storage.location_rating('degtyarev') == (5, 2, 4, 1)
+    assert storage.location_rating('city-mall') == (4, 1, 2, 1)
+
+    assert list(storage.iter_user_ids()) == ['1', '2', '3', '10']
+    assert list(storage.iter_user_ids(active_only=True)) == ['1', '2', '3']
+    assert list(storage.iter_user_ids(after='2')) == ['3', '10']
+    storage.set_active(2, False)
+    assert list(storage.iter_user_ids(after='1', active_only=True)) == ['3']
+    assert storage.count_users() == (2, 2)
+    # Пользователь снова написал боту
+    storage.upsert_user(10, {'username': 'vera'})
+    assert list(storage.iter_user_ids(active_only=True)) == ['1', '3', '10']
+    assert storage.count_users() == (3, 1)
+
+
+def test_round_trip_through_snapshot(tmp_path):
+    storage = open_storage(tmp_path)
+    fill(storage)
+    expected = contents(storage)
+    storage.close()
+    assert os.path.getsize(tmp_path / 'users.journal') == 0
+
+    reloaded = open_storage(tmp_path)
+    assert contents(reloaded) == expected
+    assert list(reloaded.iter_user_ids()) == ['1', '2', '10']
+    assert list(reloaded.iter_user_ids(after='1', active_only=True)) == ['2']
+
+
+def test_writes_after_compaction(tmp_path):
+    storage = open_storage(tmp_path, compact_every=3)
+    fill(storage)
+    storage.flush()
+    storage.set_rating(10, 'city-mall', 'drink', 1)
+    storage.upsert_user(3, {'username': 'gleb'})
+    expected = contents(storage)
+    storage.flush()
+
+    reloaded = open_storage(tmp_path)
+    assert contents(reloaded) == expected
+
+
+def test_truncated_journal_tail(tmp_path):
+    storage = open_storage(tmp_path)
+    fill(storage)
+    storage.flush()
+    expected = contents(storage)
+    with open(tmp_path / 'users.journal', 'a', encoding='utf-8') as f:
+        f.write('{"op":"rating","id":"1","loc')
+
+    reloaded = open_storage(tmp_path)
+    assert contents(reloaded) == expected
+    # Недописанная строка не должна остаться перед новыми записями
+    assert os.path.getsize(tmp_path / 'users.journal') == 0
+    reloaded.set_rating(1, 'city-mall', 'drink', 4)
+    reloaded.flush()
+    assert open_storage(tmp_path).get_rating(1, 'city-mall') == {'location': 'city-mall', 'drink_rating': 4}
+
+
+def test_crash_before_journal_truncation(tmp_path):
+    storage = open_storage(tmp_path)
+    fill(storage)
+    storage.flush()
+    with open(tmp_path / 'users.journal', 'rb') as f:
+        journal = f.read()
+    expected = contents(storage)
+    storage.close()
+
+    # Снимок уже записан, а журнал усечь не успели: записи применяются повторно
+    with open(tmp_path / 'users.journal', 'wb') as f:
+        f.write(journal)
+    reloaded = open_storage(tmp_path)
+    assert contents(reloaded) == expected
+
+
+def test_crash_while_writing_snapshot(tmp_path):
+    storage = open_storage(tmp_path)
+    fill(storage)
+    storage.close()
+    storage = open_storage(tmp_path)
+    storage.set_rating(10, 'degtyarev', 'drink', 2)
+    storage.flush()
+    expected = contents(storage)
+
+    # Недописанный временный файл не заменил снимок и не мешает следующему
+    with open(tmp_path / 'users.snap.tmp', 'wb') as f:
+        f.write(b'BBUS\x01')
+    reloaded = open_storage(tmp_path)
+    assert contents(reloaded) == expected
+    reloaded.close()
+    assert contents(open_storage(tmp_path)) == expected
+
+
+def test_damaged_snapshot_is_rejected(tmp_path):
+    storage = open_storage(tmp_path)
+    fill(storage)
+    storage.close()
+    with open(tmp_path / 'users.snap', 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xff]))
+
+    with pytest.raises(snapshot.SnapshotError):
+        open_storage(tmp_path)
+
+
+def test_damaged_snapshot_is_never_overwritten(tmp_path):
+    storage = open_storage(tmp_path)
+    fill(storage)
+    storage.close()
+    storage = open_storage(tmp_path)
+    storage.upsert_user(5, {'username': 'dina'})
+    storage.flush()
+    with open(tmp_path / 'users.snap', 'r+b') as f:
+        f.seek(40)
+        byte = f.read(1)
+        f.seek(40)
+        f.write(bytes([byte[0] ^ 0x01]))
+    files = {name: (tmp_path / name).read_bytes() for name in ('users.snap', 'users.journal')}
+
+    # Бот, проигнорировавший ошибку загрузки, не должен затереть снимок пустым хранилищем
+    storage = JsonStorage(
+        str(tmp_path / 'users.snap'), str(tmp_path / 'users.journal'), str(tmp_path / 'feedbacks.jsonl')
+    )
+    with pytest.raises(snapshot.SnapshotError):
+        storage.load()
+    with pytest.raises(RuntimeError):
+        storage.upsert_user(99, {'username': 'new'})
+    with pytest.raises(RuntimeError):
+        storage.close()
+    assert {name: (tmp_path / name).read_bytes() for name in files} == files
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_rename_location(tmp_path, backend):
+    storage = open_storage(tmp_path, backend=backend)
+    fill(storage)
+    storage.rename_location('degtyarev', 'degtyarev-2')
+    storage.flush()
+    assert storage.location_rating('degtyarev') == (0, 0, 0, 0)
+    assert storage.location_rating('degtyarev-2') == (8, 2, 4, 1)
+
+    reloaded = open_storage(tmp_path, backend=backend)
+    assert reloaded.location_rating('degtyarev-2') == (8, 2, 4, 1)
+    assert reloaded.get_rating(1, 'degtyarev-2') == {
+        'location': 'degtyarev-2', 'drink_rating': 5, 'service_rating': 4
+    }
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_legacy_json_migration(tmp_path, backend):
+    legacy = tmp_path / 'users_data.json'
+    legacy.write_text(
+        '{"1": {"username": "anna", "ratings": [{"location": "degtyarev", "drink_rating": 5}]},'
+        ' "2": {"username": "boris", "inactive": true}}',
+        encoding='utf-8'
+    )
+    storage = open_storage(tmp_path, backend=backend, legacy_users_file=str(legacy))
+    if backend == 'json':
+        assert not legacy.exists()
+        assert (tmp_path / 'users_data.json.migrated').exists()
+
+    reloaded = open_storage(tmp_path, backend=backend)
+    assert reloaded.count_users() == (1, 1)
+    assert reloaded.location_rating('degtyarev') == (5, 1, 0, 0)
+    assert list(reloaded.iter_user_ids(active_only=True)) == ['1']
+
+
+def test_json_to_sqlite_migration(tmp_path):
+    storage = open_storage(tmp_path)
+    fill(storage)
+    storage.close()
+    # Часть изменений только в журнале
+    storage = open_storage(tmp_path)
+    storage.set_rating(10, 'city-mall', 'drink', 4)
+    storage.save_feedback('f1', {'user_id': 2, 'type': 'drink_quality', 'text': 'Холодный', 'timestamp': 't'})
+    storage.flush()
+    snapshot_bytes = (tmp_path / 'users.snap').read_bytes()
+
+    migrated = open_storage(tmp_path, backend='sqlite')
+    assert migrated.user_count() == 3
+    assert migrated.count_users() == (2, 1)
+    assert list(migrated.iter_user_ids(active_only=True)) == ['1', '2']
+    assert migrated.location_rating('degtyarev') == (8, 2, 4, 1)
+    assert migrated.location_rating('city-mall') == (4, 1, 2, 1)
+    assert migrated.get_feedback('f1')['text'] == 'Холодный'
+    # Файлы json-хранилища остаются резервной копией
+    assert (tmp_path / 'users.snap').read_bytes() == snapshot_bytes
+
+    # Повторный запуск не переносит данные второй раз
+    migrated.set_rating(1, 'degtyarev', 'drink', 1)
+    migrated.close()
+    assert open_storage(tmp_path, backend='sqlite').location_rating('degtyarev') == (4, 2, 4, 1)
+
+
+def test_sqlite_adds_inactive_column(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'users.db')
+    conn.executescript("""
+        CREATE TABLE users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL DEFAULT '',
+            first_name TEXT NOT NULL DEFAULT '',
+            last_name TEXT NOT NULL DEFAULT ''
+        );
+        INSERT INTO users (user_id, username) VALUES (1, 'anna'), (2, 'boris');
+    """)
+    conn.close()
+
+    storage = open_storage(tmp_path, backend='sqlite')
+    assert storage.count_users() == (2, 0)
+    storage.set_active(2, False)
+    assert list(storage.iter_user_ids(active_only=True)) == ['1']
+    assert dict(storage.iter_users())['2'] == {
+        'username': 'boris', 'first_name': '', 'last_name': '', 'inactive': True
+    }
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_migrate_name_keys(tmp_path, backend):
+    storage = open_storage(tmp_path, backend=backend)
+    history = RatingHistory(str(tmp_path / 'history.bin'), utc_offset=0)
+    history.load()
+    storage.set_rating(1, 'Дегтярев', 'drink', 5)
+    storage.set_rating(1, 'Дегтярев', 'service', 4)
+    storage.set_rating(2, 'Сити Молл', 'drink', 3)
+    history.record(1, 'Дегтярев', 'drink', 5)
+    registry = LocationRegistry([
+        {'id': 'degtyarev', 'name': 'Дегтярев'},
+        {'id': 'city-mall', 'name': 'Сити Молл'},
+        {'id': 'new', 'name': 'Новая'},
+    ])
+
+    migrate_name_keys(registry, storage, history)
+    migrate_name_keys(registry, storage, history)
+    storage.close()
+    history.close()
+
+    reloaded = open_storage(tmp_path, backend=backend)
+    assert reloaded.location_rating('degtyarev') == (5, 1, 4, 1)
+    assert reloaded.location_rating('city-mall') == (3, 1, 0, 0)
+    assert reloaded.location_rating('Дегтярев') == (0, 0, 0, 0)
+    assert reloaded.get_rating(1, 'degtyarev') == {'location': 'degtyarev', 'drink_rating': 5, 'service_rating': 4}
+    history = RatingHistory(str(tmp_path / 'history.bin'), utc_offset=0)
+    history.load()
+    assert history.locations == ['degtyarev']
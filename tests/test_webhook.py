@@ -0,0 +1,107 @@
+"""Webhook mode end to end: raw HTTP requests through http_server into the update queue"""
+import json
+import asyncio
+
+from webhook import SECRET_HEADER, WebhookServer
+
+SECRET = 's3cret'
+UPDATE = {
+    'update_id': 1001,
+    'message': {
+        'message_id': 5,
+        'date': 1709510400,
+        'chat': {'id': 42, 'type': 'private'},
+        'from': {'id': 42, 'is_bot': False, 'first_name': 'Анна'},
+        'text': '/start',
+    },
+}
+
+
+class FakeApplication:
+    bot = None
+
+    def __init__(self):
+        self.update_queue = asyncio.Queue()
+
+
+async def request(port, method='POST', path='/hook', body=b'', headers=None):
+    """Send one request on a fresh connection, return (status, response headers)"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    lines = [f'{method} {path} HTTP/1.1', 'Host: localhost', 'Connection: close']
+    if method == 'POST':
+        lines.append(f'Content-Length: {len(body)}')
+    lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8') + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    status_line, _, rest = response.partition(b'\r\n')
+    return int(status_line.split()[1]), rest
+
+
+def run(scenario, path='hook', secret_token=SECRET):
+    async def main():
+        application = FakeApplication()
+        server = WebhookServer(application, '127.0.0.1', 0, path, secret_token)
+        await server.start()
+        try:
+            return await scenario(server.port, application)
+        finally:
+            await server.stop()
+    return asyncio.run(main())
+
+
+def test_accepted_update():
+    async def scenario(port, application):
+        status, _ = await request(port, body=json.dumps(UPDATE).encode('utf-8'), headers={SECRET_HEADER: SECRET})
+        return status, application.update_queue.get_nowait()
+
+    status, update = run(scenario)
+    assert status == 200
+    assert update.update_id == 1001
+    assert update.message.text == '/start'
+    assert update.effective_user.id == 42
+
+
+def test_keep_alive_connection():
+    async def scenario(port, application):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        statuses = []
+        for update_id in (1, 2):
+            body = json.dumps(dict(UPDATE, update_id=update_id)).encode('utf-8')
+            writer.write(
+                f'POST /hook HTTP/1.1\r\nContent-Length: {len(body)}\r\n{SECRET_HEADER}: {SECRET}\r\n\r\n'
+                .encode('ascii') + body
+            )
+            await writer.drain()
+            statuses.append(int((await reader.readline()).split()[1]))
+            while (await reader.readline()) != b'\r\n':
+                pass
+        writer.close()
+        return statuses, [application.update_queue.get_nowait().update_id for _ in range(2)]
+
+    assert run(scenario) == ([200, 200], [1, 2])
+
+
+def test_rejected_requests():
+    body = json.dumps(UPDATE).encode('utf-8')
+
+    async def scenario(port, application):
+        statuses = [
+            (await request(port, body=body, headers={SECRET_HEADER: 'wrong'}))[0],
+            (await request(port, body=body))[0],
+            (await request(port, path='/other', body=body, headers={SECRET_HEADER: SECRET}))[0],
+            (await request(port, method='GET', headers={SECRET_HEADER: SECRET}))[0],
+            (await request(port, body=b'{"update_id": ', headers={SECRET_HEADER: SECRET}))[0],
+        ]
+        return statuses, application.update_queue.qsize()
+
+    assert run(scenario) == ([403, 403, 404, 405, 400], 0)
+
+
+def test_without_secret_token():
+    async def scenario(port, application):
+        status, _ = await request(port, body=json.dumps(UPDATE).encode('utf-8'))
+        return status, application.update_queue.qsize()
+
+    assert run(scenario, '/hook', None) == (200, 1)
@@ -0,0 +1,67 @@
+"""Background flushing of storage changes"""
+import asyncio
+import threading
+
+import pytest
+
+from storage import WriteBehind, create_storage
+
+
+def open_storage(tmp_path, backend):
+    storage = create_storage(
+        backend, str(tmp_path / 'users.snap'), str(tmp_path / 'users.journal'),
+        str(tmp_path / 'feedbacks.jsonl'), str(tmp_path / 'users.db')
+    )
+    storage.load()
+    return storage
+
+
+@pytest.mark.parametrize('backend', ('json', 'sqlite'))
+def test_stop_runs_final_flush(tmp_path, backend):
+    storage = open_storage(tmp_path, backend)
+
+    async def main():
+        writer = WriteBehind(storage, interval_ms=60000)
+        writer.start()
+        storage.upsert_user(1, {'username': 'anna'})
+        storage.set_rating(1, 'degtyarev', 'drink', 5)
+        await asyncio.sleep(0.01)
+        await writer.stop()
+        assert storage.on_dirty is None
+
+    asyncio.run(main())
+    # Без close(): всё нужное должно быть записано финальным flush
+    reloaded = open_storage(tmp_path, backend)
+    assert reloaded.location_rating('degtyarev') == (5, 1, 0, 0)
+    assert reloaded.get_user(1)['username'] == 'anna'
+
+
+def test_writes_during_flush_are_not_lost(tmp_path):
+    storage = open_storage(tmp_path, 'json')
+    flushing = threading.Event()
+    release = threading.Event()
+    flush = storage.flush
+
+    def slow_flush():
+        # Записи после этой точки в текущий flush уже не попадут
+        flush()
+        flushing.set()
+        release.wait(5)
+
+    storage.flush = slow_flush
+
+    async def main():
+        writer = WriteBehind(storage, interval_ms=1, max_pending=1)
+        writer.start()
+        storage.upsert_user(1, {'username': 'anna'})
+        await asyncio.to_thread(flushing.wait, 5)
+        # Изменения и остановка приходят, пока первый flush ещё идёт
+        storage.set_rating(1, 'degtyarev', 'drink', 4)
+        stop = asyncio.create_task(writer.stop())
+        await asyncio.sleep(0.01)
+        release.set()
+        await stop
+
+    asyncio.run(main())
+    reloaded = open_storage(tmp_path, 'json')
+    assert reloaded.get_rating(1, 'degtyarev') == {'location': 'degtyarev', 'drink_rating': 4}
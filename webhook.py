@@ -0,0 +1,92 @@
+import hmac
+import json
+import signal
+import asyncio
+import logging
+
+from telegram import Update
+
+from http_server import HttpServer, Response
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+
+class WebhookServer(HttpServer):
+    """HTTP server that feeds Telegram webhook updates to the application
+
+    Only POST requests to path are accepted. When secret_token is set, the
+    X-Telegram-Bot-Api-Secret-Token header must match it. Updates are put on
+    application.update_queue and answered right away; handlers run as usual.
+    """
+
+    def __init__(self, application, host, port, path, secret_token=None):
+        super().__init__(host, port)
+        self.application = application
+        self.path = path if path.startswith('/') else f'/{path}'
+        self.secret_token = secret_token
+
+    async def start(self):
+        await super().start()
+        logger.info(f"Webhook server listening on {self.host}:{self.port}, path {self.path}")
+
+    async def handle(self, request):
+        if request.path != self.path:
+            return Response(404)
+        if request.method != 'POST':
+            return Response(405)
+        if self.secret_token and not hmac.compare_digest(
+                request.headers.get(SECRET_HEADER, '').encode('utf-8'), self.secret_token.encode('utf-8')):
+            logger.warning("Rejected webhook request with invalid secret token")
+            return Response(403)
+
+        try:
+            update = Update.de_json(json.loads(request.body), self.application.bot)
+        except Exception as e:
+            logger.error(f"Invalid webhook update: {e}")
+            return Response(400)
+
+        await self.application.update_queue.put(update)
+        return Response(200)
+
+
+async def run_webhook(application, server, webhook_url=None, secret_token=None):
+    """Run the application fed by server until SIGINT/SIGTERM
+
+    Mirrors the lifecycle of Application.run_polling, including the post_init,
+    post_stop and post_shutdown hooks. If webhook_url is given, it is
+    registered with Telegram, otherwise the server only accepts local POSTs.
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        if webhook_url:
+            await application.bot.set_webhook(
+                webhook_url,
+                secret_token=secret_token or None,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            logger.info(f"Webhook set to {webhook_url}")
+        await application.start()
+        await server.start()
+        await stop_event.wait()
+    finally:
+        # Вебхук не удаляем: пока бот перезапускается, Telegram копит обновления
+        await server.stop()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)